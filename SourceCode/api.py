@@ -0,0 +1,349 @@
+import json
+import time
+import random
+import numpy as np
+import pandas as pd
+import simpy
+from datetime import datetime
+from collections import OrderedDict
+from consumer import Consumer
+from email_object import Email_Object
+from simulation import Simulation
+from sharding import derive_seed
+from star_schema import WIDE_COLUMNS
+from random_streams import RandomStreams
+from catalog import RunCatalog, create_record
+import random_streams
+
+"""
+Library API of the simulation without prompts and without file output.
+
+simulate(parameters) runs one simulation in memory and returns a SimulationResult
+with the synthetic dataset and the aggregates. Parameters missing in the request
+fall back to DEFAULT_PARAMETERS, which mirror the default config.cfg.
+
+Generator keeps populations (consumers and purchase list), mailing calendars,
+opening tables and results of previous requests in memory, so that a warm
+worker (see service.py) only pays the setup cost once per distinct parameter set.
+Every stage is seeded with a seed derived from the request seed, so a result
+does not depend on which stages came from the cache.
+
+With "random_streams": true every random source of a stage draws from a named
+substream (see random_streams.py), so requests with the same seed share their
+random numbers across scenarios. "antithetic": true mirrors all draws.
+"""
+
+DEFAULT_PARAMETERS = {"consumer_amount": 10000,
+                      "simulation_time_days": 365,
+                      "timestep_size": 1,
+                      "share_buyers": 0.03,
+                      "mailing_frequency_per_month": {"01": 7, "02": 7, "03": 9, "04": 8, "05": 8, "06": 7, "07": 7, "08": 7, "09": 8, "10": 7, "11": 7, "12": 8},
+                      "buying_frequency_per_month": {"01": 0.05, "02": 0.05, "03": 0.2, "04": 0.05, "05": 0.2, "06": 0.0, "07": 0.0, "08": 0.0, "09": 0.2, "10": 0.0, "11": 0.05, "12": 0.2},
+                      "signup_rate_per_month": 0.0,
+                      "unsubscribe_rate_per_month": 0.0,
+                      "opening_coefficients": None,
+                      "opening_model": None,
+                      "opening_history_window": 0,
+                      "segment": "",
+                      "seed": 0,
+                      "random_streams": False,
+                      "antithetic": False}
+WEEKDAY_NAMES = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
+
+# Seed stages derived from the request seed
+POPULATION_STAGE = 0
+CALENDAR_STAGE = 1
+RUN_STAGE = 2
+
+def check_parameters(parameters):
+        """
+        Checks the ranges of the simulation parameters, so that invalid requests fail before the simulation starts.
+
+        Args
+        -------
+        parameters:                     Complete parameters of a request.
+
+        Returns
+        -------
+        None
+
+        """
+        for name in ["consumer_amount", "simulation_time_days", "timestep_size"]:
+                if isinstance(parameters[name], bool) or not isinstance(parameters[name], int) or parameters[name] < 1:
+                        raise ValueError("%s has to be a positive integer." % name)
+        for name in ["share_buyers", "signup_rate_per_month", "unsubscribe_rate_per_month"]:
+                if isinstance(parameters[name], bool) or not isinstance(parameters[name], (int, float)) or not 0 <= parameters[name] <= 1:
+                        raise ValueError("%s has to be between 0 and 1." % name)
+        for name in ["mailing_frequency_per_month", "buying_frequency_per_month"]:
+                if not isinstance(parameters[name], dict) or any(isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 for value in parameters[name].values()):
+                        raise ValueError("%s has to map months to non-negative numbers." % name)
+
+class SimulationResult:
+        def __init__(self, simulation, parameters, cached, seconds=None):
+                """
+                Initilizes the result with the dataset and the aggregates of a finished simulation.
+
+                Args
+                -------
+                simulation:             Simulation object after simulation_process.
+                parameters:             Complete parameters of the run.
+                cached:                 Names of the stages that were taken from the cache.
+                seconds:                Duration of the request.
+
+                Returns
+                -------
+                None
+
+                """
+                self.parameters = parameters
+                self.cached = cached
+                self.seconds = seconds
+                self.batches = simulation.campaign_batches
+                self.rows = sum(len(batch) for batch in self.batches)
+                self.consumers = len(np.unique(np.concatenate([batch.columns["consumerID"] for batch in self.batches]))) if self.batches else 0
+                self.frame = None
+                self.opening_data = list(simulation.opening_data)
+                self.global_opening_data = list(simulation.global_opening_data)
+                self.global_timespan_data = list(simulation.global_timespan_data)
+                self.mailings_per_month = dict(simulation.mailings_per_month)
+                self.purchases_per_month = dict(simulation.purchases_per_month)
+                self.signups_per_month = dict(simulation.signups_per_month)
+                self.unsubscribes_per_month = dict(simulation.unsubscribes_per_month)
+                self.device_recipients = dict(simulation.device_recipients)
+                self.device_openings = dict(simulation.device_openings)
+                self.population = simulation.population
+                self.opening_rate = float(np.mean([rate for _, rate in self.opening_data])) if self.opening_data else 0.0
+
+        @property
+        def dataset(self):
+                """ Synthetic dataset of the run. It is built from the campaign batches when it is first read."""
+                if self.frame is None:
+                        self.frame = pd.concat([batch.frame() for batch in self.batches], ignore_index=True) if self.batches else pd.DataFrame(columns=WIDE_COLUMNS)
+                        self.batches = None
+                return self.frame
+
+        def arrays(self):
+                """
+                Returns the columns of the synthetic dataset as numpy arrays.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                arrays:                 Dictionary of column names and arrays.
+
+                """
+                return {column: self.dataset[column].to_numpy() for column in self.dataset.columns}
+
+        def history(self, window=5):
+                """
+                Returns the behavior history features of the consumers that are subscribed at the end of the run.
+
+                Args
+                -------
+                window:                 Amount of last received emails for recent openings (1 to 64).
+
+                Returns
+                -------
+                history:                DataFrame with consumerID, received and opened emails, openings among the last window emails and current opening streak.
+
+                """
+                population = self.population
+                index = population.active_index()
+                sent, opened = population.count_history(index)
+                return pd.DataFrame({"consumerID": population.consumer_id[index],
+                                     "Erhaltene E-Mails": sent,
+                                     "Geöffnete E-Mails": opened,
+                                     "Öffnungen letzte %d E-Mails" % window: population.count_recent_openings(index, window),
+                                     "Öffnungsserie": population.calculate_streak(index)})
+
+        def record(self, source="api"):
+                """
+                Returns the catalog record of the run, see catalog.create_record.
+
+                Args
+                -------
+                source:                 Origin of the run.
+
+                Returns
+                -------
+                record:                 Record for RunCatalog.insert.
+
+                """
+                return create_record(self, self.parameters, source, self.seconds, self.parameters["seed"])
+
+        def aggregates(self):
+                """
+                Returns the aggregates of the run as JSON-serializable dictionary.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                aggregates:             Dictionary of opening rate, counters per month and opening rates per campaign.
+
+                """
+                return {"rows": self.rows,
+                        "consumers": self.consumers,
+                        "mailings": len(self.opening_data),
+                        "opening_rate": self.opening_rate,
+                        "mailings_per_month": self.mailings_per_month,
+                        "purchases_per_month": self.purchases_per_month,
+                        "signups_per_month": self.signups_per_month,
+                        "unsubscribes_per_month": self.unsubscribes_per_month,
+                        "opening_data": [(date.isoformat(), rate) for date, rate in self.opening_data]}
+
+class Generator:
+        def __init__(self, cache_size=8, catalog_path=""):
+                """
+                Initilizes the caches of the generator.
+
+                Args
+                -------
+                cache_size:             Amount of entries kept per cache (populations, calendars, opening tables, results). 0 disables caching.
+                catalog_path:           SQLite file of the run catalog in which every simulated (not cached) result is stored. Empty disables the catalog.
+
+                Returns
+                -------
+                None
+
+                """
+                self.cache_size = cache_size
+                self.catalog = RunCatalog(catalog_path) if catalog_path else None
+                self.caches = {"population": OrderedDict(), "calendar": OrderedDict(), "opening_table": OrderedDict(), "result": OrderedDict()}
+
+        def cached(self, name, key, create):
+                """
+                Returns an entry of a cache or creates and stores it. Least recently used entries are evicted.
+
+                Args
+                -------
+                name:                   Name of the cache.
+                key:                    Key of the entry.
+                create:                 Function that creates the entry.
+
+                Returns
+                -------
+                entry:                  Cached or created entry.
+                hit:                    True if the entry was cached.
+
+                """
+                cache = self.caches[name]
+                if key in cache:
+                        cache.move_to_end(key)
+                        return cache[key], True
+                entry = create()
+                self.store(name, key, entry)
+                return entry, False
+
+        def store(self, name, key, entry):
+                """ Stores an entry in a cache and evicts the least recently used entries."""
+                cache = self.caches[name]
+                cache[key] = entry
+                cache.move_to_end(key)
+                while len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+
+        def simulate(self, parameters=None):
+                """
+                Runs a simulation in memory with the given parameters.
+
+                Args
+                -------
+                parameters:             Dictionary of parameters, see DEFAULT_PARAMETERS. Missing entries fall back to the defaults.
+
+                Returns
+                -------
+                result:                 SimulationResult of the run.
+
+                """
+                parameters = dict(DEFAULT_PARAMETERS, **(parameters or {}))
+                unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+                if unknown:
+                        raise ValueError("Unknown simulation parameters: %s." % ", ".join(sorted(unknown)))
+                check_parameters(parameters)
+                seed = parameters["seed"]
+                start = time.perf_counter()
+                # Calendars and purchase dates are relative to today, so cached entries expire at midnight.
+                today = datetime.now().date().isoformat()
+                result_key = (json.dumps(parameters, sort_keys=True), today)
+                if result_key in self.caches["result"]:
+                        self.caches["result"].move_to_end(result_key)
+                        return self.caches["result"][result_key]
+
+                def stage_streams(stage):
+                        np.random.seed(derive_seed(seed, stage))
+                        random.seed(derive_seed(seed, stage))
+                        return RandomStreams(derive_seed(seed, stage), parameters["antithetic"]) if parameters["random_streams"] else None
+
+                def create_population():
+                        with random_streams.use(stage_streams(POPULATION_STAGE)):
+                                consumers = Consumer.create_consumers(parameters["consumer_amount"])
+                                purchase_list = Consumer.create_purchase_list(parameters["simulation_time_days"], parameters["buying_frequency_per_month"], parameters["share_buyers"], consumers, parameters["timestep_size"])
+                        return consumers, purchase_list
+
+                def create_calendar():
+                        with random_streams.use(stage_streams(CALENDAR_STAGE)):
+                                return Email_Object.create_mailing_list(parameters["simulation_time_days"], parameters["mailing_frequency_per_month"], parameters["timestep_size"])
+
+                population_key = json.dumps([parameters[name] for name in ["consumer_amount", "simulation_time_days", "timestep_size", "share_buyers", "buying_frequency_per_month", "seed", "random_streams", "antithetic"]], sort_keys=True) + today
+                calendar_key = json.dumps([parameters[name] for name in ["simulation_time_days", "timestep_size", "mailing_frequency_per_month", "seed", "random_streams", "antithetic"]], sort_keys=True) + today
+                (consumers, purchase_list), population_hit = self.cached("population", population_key, create_population)
+                mailing_list, calendar_hit = self.cached("calendar", calendar_key, create_calendar)
+
+                simulation = Simulation(interactive=False, options={"ml_export_path": "",
+                                                                    "output_mode": "wide",
+                                                                    "run_artifact_path": "",
+                                                                    "output_pipeline": False,
+                                                                    "event_log_path": "",
+                                                                    "latent_state_path": "",
+                                                                    "analysis_mode": "exact",
+                                                                    "simulation_mode": "individual",
+                                                                    "cohort_sample_size": 0,
+                                                                    "signup_rate_per_month": parameters["signup_rate_per_month"],
+                                                                    "unsubscribe_rate_per_month": parameters["unsubscribe_rate_per_month"],
+                                                                    "compaction_threshold": 0.25,
+                                                                    "behavior_history": True,
+                                                                    "opening_history_window": parameters["opening_history_window"],
+                                                                    "progress_interval_seconds": 0,
+                                                                    "metrics_path": "",
+                                                                    "segment": parameters["segment"],
+                                                                    "opening_coefficients": parameters["opening_coefficients"],
+                                                                    "opening_model": parameters["opening_model"]})
+                simulation.campaign_batches = []
+                table_key = json.dumps([parameters["opening_coefficients"], parameters["opening_model"], parameters["opening_history_window"]], sort_keys=True)
+                simulation.opening_table = self.caches["opening_table"].get(table_key)
+                table_hit = simulation.opening_table is not None
+
+                with random_streams.use(stage_streams(RUN_STAGE)):
+                        env = simpy.Environment()
+                        env.process(simulation.simulation_process(env, WEEKDAY_NAMES, parameters["consumer_amount"], parameters["mailing_frequency_per_month"], parameters["buying_frequency_per_month"],
+                                                                  parameters["share_buyers"], parameters["simulation_time_days"], parameters["timestep_size"], (consumers, purchase_list, mailing_list)))
+                        env.run()
+                self.store("opening_table", table_key, simulation.opening_table)
+
+                cached = [name for name, hit in [("population", population_hit), ("calendar", calendar_hit), ("opening_table", table_hit)] if hit]
+                result = SimulationResult(simulation, parameters, cached, time.perf_counter() - start)
+                self.store("result", result_key, result)
+                if self.catalog is not None:
+                        self.catalog.insert([result.record()])
+                return result
+
+def simulate(parameters=None):
+        """
+        Runs a simulation in memory without prompts and without file output.
+
+        Args
+        -------
+        parameters:                     Dictionary of parameters, see DEFAULT_PARAMETERS. Missing entries fall back to the defaults.
+
+        Returns
+        -------
+        result:                         SimulationResult with the synthetic dataset and the aggregates.
+
+        """
+        return Generator(cache_size=0).simulate(parameters)
@@ -0,0 +1,376 @@
+import copy
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, skew, kurtosis
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+from event_log import hash_uniform
+from sharding import derive_seed
+from star_schema import WIDE_COLUMNS
+
+"""
+Approximate analysis of the synthetic dataset in constant memory.
+
+Instead of keeping all rows for data_analysis, the AnalysisSampler is an output of
+the campaigns and keeps:
+- a sample of consumers with the first row of every sampled consumer;
+- a sample of interactions (rows);
+- a quantile sketch of the age per device over all rows;
+- one row per campaign for the email attributes (exact).
+
+Both samples are bottom-k samples: every consumer (every row) gets a priority
+derived from a hash of consumerID (and emailID) and the seed, and the k smallest
+priorities are kept. This is a uniform sample without replacement of the distinct
+consumers, so no set of seen consumers is needed, and the k-th priority estimates
+the amount of distinct consumers (KMV estimator). The priorities do not change the
+random state of the run.
+
+The quantile sketch keeps counts of logarithmic buckets (DDSketch). Every
+quantile is returned with a relative error of at most accuracy, and the amount of
+buckets only grows with the logarithm of the value range.
+
+The statistics of the consumer sample are reported with 95% confidence intervals.
+"""
+
+CONSUMER_SALT = 1
+INTERACTION_SALT = 2
+CONFIDENCE = 0.95
+
+class RowSample:
+        def __init__(self, size, seed=0, distinct_consumers=False):
+                """
+                Initilizes an empty bottom-k sample of rows.
+
+                Args
+                -------
+                size:                   Amount of kept rows.
+                seed:                   Seed of the priorities.
+                distinct_consumers:     Samples consumers with their first row if True, rows otherwise.
+
+                Returns
+                -------
+                None
+
+                """
+                if size < 2:
+                        raise ValueError("The sample size of the analysis has to be at least 2.")
+                self.size = size
+                self.seed = seed
+                self.distinct_consumers = distinct_consumers
+                self.priorities = np.zeros(0, dtype=np.float64)
+                # Column arrays of the kept rows: the batch columns and the attributes of their emails
+                self.columns = None
+
+        def __len__(self):
+                return len(self.priorities)
+
+        def threshold(self):
+                """ Returns the highest kept priority once the sample is full, 1 otherwise."""
+                if len(self) < self.size:
+                        return 1.0
+                return float(self.priorities.max())
+
+        def write_batch(self, batch):
+                """
+                Keeps the rows of a campaign whose priorities are among the size smallest of the kept and the new rows.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                consumer_ids = batch.columns["consumerID"]
+                priorities = hash_uniform(consumer_ids, 0 if self.distinct_consumers else batch.email_id, self.seed)
+                selected = priorities < self.threshold()
+                if self.distinct_consumers and self.columns is not None:
+                        # Only the first row of a sampled consumer is kept
+                        selected &= ~np.isin(consumer_ids, self.columns["consumerID"])
+                selected = np.flatnonzero(selected)
+                if len(selected) == 0:
+                        return
+                kept = np.arange(len(self))
+                candidates = np.concatenate([self.priorities, priorities[selected]])
+                if len(candidates) > self.size:
+                        # Only the size smallest priorities of the kept and the new rows survive
+                        survivors = np.sort(np.argpartition(candidates, self.size - 1)[:self.size])
+                        kept = survivors[survivors < len(self)]
+                        selected = selected[survivors[survivors >= len(self)] - len(self)]
+                        candidates = candidates[survivors]
+                self.priorities = candidates
+                new_columns = {name: column[selected] for name, column in batch.columns.items()}
+                new_columns.update({"emailID": np.full(len(selected), batch.email_id, dtype=np.int64),
+                                    "Anzahl Wörter in Betreffzeile": np.full(len(selected), batch.length),
+                                    "Informationsgehalt": np.full(len(selected), batch.information_value),
+                                    "Versandtag": np.full(len(selected), batch.sending_day, dtype=object),
+                                    "Simulationszeit": np.full(len(selected), batch.current_time, dtype=object)})
+                if self.columns is None:
+                        self.columns = new_columns
+                else:
+                        self.columns = {name: np.concatenate([column[kept], new_columns[name]]) for name, column in self.columns.items()}
+
+        def frame(self):
+                """
+                Returns the sampled rows in order of appearance.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                df:                     DataFrame of the sampled rows.
+
+                """
+                if self.columns is None:
+                        return pd.DataFrame(columns=WIDE_COLUMNS)
+                columns = self.columns
+                personalization = np.full(len(self), False, dtype=object)
+                personalization[columns["Produktkauf"]] = "Produktbasierte Personalisierung"
+                return pd.DataFrame({"consumerID": columns["consumerID"],
+                                     "Alter": columns["Alter"],
+                                     "Geschlecht": np.array(GENDER_CATEGORIES, dtype=object)[columns["Geschlecht"]],
+                                     "Einkommen": columns["Einkommen"],
+                                     "Informative Wahrnehmung": columns["Informative Wahrnehmung"],
+                                     "Frequenz": columns["Frequenz"],
+                                     "Zeitspanne vorherige E-Mail": columns["Zeitspanne vorherige E-Mail"],
+                                     "Produktkauf": columns["Produktkauf"],
+                                     "Öffnung vorherige E-Mail": columns["Öffnung vorherige E-Mail"],
+                                     "Endgerät": np.array(DEVICE_CATEGORIES, dtype=object)[columns["Endgerät"]],
+                                     "emailID": columns["emailID"],
+                                     "Anzahl Wörter in Betreffzeile": columns["Anzahl Wörter in Betreffzeile"],
+                                     "Informationsgehalt": columns["Informationsgehalt"],
+                                     "Personalisierung": personalization,
+                                     "Versandtag": columns["Versandtag"],
+                                     "Simulationszeit": pd.to_datetime(columns["Simulationszeit"]),
+                                     "Öffnung": np.where(columns["Öffnung"], "Ja", "Nein")})
+
+        def estimate_total(self):
+                """
+                Estimates the amount of distinct consumers (rows) from the k-th priority.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                total:                  Estimated amount, exact if the sample is not full.
+                relative_error:         Relative standard error of the estimate, 0 if exact.
+
+                """
+                if len(self) < self.size:
+                        return len(self), 0.0
+                return (self.size - 1) / self.threshold(), 1 / np.sqrt(self.size - 2)
+
+class QuantileSketch:
+        def __init__(self, accuracy=0.01):
+                """
+                Initilizes an empty sketch with logarithmic buckets.
+
+                Args
+                -------
+                accuracy:               Highest relative error of the quantiles.
+
+                Returns
+                -------
+                None
+
+                """
+                if not 0 < accuracy < 1:
+                        raise ValueError("The accuracy of the quantile sketch has to be between 0 and 1.")
+                self.accuracy = accuracy
+                self.gamma = (1 + accuracy) / (1 - accuracy)
+                self.counts = {}
+                self.zeros = 0
+
+        def add(self, values):
+                """
+                Counts non-negative values in their buckets.
+
+                Args
+                -------
+                values:                 Array of values.
+
+                Returns
+                -------
+                None
+
+                """
+                values = np.asarray(values, dtype=np.float64)
+                if (values < 0).any():
+                        raise ValueError("The quantile sketch only counts non-negative values.")
+                self.zeros += int(np.count_nonzero(values == 0))
+                keys, amount = np.unique(np.ceil(np.log(values[values > 0]) / np.log(self.gamma)).astype(np.int64), return_counts=True)
+                for key, count in zip(keys.tolist(), amount.tolist()):
+                        self.counts[key] = self.counts.get(key, 0) + count
+
+        def __len__(self):
+                return self.zeros + sum(self.counts.values())
+
+        def value_counts(self):
+                """
+                Returns the representative value and count of every bucket.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                values:                 Array of representative values in ascending order.
+                counts:                 Array of counts per value.
+
+                """
+                keys = np.array(sorted(self.counts), dtype=np.int64)
+                values = 2 * self.gamma ** keys.astype(np.float64) / (self.gamma + 1)
+                counts = np.array([self.counts[key] for key in keys.tolist()], dtype=np.int64)
+                if self.zeros:
+                        values = np.concatenate([[0.0], values])
+                        counts = np.concatenate([[self.zeros], counts])
+                return values, counts
+
+        def quantile(self, quantile):
+                """
+                Returns a quantile of the counted values with a relative error of at most accuracy.
+
+                Args
+                -------
+                quantile:               Quantile between 0 and 1.
+
+                Returns
+                -------
+                value:                  Approximate quantile.
+
+                """
+                values, counts = self.value_counts()
+                if len(values) == 0:
+                        raise ValueError("The quantile sketch is empty.")
+                return float(values[np.searchsorted(np.cumsum(counts), quantile * (counts.sum() - 1), side="right")])
+
+class AnalysisSampler:
+        def __init__(self, sample_size=10000, accuracy=0.01, seed=0):
+                """
+                Initilizes the samples and sketches of the approximate analysis.
+
+                Args
+                -------
+                sample_size:            Amount of sampled consumers and of sampled interactions.
+                accuracy:               Highest relative error of the quantile sketches.
+                seed:                   Seed of the priorities, e.g. of the random streams.
+
+                Returns
+                -------
+                None
+
+                """
+                self.consumers = RowSample(sample_size, derive_seed(seed, CONSUMER_SALT), distinct_consumers=True)
+                self.interactions = RowSample(sample_size, derive_seed(seed, INTERACTION_SALT))
+                self.device_ages = {device: QuantileSketch(accuracy) for device in DEVICE_CATEGORIES}
+                self.mails = []
+                self.rows = 0
+
+        def write_batch(self, batch):
+                """
+                Adds a campaign to the samples and sketches.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                if len(batch) == 0:
+                        return
+                self.rows += len(batch)
+                self.consumers.write_batch(batch)
+                self.interactions.write_batch(batch)
+                for device_index, device in enumerate(DEVICE_CATEGORIES):
+                        self.device_ages[device].add(batch.columns["Alter"][batch.columns["Endgerät"] == device_index])
+                first = copy.copy(batch)
+                first.columns = {name: column[:1] for name, column in batch.columns.items()}
+                self.mails.extend(first.rows())
+
+        def mail_frame(self):
+                """ Returns the first row of every campaign, like drop_duplicates("emailID")."""
+                return pd.DataFrame(self.mails, columns=WIDE_COLUMNS)
+
+        def device_age_counts(self):
+                """
+                Returns the row counts of the age buckets per device.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                counts:                 Series of row counts with an (Endgerät, Alter) index, see Simulation.device_age_boxes.
+
+                """
+                index = []
+                counts = []
+                for device, sketch in self.device_ages.items():
+                        values, amount = sketch.value_counts()
+                        index.extend((device, value) for value in values.tolist())
+                        counts.extend(amount.tolist())
+                return pd.Series(counts, index=pd.MultiIndex.from_tuples(index, names=["Endgerät", "Alter"]), dtype=np.int64)
+
+def describe_sample(values, population_size):
+        """
+        Computes statistics of a sample with 95% confidence intervals.
+
+        Args
+        -------
+        values:                         Array of sampled values.
+        population_size:                Amount of values the sample was drawn from, for the finite population correction of the mean. Intervals are empty if the sample contains all values.
+
+        Returns
+        -------
+        statistics:                     Dictionary of mean, standard deviation, median, skewness and kurtosis with (estimate, lower, upper) each.
+
+        """
+        values = np.sort(np.asarray(values, dtype=np.float64))
+        n = len(values)
+        # A sample of the whole population gives exact statistics
+        z = norm.ppf(0.5 + CONFIDENCE / 2) if population_size > n else 0.0
+        correction = np.sqrt(1 - n / population_size) if population_size > n else 0.0
+        mean = values.mean()
+        std = values.std(ddof=1)
+        # Distribution-free interval of the median from order statistics
+        lower_rank = int(max(np.floor(n / 2 - z * np.sqrt(n) / 2), 0))
+        upper_rank = int(min(np.ceil(n / 2 + z * np.sqrt(n) / 2), n - 1))
+        median = float(np.median(values))
+        statistics = {"mean": (mean, z * std / np.sqrt(n) * correction),
+                      # Variance of the sample variance with the excess kurtosis of the sample
+                      "std": (std, z * std / 2 * np.sqrt(2 / (n - 1) + max(kurtosis(values), 0) / n)),
+                      "skewness": (skew(values), z * np.sqrt(6 / n)),
+                      "kurtosis": (kurtosis(values), z * np.sqrt(24 / n))}
+        statistics = {name: (float(value), float(value - half_width), float(value + half_width)) for name, (value, half_width) in statistics.items()}
+        statistics["median"] = (median, float(values[lower_rank]), float(values[upper_rank])) if z > 0 else (median, median, median)
+        return statistics
+
+def correlation_interval(x, y, population_size):
+        """
+        Computes the correlation of two sampled columns with the 95% confidence interval of the Fisher transformation.
+
+        Args
+        -------
+        x, y:                           Arrays of sampled values.
+        population_size:                Amount of pairs the sample was drawn from. The interval is empty if the sample contains all pairs.
+
+        Returns
+        -------
+        correlation:                    Tuple of estimate, lower and upper bound.
+
+        """
+        correlation = float(np.corrcoef(x, y)[0, 1])
+        if len(x) < 4 or abs(correlation) == 1 or population_size <= len(x):
+                return correlation, correlation, correlation
+        half_width = norm.ppf(0.5 + CONFIDENCE / 2) / np.sqrt(len(x) - 3)
+        return correlation, float(np.tanh(np.arctanh(correlation) - half_width)), float(np.tanh(np.arctanh(correlation) + half_width))
@@ -0,0 +1,252 @@
+import json
+import copy
+import numpy as np
+from datetime import timedelta
+from consumer import Consumer, DEVICE_CATEGORIES
+from email_object import Email_Object
+from opening_table import OpeningTable, DEFAULT_COEFFICIENTS
+from cohort import CohortSimulation, check_cohort_options
+
+"""
+Calibration of the opening-model coefficients against target opening rates.
+
+Each candidate set of coefficients is evaluated with the cohort-aggregated
+simulation. Cohorts, mailing calendars and purchase schedules of a few replications
+are drawn once and reused for every evaluation, because opening rates vary strongly
+between calendars. The purchase draws are reseeded per evaluation
+(common random numbers), so that two candidates only differ by their coefficients.
+The coefficient space is searched with a compass (pattern) search, which does not
+need gradients of the rounded opening decisions. The search stops as soon as every
+target is met within the tolerance.
+
+Targets are given as JSON, e.g.
+{"overall": 0.3, "month": {"2024-05": 0.32}, "device": {"Mobil": 0.35, "Desktop": 0.1}}
+"""
+
+TARGET_GROUPS = ["overall", "month", "device"]
+
+def read_coefficients(file_path):
+        """
+        Reads opening-model coefficients, e.g. the output of a calibration.
+
+        Args
+        -------
+        file_path:                      Path of a JSON file with the coefficients, optionally nested under "coefficients".
+
+        Returns
+        -------
+        coefficients:                   Dictionary of coefficients that replace DEFAULT_COEFFICIENTS.
+
+        """
+        with open(file_path, encoding="utf-8") as file:
+                coefficients = json.load(file)
+        coefficients = coefficients.get("coefficients", coefficients)
+        unknown = set(coefficients) - set(DEFAULT_COEFFICIENTS)
+        if unknown:
+                raise ValueError("Unknown opening-model coefficients: %s." % ", ".join(sorted(unknown)))
+        return coefficients
+
+class Calibration:
+        def __init__(self, simulation, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size, seed=0, replications=5):
+                """
+                Initilizes the class and creates cohorts, mailing calendars and purchase schedules for all evaluations.
+
+                Args
+                -------
+                simulation:             Non-interactive Simulation object.
+                consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size
+                seed:                   Seed of the cohorts, the calendars and the purchase draws.
+                replications:           Amount of calendars with own cohorts and purchase schedule that are averaged per evaluation.
+
+                Returns
+                -------
+                None
+
+                """
+                check_cohort_options(simulation.options)
+                np.random.seed(seed)
+                self.seed = seed
+                self.consumer_amount = consumer_amount
+                self.evaluations = 0
+                # Evaluations run on a copy, so the device counters of simulation do not change
+                self.cohort_simulation = CohortSimulation(copy.copy(simulation))
+                self.cohort_simulation.rng = np.random.default_rng(seed)
+
+                self.replications = [self.create_replication(simulation, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size) for _ in range(replications)]
+                self.max_frequency = max(max_frequency for max_frequency, _, _ in self.replications)
+
+        def create_replication(self, simulation, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size):
+                """
+                Creates mailing calendar, purchase schedule and cohorts of one replication.
+
+                Args
+                -------
+                simulation, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size
+
+                Returns
+                -------
+                max_frequency:          Highest mailing frequency in 30 days of the calendar.
+                counts:                 Counts of consumers with axes (perception, purchase, prior opening, device).
+                timeline:               List of (year_month, email or None, timespan, frequency, purchases) for every day with dispatch or purchases.
+
+                """
+                mailing_list = Email_Object.create_mailing_list(simulation_time_days, mailing_frequency_per_month, timestep_size)
+                max_frequency = Email_Object.calculate_max_frequency(mailing_list)
+                counts = self.cohort_simulation.create_cohorts(self.consumer_amount, OpeningTable(max_frequency))
+                purchase_schedule = {date.strftime("%Y-%m-%d"): purchases for date, purchases in Consumer.create_purchase_schedule(simulation_time_days, buying_frequency_per_month, round(self.consumer_amount * share_buyers), timestep_size)}
+                mailing_dates = {date: email for email, date in mailing_list}
+
+                """
+                Frequency and timespan are the same for all consumers and do not depend on the coefficients.
+                """
+                time_past, _, _, _, end_time, current_time, _, _, _ = simulation.initialize_simulation_parameters(simulation_time_days)
+                timeline = []
+                mailing_days = []
+                while current_time.date() < end_time.date():
+                        time_past += timestep_size
+                        current_time += timedelta(days=timestep_size)
+                        date = current_time.strftime("%Y-%m-%d")
+                        email = mailing_dates.get(date)
+                        frequency = sum(1 for day in mailing_days if day >= time_past - 30)
+                        timespan = time_past - mailing_days[-1] if mailing_days else 0
+                        if email is not None:
+                                mailing_days.append(time_past)
+                        purchases = purchase_schedule.get(date, 0)
+                        if email is not None or purchases > 0:
+                                timeline.append((current_time.strftime("%Y-%m"), email, timespan, frequency, purchases))
+                return max_frequency, counts, timeline
+
+        def evaluate(self, coefficients):
+                """
+                Runs the aggregated simulation of all replications with a set of coefficients.
+
+                Args
+                -------
+                coefficients:           Dictionary of opening-model coefficients.
+
+                Returns
+                -------
+                fit:                    Dictionary with the average campaign opening rate ("overall") and the opening rates per month and per device over all replications.
+
+                """
+                self.evaluations += 1
+                cohort_simulation = self.cohort_simulation
+                cohort_simulation.opening_table = OpeningTable(self.max_frequency, coefficients)
+                cohort_simulation.rng = np.random.default_rng(self.seed)
+                cohort_simulation.simulation.device_recipients = {}
+                cohort_simulation.simulation.device_openings = {}
+                campaign_opening_rates = []
+                month_opens, month_recipients = {}, {}
+                device_opens = np.zeros(len(DEVICE_CATEGORIES), dtype=np.int64)
+                device_recipients = np.zeros(len(DEVICE_CATEGORIES), dtype=np.int64)
+
+                for _, counts, timeline in self.replications:
+                        for year_month, email, timespan, frequency, purchases in timeline:
+                                if email is not None:
+                                        device_recipients += counts.sum(axis=(0, 1, 2))
+                                        counts, opens = cohort_simulation.email_dispatch(counts, email, timespan, frequency)
+                                        device_opens += counts[:, :, 1, :].sum(axis=(0, 1))
+                                        month_opens[year_month] = month_opens.get(year_month, 0) + opens
+                                        month_recipients[year_month] = month_recipients.get(year_month, 0) + self.consumer_amount
+                                        campaign_opening_rates.append(opens / self.consumer_amount)
+                                if purchases > 0:
+                                        counts = cohort_simulation.product_purchase(counts, None, purchases, 0)
+
+                return {"overall": float(np.mean(campaign_opening_rates)) if campaign_opening_rates else 0.0,
+                        "month": {year_month: month_opens[year_month] / month_recipients[year_month] for year_month in month_opens},
+                        "device": {device: float(device_opens[i] / device_recipients[i]) if device_recipients[i] > 0 else 0.0 for i, device in enumerate(DEVICE_CATEGORIES)}}
+
+        def deviations(self, fit, targets):
+                """
+                Compares a fit with the targets.
+
+                Args
+                -------
+                fit:                    Result of evaluate.
+                targets:                Dictionary of target opening rates with the structure of a fit.
+
+                Returns
+                -------
+                deviations:             Dictionary of simulated minus target opening rate per target.
+
+                """
+                deviations = {}
+                for group in TARGET_GROUPS:
+                        if group not in targets:
+                                continue
+                        if group == "overall":
+                                deviations["overall"] = fit["overall"] - targets["overall"]
+                                continue
+                        for key, target in targets[group].items():
+                                if key not in fit[group]:
+                                        raise ValueError("Target %s %s is not covered by the simulation period." % (group, key))
+                                deviations["%s %s" % (group, key)] = fit[group][key] - target
+                return deviations
+
+        def fit(self, targets, parameters, tolerance=0.005, max_evaluations=500, initial_step=0.5, min_step=0.001, initial_coefficients=None):
+                """
+                Searches the coefficients with a compass search until all targets are met within the tolerance.
+
+                Args
+                -------
+                targets:                Dictionary of target opening rates, see module description.
+                parameters:             Names of the coefficients to fit, e.g. ["intercept", "device"]. Coefficients with several values are fitted per value.
+                tolerance:              Highest accepted absolute deviation of every target.
+                max_evaluations:        Highest amount of evaluations.
+                initial_step:           Initial step size of the search.
+                min_step:               Step size at which the search stops.
+                initial_coefficients:   Coefficients to start from. DEFAULT_COEFFICIENTS if None.
+
+                Returns
+                -------
+                result:                 Dictionary with the fitted coefficients and the achieved fit.
+
+                """
+                if not targets or any(group not in TARGET_GROUPS for group in targets):
+                        raise ValueError("Targets have to be given for %s." % ", ".join(TARGET_GROUPS))
+                coefficients = copy.deepcopy(dict(DEFAULT_COEFFICIENTS, **(initial_coefficients or {})))
+                positions = []
+                for name in parameters:
+                        if name not in DEFAULT_COEFFICIENTS:
+                                raise ValueError("Unknown opening-model coefficient: %s." % name)
+                        if isinstance(coefficients[name], list):
+                                positions += [(name, i) for i in range(len(coefficients[name]))]
+                        else:
+                                positions.append((name, None))
+
+                def assess(coefficients):
+                        fit = self.evaluate(coefficients)
+                        deviations = self.deviations(fit, targets)
+                        return fit, deviations, sum(deviation**2 for deviation in deviations.values())
+
+                def within_tolerance(deviations):
+                        return max(abs(deviation) for deviation in deviations.values()) <= tolerance
+
+                fit, deviations, loss = assess(coefficients)
+                step = initial_step
+                while not within_tolerance(deviations) and step >= min_step and self.evaluations < max_evaluations:
+                        improved = False
+                        for name, i in positions:
+                                for direction in (1, -1):
+                                        candidate = copy.deepcopy(coefficients)
+                                        if i is None:
+                                                candidate[name] = round(candidate[name] + direction * step, 6)
+                                        else:
+                                                candidate[name][i] = round(candidate[name][i] + direction * step, 6)
+                                        candidate_fit, candidate_deviations, candidate_loss = assess(candidate)
+                                        if candidate_loss < loss:
+                                                coefficients, fit, deviations, loss = candidate, candidate_fit, candidate_deviations, candidate_loss
+                                                improved = True
+                                                break
+                                if within_tolerance(deviations) or self.evaluations >= max_evaluations:
+                                        break
+                        if not improved:
+                                step /= 2
+
+                return {"coefficients": coefficients,
+                        "fit": {"converged": within_tolerance(deviations),
+                                "max_deviation": max(abs(deviation) for deviation in deviations.values()),
+                                "evaluations": self.evaluations,
+                                "deviations": deviations,
+                                "simulated": fit,
+                                "targets": targets}}
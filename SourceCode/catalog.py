@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+import subprocess
+from datetime import datetime
+from consumer import DEVICE_CATEGORIES
+
+"""
+Embedded run catalog in a local SQLite file.
+
+Every run is stored with its parameters, seed, version of the simulator, timing
+and aggregates in three tables:
+        runs            One row per run. Frequently queried parameters have own columns,
+                        all parameters are kept as JSON in the column parameters.
+        run_months      Mailings, purchases, signups, unsubscribes and opening rate per run and month.
+        run_devices     Recipients, openings and opening rate per run and device.
+Indexes on (parameter, opening_rate) support queries like "all runs with
+share_buyers > 0.05 sorted by opening rate" without a table scan. Records of a
+sweep are inserted in one transaction.
+
+Usage: python catalog.py <catalog> query [--where "share_buyers > 0.05" ...] [--order-by opening_rate] [--ascending] [--limit 20]
+       python catalog.py <catalog> show <run_id>
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+        run_id INTEGER PRIMARY KEY,
+        created TEXT NOT NULL,
+        version TEXT NOT NULL,
+        source TEXT NOT NULL,
+        run_path TEXT,
+        seed INTEGER,
+        seconds REAL,
+        consumer_amount INTEGER,
+        simulation_time_days INTEGER,
+        timestep_size INTEGER,
+        share_buyers REAL,
+        signup_rate_per_month REAL,
+        unsubscribe_rate_per_month REAL,
+        simulation_mode TEXT,
+        segment TEXT,
+        parameters TEXT NOT NULL,
+        recipients INTEGER,
+        mailings INTEGER,
+        purchases INTEGER,
+        opening_rate REAL);
+CREATE TABLE IF NOT EXISTS run_months (
+        run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+        month TEXT NOT NULL,
+        mailings INTEGER,
+        purchases INTEGER,
+        signups INTEGER,
+        unsubscribes INTEGER,
+        opening_rate REAL,
+        PRIMARY KEY (run_id, month)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS run_devices (
+        run_id INTEGER NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+        device TEXT NOT NULL,
+        recipients INTEGER,
+        openings INTEGER,
+        opening_rate REAL,
+        PRIMARY KEY (run_id, device)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_opening_rate ON runs (opening_rate);
+CREATE INDEX IF NOT EXISTS runs_share_buyers ON runs (share_buyers, opening_rate);
+CREATE INDEX IF NOT EXISTS runs_consumer_amount ON runs (consumer_amount, opening_rate);
+CREATE INDEX IF NOT EXISTS runs_rates ON runs (signup_rate_per_month, unsubscribe_rate_per_month, opening_rate);
+CREATE INDEX IF NOT EXISTS runs_seed ON runs (seed);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+CREATE INDEX IF NOT EXISTS run_months_month ON run_months (month, opening_rate);
+CREATE INDEX IF NOT EXISTS run_devices_device ON run_devices (device, opening_rate);
+"""
+RUN_COLUMNS = ["run_id", "created", "version", "source", "run_path", "seed", "seconds", "consumer_amount", "simulation_time_days", "timestep_size", "share_buyers",
+               "signup_rate_per_month", "unsubscribe_rate_per_month", "simulation_mode", "segment", "parameters", "recipients", "mailings", "purchases", "opening_rate"]
+PARAMETER_COLUMNS = ["consumer_amount", "simulation_time_days", "timestep_size", "share_buyers", "signup_rate_per_month", "unsubscribe_rate_per_month", "simulation_mode", "segment"]
+OPERATORS = ["=", "!=", "<", "<=", ">", ">="]
+CONDITION_PATTERN = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.+?)\s*$")
+
+version = None
+
+def simulator_version():
+        """
+        Returns the git commit of the simulator, or "unknown" outside of a git checkout.
+
+        Args
+        -------
+        None
+
+        Returns
+        -------
+        version:                        Short commit hash.
+
+        """
+        global version
+        if version is None:
+                try:
+                        version = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=5).stdout.strip() or "unknown"
+                except (OSError, subprocess.SubprocessError):
+                        version = "unknown"
+        return version
+
+def create_record(results, parameters, source, seconds=None, seed=None, run_path=""):
+        """
+        Creates a catalog record from the counters and time series of a run.
+
+        Args
+        -------
+        results:                        Simulation or SimulationResult with opening_data, the counters per month and device_recipients / device_openings.
+        parameters:                     Dictionary of the parameters of the run, e.g. consumer_amount and share_buyers.
+        source:                         Origin of the run, e.g. "run", "api" or "comparison".
+        seconds:                        Duration of the run.
+        seed:                           Seed of the run. None for unseeded runs.
+        run_path:                       Folder of the run artifacts.
+
+        Returns
+        -------
+        record:                         Dictionary with the columns of runs and the lists months and devices.
+
+        """
+        campaign_rates = {}
+        for date, rate in results.opening_data:
+                campaign_rates.setdefault(date.strftime("%Y-%m"), []).append(rate)
+        record = {"created": datetime.now().isoformat(),
+                  "version": simulator_version(),
+                  "source": source,
+                  "run_path": run_path,
+                  "seed": seed,
+                  "seconds": seconds,
+                  "parameters": json.dumps(parameters, sort_keys=True, default=str),
+                  "recipients": int(sum(results.device_recipients.values())),
+                  "mailings": len(results.opening_data),
+                  "purchases": int(sum(results.purchases_per_month.values())),
+                  "opening_rate": sum(rate for _, rate in results.opening_data) / len(results.opening_data) if results.opening_data else None}
+        record.update({name: parameters.get(name) for name in PARAMETER_COLUMNS})
+        record["months"] = [{"month": month,
+                             "mailings": results.mailings_per_month.get(month, 0),
+                             "purchases": results.purchases_per_month.get(month, 0),
+                             "signups": results.signups_per_month.get(month, 0),
+                             "unsubscribes": results.unsubscribes_per_month.get(month, 0),
+                             "opening_rate": sum(campaign_rates[month]) / len(campaign_rates[month]) if month in campaign_rates else None}
+                            for month in sorted(set(results.mailings_per_month) | set(campaign_rates))]
+        record["devices"] = [{"device": device,
+                              "recipients": results.device_recipients.get(device, 0),
+                              "openings": results.device_openings.get(device, 0),
+                              "opening_rate": results.device_openings.get(device, 0) / results.device_recipients[device] if results.device_recipients.get(device, 0) > 0 else None}
+                             for device in DEVICE_CATEGORIES]
+        return record
+
+class RunCatalog:
+        def __init__(self, catalog_path):
+                """
+                Opens or creates the catalog file.
+
+                Args
+                -------
+                catalog_path:           Path of the SQLite file.
+
+                Returns
+                -------
+                None
+
+                """
+                directory = os.path.dirname(os.path.abspath(catalog_path))
+                os.makedirs(directory, exist_ok=True)
+                self.connection = sqlite3.connect(catalog_path)
+                self.connection.row_factory = sqlite3.Row
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+                self.connection.execute("PRAGMA foreign_keys=ON")
+                self.connection.executescript(SCHEMA)
+
+        def insert(self, records):
+                """
+                Inserts records in one transaction, e.g. all runs of a sweep.
+
+                Args
+                -------
+                records:                List of records of create_record.
+
+                Returns
+                -------
+                run_ids:                List of the run_ids of the records.
+
+                """
+                columns = [column for column in RUN_COLUMNS if column != "run_id"]
+                statement = "INSERT INTO runs (%s) VALUES (%s)" % (", ".join(columns), ", ".join("?" * len(columns)))
+                run_ids = []
+                months = []
+                devices = []
+                with self.connection:
+                        for record in records:
+                                run_id = self.connection.execute(statement, [record.get(column) for column in columns]).lastrowid
+                                run_ids.append(run_id)
+                                months.extend((run_id, month["month"], month["mailings"], month["purchases"], month["signups"], month["unsubscribes"], month["opening_rate"]) for month in record["months"])
+                                devices.extend((run_id, device["device"], device["recipients"], device["openings"], device["opening_rate"]) for device in record["devices"])
+                        self.connection.executemany("INSERT INTO run_months VALUES (?, ?, ?, ?, ?, ?, ?)", months)
+                        self.connection.executemany("INSERT INTO run_devices VALUES (?, ?, ?, ?, ?)", devices)
+                return run_ids
+
+        def query(self, conditions=(), order_by="opening_rate", descending=True, limit=None):
+                """
+                Selects runs by conditions on the columns of runs.
+
+                Args
+                -------
+                conditions:             List of (column, operator, value), e.g. [("share_buyers", ">", 0.05)].
+                order_by:               Column to sort by.
+                descending:             Sorts descending if True.
+                limit:                  Highest amount of runs. All runs if None.
+
+                Returns
+                -------
+                runs:                   List of dictionaries with the columns of runs.
+
+                """
+                for column in [column for column, _, _ in conditions] + [order_by]:
+                        if column not in RUN_COLUMNS:
+                                raise ValueError("Unknown catalog column %s. Known columns: %s." % (column, ", ".join(RUN_COLUMNS)))
+                for _, operator, _ in conditions:
+                        if operator not in OPERATORS:
+                                raise ValueError("Unknown operator %s. Known operators: %s." % (operator, " ".join(OPERATORS)))
+                statement = "SELECT * FROM runs"
+                if conditions:
+                        statement += " WHERE " + " AND ".join("%s %s ?" % (column, operator) for column, operator, _ in conditions)
+                statement += " ORDER BY %s %s" % (order_by, "DESC" if descending else "ASC")
+                values = [value for _, _, value in conditions]
+                if limit is not None:
+                        statement += " LIMIT ?"
+                        values.append(limit)
+                return [dict(row) for row in self.connection.execute(statement, values)]
+
+        def show(self, run_id):
+                """
+                Returns a run with its aggregates per month and device.
+
+                Args
+                -------
+                run_id:                 Id of the run.
+
+                Returns
+                -------
+                run:                    Dictionary with the columns of runs and the lists months and devices.
+
+                """
+                row = self.connection.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+                if row is None:
+                        raise ValueError("Run %d is not in the catalog." % run_id)
+                run = dict(row)
+                run["months"] = [dict(month) for month in self.connection.execute("SELECT month, mailings, purchases, signups, unsubscribes, opening_rate FROM run_months WHERE run_id = ? ORDER BY month", (run_id,))]
+                run["devices"] = [dict(device) for device in self.connection.execute("SELECT device, recipients, openings, opening_rate FROM run_devices WHERE run_id = ?", (run_id,))]
+                return run
+
+        def close(self):
+                """ Closes the connection."""
+                self.connection.close()
+
+def parse_condition(condition):
+        """
+        Parses a condition like "share_buyers > 0.05".
+
+        Args
+        -------
+        condition:                      Condition as text.
+
+        Returns
+        -------
+        condition:                      Tuple of column, operator and value (number if possible).
+
+        """
+        match = CONDITION_PATTERN.match(condition)
+        if match is None:
+                raise ValueError("Invalid condition %s. Expected <column> <operator> <value>." % condition)
+        column, operator, value = match.groups()
+        try:
+                value = float(value)
+        except ValueError:
+                value = value.strip("\"'")
+        return column, operator, value
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Query the run catalog.")
+        parser.add_argument("catalog", help="Path of the catalog file.")
+        subparsers = parser.add_subparsers(dest="command", required=True)
+        query_parser = subparsers.add_parser("query", help="List runs matching conditions.")
+        query_parser.add_argument("--where", action="append", default=[], help="Condition like \"share_buyers > 0.05\". Can be repeated.")
+        query_parser.add_argument("--order-by", default="opening_rate", help="Column to sort by.")
+        query_parser.add_argument("--ascending", action="store_true", help="Sort ascending.")
+        query_parser.add_argument("--limit", type=int, default=None, help="Highest amount of runs.")
+        show_parser = subparsers.add_parser("show", help="Show a run with its aggregates per month and device.")
+        show_parser.add_argument("run_id", type=int, help="Id of the run.")
+        arguments = parser.parse_args()
+
+        catalog = RunCatalog(arguments.catalog)
+        if arguments.command == "query":
+                runs = catalog.query([parse_condition(condition) for condition in arguments.where], arguments.order_by, not arguments.ascending, arguments.limit)
+                for run in runs:
+                        print(run["run_id"], run["created"], run["source"], "consumer_amount=%s" % run["consumer_amount"], "share_buyers=%s" % run["share_buyers"], "seed=%s" % run["seed"], "opening_rate=%s" % run["opening_rate"])
+        else:
+                print(json.dumps(catalog.show(arguments.run_id), indent=4, ensure_ascii=False))
+        catalog.close()
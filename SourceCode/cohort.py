@@ -0,0 +1,281 @@
+import numpy as np
+from datetime import timedelta
+from types import SimpleNamespace
+from scipy import integrate
+from scipy.stats import norm, gamma
+from consumer import Consumer, GENDER_CATEGORIES, GENDER_PROBABILITIES, DEVICE_CATEGORIES, correlated_age_income_parameters
+from email_object import Email_Object
+from opening_table import OpeningTable
+from population import Population
+from telemetry import Telemetry
+
+"""
+Cohort-aggregated simulation for very large audiences.
+
+The opening reaction is deterministic given the discrete state of a consumer
+(informative perception, device, product purchase, prior email opening) and the
+mailing frequency and timespan, which are the same for every consumer because all
+consumers receive every email. Consumers with the same state are therefore tracked
+as counts instead of individuals, which gives exact aggregate opening rates and
+per-month statistics independent of the consumer amount.
+
+Segments, signups, unsubscribes and the opening history window give consumers
+individual calendars or states and are not simulated in cohort mode.
+"""
+
+# Integer age and income cells on which informative perception and device probabilities are constant.
+AGE_CELLS = [18, 20, 30, 40, 44, 50, 60, 70]
+INCOME_CELLS = [2083, 3792, 7583, 7584, 15167, 15168]
+UNSUPPORTED_OPTIONS = [("SEGMENT", "segment"), ("SIGNUP_RATE_PER_MONTH", "signup_rate_per_month"), ("UNSUBSCRIBE_RATE_PER_MONTH", "unsubscribe_rate_per_month"), ("OPENING_HISTORY_WINDOW", "opening_history_window")]
+
+def check_cohort_options(options):
+        """
+        Checks that no option is set that the cohort mode does not simulate.
+
+        Args
+        -------
+        options:                        Options of the simulation, see Simulation.read_options.
+
+        Returns
+        -------
+        None
+
+        """
+        unsupported = [name for name, option in UNSUPPORTED_OPTIONS if options[option]]
+        if unsupported:
+                raise ValueError("The cohort mode does not simulate %s. Unset these options or use the individual mode." % ", ".join(unsupported))
+
+class CohortSimulation:
+        def __init__(self, simulation, sample_size=0):
+                """
+                Initilizes the class.
+
+                Args
+                -------
+                simulation:             Simulation object that collects the results (opening_data, counters, rows of the sample).
+                sample_size:            Amount of individual consumers for which rows are materialized. 0 disables rows.
+
+                Returns
+                -------
+                None
+
+                """
+                self.simulation = simulation
+                self.sample_size = sample_size
+                self.rng = np.random.default_rng(np.random.randint(0, 2**31 - 1))
+
+        def cell_probabilities(self):
+                """
+                Calculates the probability of every age and income cell from the Gaussian copula
+                of generate_correlated_age_income. Samples are rounded to integers, so the cell
+                boundaries are shifted by 0.5.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                probabilities:          Matrix of probabilities with age cells as rows and income cells as columns.
+
+                """
+                correlation, (shape_age, scale_age, age_min), (shape_income, scale_income, income_min) = correlated_age_income_parameters()
+                age_bounds = [norm.ppf(gamma.cdf(cell - 0.5 - age_min, a=shape_age, scale=scale_age)) for cell in AGE_CELLS[1:]]
+                income_bounds = [norm.ppf(gamma.cdf(cell - 0.5 - income_min, a=shape_income, scale=scale_income)) for cell in INCOME_CELLS[1:]]
+                y_bounds = np.array([-np.inf] + age_bounds + [np.inf])
+                x_bounds = np.array([-np.inf] + income_bounds + [np.inf])
+
+                # Y = correlation * X + sqrt(1 - correlation^2) * Z, so P(X in [x0, x1), Y < y) is integrated over X.
+                residual = np.sqrt(1 - correlation**2)
+                probabilities = np.zeros((len(AGE_CELLS), len(INCOME_CELLS)))
+                for j in range(len(INCOME_CELLS)):
+                        for i in range(len(AGE_CELLS)):
+                                probabilities[i, j] = integrate.quad(lambda x: norm.pdf(x) * (norm.cdf((y_bounds[i + 1] - correlation * x) / residual) - norm.cdf((y_bounds[i] - correlation * x) / residual)),
+                                                                     x_bounds[j], x_bounds[j + 1], epsabs=1e-13, epsrel=1e-12)[0]
+                return probabilities / probabilities.sum()
+
+        def create_cohorts(self, consumer_amount, opening_table):
+                """
+                Draws the amount of consumers per static state (perception, device).
+                The counts follow the same distribution as Consumer.create_consumers.
+
+                Args
+                -------
+                consumer_amount:        Amount of consumers in the cohorts.
+                opening_table:          OpeningTable used to index the informative perception.
+
+                Returns
+                -------
+                counts:                 Counts of consumers with axes (perception, purchase, prior opening, device).
+
+                """
+                cells = []
+                probabilities = []
+                cell_probabilities = self.cell_probabilities()
+                for i, age in enumerate(AGE_CELLS):
+                        for j, income in enumerate(INCOME_CELLS):
+                                for gender, gender_probability in zip(GENDER_CATEGORIES, GENDER_PROBABILITIES):
+                                        consumer = SimpleNamespace(age=age, income=income, gender=gender)
+                                        perception = Consumer.generate_informative_perception(consumer)
+                                        for device, device_probability in enumerate(Consumer.device_probabilities(consumer)):
+                                                cells.append((perception, device))
+                                                probabilities.append(cell_probabilities[i, j] * gender_probability * device_probability)
+                probabilities = np.array(probabilities)
+                cell_counts = self.rng.multinomial(consumer_amount, probabilities / probabilities.sum())
+
+                counts = np.zeros((len(opening_table.perception_values), 2, 2, len(DEVICE_CATEGORIES)), dtype=np.int64)
+                perception_index = opening_table.perception_index([cell[0] for cell in cells])
+                for (perception, device), index, count in zip(cells, perception_index, cell_counts):
+                        counts[index, 0, 0, device] += count
+                return counts
+
+        def email_dispatch(self, counts, email, timespan, frequency):
+                """
+                Dispatches an email to all cohorts and updates prior email opening.
+
+                Args
+                -------
+                counts:                 Counts of consumers with axes (perception, purchase, prior opening, device).
+                email:                  Email that is sent to the consumers.
+                timespan:               Amount of days since last dispatch.
+                frequency:              Amount of emails in the last 30 days.
+
+                Returns
+                -------
+                counts:                 Updated counts.
+                opens:                  Amount of consumers that opened the email.
+
+                """
+                perception, purchase, prior, device = np.indices(counts.shape)
+                opening, _ = self.opening_table.decide(email, perception, np.full(counts.shape, timespan), np.full(counts.shape, frequency), purchase, prior, device)
+                opened_counts = counts * opening
+                updated_counts = np.zeros_like(counts)
+                updated_counts[:, :, 1, :] = opened_counts.sum(axis=2)
+                updated_counts[:, :, 0, :] = (counts - opened_counts).sum(axis=2)
+                self.simulation.count_device_openings(counts.sum(axis=(0, 1, 2)), opened_counts.sum(axis=(0, 1, 2)))
+                return updated_counts, int(opened_counts.sum())
+
+        def product_purchase(self, counts, sample, purchases, current_day):
+                """
+                Moves consumers without purchase into the purchase state.
+                Buyers are drawn uniformly from all consumers without purchase in cohorts and sample.
+
+                Args
+                -------
+                counts:                 Counts of consumers with axes (perception, purchase, prior opening, device).
+                sample:                 Population of the sample or None.
+                purchases:              Amount of purchases at the current day.
+                current_day:            Current day in simulation.
+
+                Returns
+                -------
+                counts:                 Updated counts.
+
+                """
+                sample_purchases = 0
+                if sample is not None:
+                        sample_candidates = np.flatnonzero(~sample.product_purchase)
+                        sample_purchases = self.rng.hypergeometric(len(sample_candidates), int(counts[:, 0].sum()), purchases) if purchases > 0 else 0
+                        if sample_purchases > 0:
+                                buyers = self.rng.choice(sample_candidates, sample_purchases, replace=False)
+                                sample.record_purchase(sample.consumer_id[buyers], current_day)
+                cohort_purchases = purchases - sample_purchases
+                if cohort_purchases > 0:
+                        candidates = counts[:, 0].reshape(-1)
+                        buyers = self.rng.multivariate_hypergeometric(candidates, cohort_purchases, method="marginals").reshape(counts[:, 0].shape)
+                        counts = counts.copy()
+                        counts[:, 0] -= buyers
+                        counts[:, 1] += buyers
+                return counts
+
+        def simulation_process(self, env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size):
+                """ Initializes cohorts, sample as well as email and purchase lists.
+                    Starts the cohort simulation with the timing routine of Simulation.simulation_process.
+
+                Args
+                -------
+                env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size
+
+                Returns
+                -------
+                None
+                """
+                simulation = self.simulation
+                time_past, opening_rate, total_mailings, total_purchases, end_time, current_time, year_month, email_dispatch, product_purchase = simulation.initialize_simulation_parameters(simulation_time_days)
+
+                """
+                Create mailing list, purchase schedule and opening table.
+                """
+                mailing_list = Email_Object.create_mailing_list(simulation_time_days, mailing_frequency_per_month, timestep_size)
+                max_frequency = Email_Object.calculate_max_frequency(mailing_list)
+                self.opening_table = OpeningTable(max_frequency, simulation.options["opening_coefficients"], spec=simulation.options["opening_model"])
+                self.opening_table.verify(simulation)
+                simulation.opening_table = self.opening_table
+                purchase_schedule = {date.strftime("%Y-%m-%d"): purchases for date, purchases in Consumer.create_purchase_schedule(simulation_time_days, buying_frequency_per_month, round(consumer_amount * share_buyers), timestep_size)}
+                mailing_dates = {date: email for email, date in mailing_list}
+
+                """
+                Create cohorts and sample of individual consumers.
+                """
+                sample_size = min(self.sample_size, consumer_amount)
+                sample = None
+                if sample_size > 0:
+                        sample_consumers = Consumer.create_consumers(consumer_amount=sample_size)
+                        sample = Population(sample_consumers, self.opening_table, max_frequency)
+                        if simulation.star_writer is not None:
+                                simulation.star_writer.write_consumers(sample_consumers)
+                                simulation.star_writer.write_emails(mailing_list, weekday_names, end_time)
+                counts = self.create_cohorts(consumer_amount - sample_size, self.opening_table)
+                mailing_days = []
+                telemetry = Telemetry((end_time.date() - current_time.date()).days, simulation.options["progress_interval_seconds"], simulation.options["metrics_path"])
+
+                while current_time.date() < end_time.date():
+                        time_past += timestep_size
+                        current_time += timedelta(days=timestep_size)
+                        date = current_time.strftime("%Y-%m-%d")
+                        year_month = current_time.strftime("%Y-%m")
+                        simulation.mailings_per_month[year_month] = simulation.mailings_per_month.get(year_month, 0)
+                        simulation.purchases_per_month[year_month] = simulation.purchases_per_month.get(year_month, 0)
+
+                        campaign_rows = 0
+                        if date in mailing_dates:
+                                email = mailing_dates[date]
+                                frequency = sum(1 for day in mailing_days if day >= time_past - 30)
+                                timespan = time_past - mailing_days[-1] if mailing_days else 0
+                                counts, opens = self.email_dispatch(counts, email, timespan, frequency)
+                                if sample is not None:
+                                        sample_opening_rate, batch = simulation.email_dispatch(sample, current_time, time_past, email, weekday_names)
+                                        opens += round(sample_opening_rate * len(sample))
+                                        simulation.write_campaign_rows(batch)
+                                mailing_days.append(time_past)
+                                campaign_opening_rate = opens / consumer_amount
+                                opening_rate += campaign_opening_rate
+                                simulation.opening_data.append((current_time.date(), campaign_opening_rate))
+                                total_mailings += 1
+                                simulation.mailings_per_month[year_month] += 1
+                                campaign_rows = consumer_amount
+
+                        if date in purchase_schedule:
+                                counts = self.product_purchase(counts, sample, purchase_schedule[date], time_past)
+                                simulation.purchases_per_month[year_month] += purchase_schedule[date]
+                                total_purchases += purchase_schedule[date]
+
+                        if total_mailings > 0:
+                                average_opening_rate = opening_rate / total_mailings
+                                simulation.global_opening_data.append((current_time.date(), average_opening_rate))
+                                simulation.global_timespan_data.append((current_time.date(), time_past / total_mailings))
+
+                        telemetry.update(time_past, int(date in mailing_dates), campaign_rows)
+
+                telemetry.close()
+                self.counts = counts
+                if simulation.verbose:
+                        print(  "Anzahl Mailings: ", total_mailings,
+                                "\nÖffnungsrate: ", average_opening_rate,
+                                "\nAnzahl Käufe: ", total_purchases,
+                                "\nAnzahl Simulationstage: ", time_past,
+                                "\nDurschnittliche Zeitspanne zur letzten E-Mail: ", time_past / total_mailings,
+                                "\nMailings pro Monat: ", simulation.mailings_per_month,
+                                "\nKäufe pro Monat: ", simulation.purchases_per_month)
+
+                yield env.timeout(1)
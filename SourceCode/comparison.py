@@ -0,0 +1,115 @@
+import json
+import argparse
+import numpy as np
+from scipy.stats import t
+from api import Generator
+from sharding import derive_seed
+from catalog import RunCatalog
+
+"""
+Replication runner for the comparison of two scenarios, e.g. two mailing frequency profiles.
+
+Every replication runs both scenarios with named random substreams. With common
+random numbers (default) both scenarios of a replication use the same seed, so
+they share consumers, email attributes and buyers, and the difference of a metric
+is measured on paired runs. With antithetic=True every replication is run a second
+time with mirrored draws and both runs are averaged.
+
+The report contains the mean difference (B - A) with standard error and 95%
+confidence interval over the replications, and the variance reduction
+(var(A) + var(B)) / var(B - A), i.e. the factor of replications that independent
+runs would need for the same confidence.
+
+Usage: python comparison.py <scenario-a.json> <scenario-b.json> [--replications 10] [--seed 0] [--antithetic] [--independent] [--metric opening_rate] [--output comparison.json] [--catalog catalog.sqlite]
+Scenario files contain parameters of api.DEFAULT_PARAMETERS.
+"""
+
+METRICS = {"opening_rate": lambda result: result.opening_rate,
+           "openings": lambda result: int(sum(result.device_openings.values())),
+           "rows": lambda result: result.rows}
+
+def compare(scenario_a, scenario_b, replications=10, seed=0, antithetic=False, common_random_numbers=True, metric="opening_rate", catalog_path=""):
+        """
+        Runs paired replications of two scenarios and estimates the difference of a metric.
+
+        Args
+        -------
+        scenario_a:                     Parameters of scenario A, see api.DEFAULT_PARAMETERS.
+        scenario_b:                     Parameters of scenario B.
+        replications:                   Amount of replications (pairs of runs). At least 2.
+        seed:                           Master seed of the replications.
+        antithetic:                     Averages every replication with its antithetic run if True.
+        common_random_numbers:          Uses the same seed for both scenarios of a replication if True, independent seeds otherwise.
+        metric:                         Name of the metric, see METRICS.
+        catalog_path:                   SQLite file of the run catalog in which all runs are stored in one transaction. Empty disables the catalog.
+
+        Returns
+        -------
+        report:                         Dictionary of the means, the mean difference, its standard error and confidence interval, the correlation and the variance reduction.
+
+        """
+        if replications < 2:
+                raise ValueError("At least 2 replications are required.")
+        if metric not in METRICS:
+                raise ValueError("Unknown metric %s. Known metrics: %s." % (metric, ", ".join(METRICS)))
+        # Paired scenarios share populations and calendars through the cache
+        generator = Generator(cache_size=4)
+        values = np.zeros((replications, 2))
+        records = []
+        for replication in range(replications):
+                replication_seed = derive_seed(seed, replication)
+                for scenario_index, scenario in enumerate([scenario_a, scenario_b]):
+                        scenario_seed = replication_seed if common_random_numbers else derive_seed(replication_seed, scenario_index + 1)
+                        runs = [generator.simulate(dict(scenario, seed=scenario_seed, random_streams=True, antithetic=mirrored)) for mirrored in ([False, True] if antithetic else [False])]
+                        values[replication, scenario_index] = np.mean([METRICS[metric](result) for result in runs])
+                        records.extend(result.record("comparison") for result in runs)
+        if catalog_path:
+                catalog = RunCatalog(catalog_path)
+                catalog.insert(records)
+                catalog.close()
+
+        differences = values[:, 1] - values[:, 0]
+        difference = float(differences.mean())
+        standard_error = float(differences.std(ddof=1) / np.sqrt(replications))
+        half_width = float(t.ppf(0.975, replications - 1) * standard_error)
+        difference_variance = differences.var(ddof=1)
+        independent_variance = values[:, 0].var(ddof=1) + values[:, 1].var(ddof=1)
+        return {"metric": metric,
+                "replications": replications,
+                "antithetic": antithetic,
+                "common_random_numbers": common_random_numbers,
+                "mean_a": float(values[:, 0].mean()),
+                "mean_b": float(values[:, 1].mean()),
+                "difference": difference,
+                "standard_error": standard_error,
+                "confidence_interval": [difference - half_width, difference + half_width],
+                "correlation": float(np.corrcoef(values[:, 0], values[:, 1])[0, 1]) if values.std(axis=0).min() > 0 else None,
+                "variance_reduction": float(independent_variance / difference_variance) if difference_variance > 0 else None}
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Compare two scenarios with paired replications.")
+        parser.add_argument("scenario_a", help="JSON file with the parameters of scenario A.")
+        parser.add_argument("scenario_b", help="JSON file with the parameters of scenario B.")
+        parser.add_argument("--replications", type=int, default=10, help="Amount of replications.")
+        parser.add_argument("--seed", type=int, default=0, help="Master seed of the replications.")
+        parser.add_argument("--antithetic", action="store_true", help="Average every replication with its antithetic run.")
+        parser.add_argument("--independent", action="store_true", help="Use independent seeds for the scenarios instead of common random numbers.")
+        parser.add_argument("--metric", default="opening_rate", choices=list(METRICS), help="Compared metric.")
+        parser.add_argument("--output", default="", help="Optional JSON file for the report.")
+        parser.add_argument("--catalog", default="", help="SQLite file of the run catalog for all runs.")
+        arguments = parser.parse_args()
+        scenarios = []
+        for path in [arguments.scenario_a, arguments.scenario_b]:
+                with open(path, encoding="utf-8") as file:
+                        scenarios.append(json.load(file))
+        report = compare(scenarios[0], scenarios[1], arguments.replications, arguments.seed, arguments.antithetic, not arguments.independent, arguments.metric, arguments.catalog)
+        if arguments.output:
+                with open(arguments.output, "w", encoding="utf-8") as file:
+                        json.dump(report, file, indent=4)
+        print(  "Mittelwert A: ", report["mean_a"],
+                "\nMittelwert B: ", report["mean_b"],
+                "\nDifferenz (B - A): ", report["difference"],
+                "\nStandardfehler: ", report["standard_error"],
+                "\n95%-Konfidenzintervall: ", report["confidence_interval"],
+                "\nKorrelation: ", report["correlation"],
+                "\nVarianzreduktion: ", report["variance_reduction"])
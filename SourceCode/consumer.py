@@ -1,8 +1,13 @@
-import random
 import numpy as np
 from datetime import datetime, timedelta
 from scipy.stats import norm, gamma
 from calendar import monthrange
+from types import SimpleNamespace
+import random_streams
+
+GENDER_CATEGORIES = ["Männlich", "Weiblich"]
+GENDER_PROBABILITIES = [0.59, 0.41]
+DEVICE_CATEGORIES = ["Mobil", "Desktop"]
 
 """ 
 Class Consumer with static attributes
@@ -75,9 +80,7 @@ class Consumer:
                 age_sample:                     Age sample of desired size. 
 
                 """
-                gender_categories = ["Männlich", "Weiblich"]
-                gender_probabilities = [0.59, 0.41]
-                gender = np.random.choice(gender_categories, p=gender_probabilities)
+                gender = random_streams.choice("gender", GENDER_CATEGORIES, GENDER_PROBABILITIES)
                 return gender
         
         def generate_device(self):
@@ -94,8 +97,30 @@ class Consumer:
                 device_influence: Regression coefficient of device with direct influence on OR.
 
                 """
-                device_categories = ["Mobil", "Desktop"]
-                device = "Desktop"
+                device_probabilities = self.device_probabilities()
+                device = random_streams.choice("device", DEVICE_CATEGORIES, device_probabilities)
+
+                device_influence = 0
+                if device == "Mobil":
+                        device_influence = 0.9
+                if device == "Desktop":
+                        device_influence = 0
+
+                return device, device_influence
+
+        def device_probabilities(self):
+                """ 
+                Defines probabilities of the device categories for the age of the consumer. 
+                
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                device_probabilities: Probabilities of "Mobil" and "Desktop".  
+
+                """
                 if self.age <= 19:
                         device_probabilities = [0.942, 0.058]
                 elif 20 <= self.age <= 29:
@@ -112,16 +137,7 @@ class Consumer:
                         device_probabilities = [0.682, 0.318]
                 else:
                         print("No device")
-
-                device = np.random.choice(device_categories, p=device_probabilities)
-
-                device_influence = 0
-                if device == "Mobil":
-                        device_influence = 0.9
-                if device == "Desktop":
-                        device_influence = 0
-
-                return device, device_influence
+                return device_probabilities
         
         def generate_informative_perception(self):
                 """ 
@@ -167,7 +183,7 @@ class Consumer:
                 informative_perception = age_perception + gender_perception + income_perception
                 return informative_perception
 
-        def create_consumers(consumer_amount):
+        def create_consumers(consumer_amount, first_consumer_id=1):
                 """ 
                 Creates consumer sample based on defined consumer_amount.
                 First correlated static attributes are generated. 
@@ -177,6 +193,7 @@ class Consumer:
                 Args
                 -------
                 consumer_amount: Amount of consumers in simulation defined by user.
+                first_consumer_id: ConsumerID of the first consumer, e.g. of a consumer-ID-range shard.
 
                 Returns
                 -------
@@ -192,10 +209,49 @@ class Consumer:
                 income_sample = np.round(correlated_age_income[1])
 
                 for i in range(0, consumer_amount):
-                        consumer = Consumer(i+1, int(age_sample[i]), int(income_sample[i]))
+                        consumer = Consumer(first_consumer_id+i, int(age_sample[i]), int(income_sample[i]))
                         consumers.append(consumer)
                 return consumers
                 
+        def generate_consumer_columns(consumer_amount, first_consumer_id):
+                """ 
+                Creates consumers in bulk as columns instead of Consumer objects, e.g. for signups.
+                Attributes follow the same distributions and rules as the Consumer class.
+                
+                Args
+                -------
+                consumer_amount:        Amount of consumers to create.
+                first_consumer_id:      ConsumerID of the first consumer.
+
+                Returns
+                -------
+                columns:                Dictionary of arrays consumer_id, age, income, gender, device 
+                                        (indexes of GENDER_CATEGORIES and DEVICE_CATEGORIES) and informative_perception.
+
+                """
+                correlated_age_income = generate_correlated_age_income(consumer_amount)
+                age = np.round(correlated_age_income[0]).astype(np.int64)
+                income = np.round(correlated_age_income[1]).astype(np.int64)
+                gender = random_streams.choice("gender", len(GENDER_CATEGORIES), GENDER_PROBABILITIES, consumer_amount).astype(np.int8)
+
+                # Device probabilities are looked up once per distinct age
+                ages, age_index = np.unique(age, return_inverse=True)
+                mobile_probability = np.array([Consumer.device_probabilities(SimpleNamespace(age=value))[0] for value in ages])[age_index.reshape(-1)]
+                device = (random_streams.uniform("device", consumer_amount) >= mobile_probability).astype(np.int8)
+
+                # Same thresholds as generate_informative_perception
+                age_perception = np.where(age < 44, 0, -1.2)
+                gender_perception = np.where(gender == GENDER_CATEGORIES.index("Männlich"), 0.3, 0)
+                income_perception = np.select([income < 3792, (income >= 3792) & (income < 7583), (income >= 7584) & (income < 15167), income > 15167], [0, 0.4, -0.1, -0.1], default=0)
+                informative_perception = age_perception + gender_perception + income_perception
+
+                return {"consumer_id": np.arange(first_consumer_id, first_consumer_id + consumer_amount, dtype=np.int64),
+                        "age": age,
+                        "income": income,
+                        "gender": gender,
+                        "device": device,
+                        "informative_perception": informative_perception}
+
         def create_purchase_list(simulation_time_days, buying_frequency_per_month, share_buyers, consumers, timestep_size):
                 """ 
                 Creates purchase list based on input parameters for whole simulation time.
@@ -215,10 +271,38 @@ class Consumer:
 
                 """
                 purchase_list = []
+                num_buyers = round(len(consumers) * share_buyers)
+                buyers = random_streams.sample("buyers", consumers, num_buyers)
+
+                purchases_made = 0
+                for current_time, purchases_per_day in Consumer.create_purchase_schedule(simulation_time_days, buying_frequency_per_month, num_buyers, timestep_size):
+                        for _ in range(purchases_per_day):
+                                buyer = buyers[purchases_made]
+                                purchase_list.append((buyer, current_time))
+                                purchases_made += 1
+
+                purchase_list.sort(key=lambda x: x[1])
+                return purchase_list
+
+        def create_purchase_schedule(simulation_time_days, buying_frequency_per_month, num_buyers, timestep_size):
+                """ 
+                Creates the amount of purchases per day for whole simulation time.
+                
+                Args
+                -------
+                simulation_time_days:           Counter  for simulation days
+                buying_frequency_per_month:     Specified buying frequency per month.
+                num_buyers:                     Amount of consumers who buy products.
+                timestep_size:                  Specified time step size.
+
+                Returns
+                -------
+                purchase_schedule:              List of dates with the amount of purchases at each date.
+
+                """
+                purchase_schedule = []
                 current_time = datetime.now() - timedelta(days=simulation_time_days)
                 end_time = datetime.now()
-                num_buyers = round(len(consumers) * share_buyers)
-                buyers = random.sample(consumers, num_buyers)
 
                 buyers_per_month = {k: round(num_buyers * v) for k, v in buying_frequency_per_month.items()}
 
@@ -238,16 +322,14 @@ class Consumer:
                         # Deduct the purchases of the current day from the total monthly purchases
                         buyers_per_month[month.split("-")[1]] -= purchases_per_day
 
-                        for _ in range(purchases_per_day):
-                                if purchases_made < num_buyers:
-                                        buyer = buyers[purchases_made]
-                                        purchase_list.append((buyer, current_time))
-                                        purchases_made += 1
+                        purchases_per_day = min(purchases_per_day, num_buyers - purchases_made) # Ensure not to exceed amount of buyers
+                        if purchases_per_day > 0:
+                                purchase_schedule.append((current_time, purchases_per_day))
+                                purchases_made += purchases_per_day
 
                         current_time += timedelta(days=timestep_size)
 
-                purchase_list.sort(key=lambda x: x[1])
-                return purchase_list
+                return purchase_schedule
         
         def calculate_frequency(dispatch_timestamps, current_time):
                 """ 
@@ -345,21 +427,22 @@ def generate_age(consumer_amount):
         #age_sample = truncated_skew_normal_kurt(age_mean, age_std, age_min, age_max, age_skewness, age_kurtosis, consumer_amount)
         return age_sample
                 
-def generate_correlated_age_income(consumer_amount):
+def correlated_age_income_parameters():
         """ 
-        Generates correlated age and income samples based on consumer amount. 
+        Defines the Gaussian copula of correlated age and income samples.
+        Age and income follow shifted gamma distributions of the normal variables Y and X.
 
         Args
         -------
-        consumer_amount:                Amount of consumers for desired size of age sample. 
+        None
 
         Returns
         -------
-        age_sample:                     Correlated age sample of desired size. 
-        income_sample:                  Correlated income sample of desired size. 
+        correlation_age_income:         Correlation of the normal variables X and Y.
+        age_parameters:                 Shape, scale and minimum of the age distribution.
+        income_parameters:              Shape, scale and minimum of the income distribution.
 
         """
-        size = consumer_amount
         correlation_age_income = 0.46
 
         income_min = 2083
@@ -376,8 +459,27 @@ def generate_correlated_age_income(consumer_amount):
         shape_age = (age_mean**2) / age_variance
         scale_age = age_variance / age_mean
 
-        X = np.random.normal(0, 1, size)
-        Y = correlation_age_income * X + np.sqrt(1 - correlation_age_income**2) * np.random.normal(0, 1, size)
+        return correlation_age_income, (shape_age, scale_age, age_min), (shape_income, scale_income, income_min)
+
+def generate_correlated_age_income(consumer_amount):
+        """ 
+        Generates correlated age and income samples based on consumer amount. 
+
+        Args
+        -------
+        consumer_amount:                Amount of consumers for desired size of age sample. 
+
+        Returns
+        -------
+        age_sample:                     Correlated age sample of desired size. 
+        income_sample:                  Correlated income sample of desired size. 
+
+        """
+        size = consumer_amount
+        correlation_age_income, (shape_age, scale_age, age_min), (shape_income, scale_income, income_min) = correlated_age_income_parameters()
+
+        X = random_streams.normal("age_income", size)
+        Y = correlation_age_income * X + np.sqrt(1 - correlation_age_income**2) * random_streams.normal("age_income", size)
 
         income_sample = gamma.ppf(norm.cdf(X), a=shape_income, scale=scale_income) + income_min
         age_sample = gamma.ppf(norm.cdf(Y), a=shape_age, scale=scale_age) + age_min
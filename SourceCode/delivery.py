@@ -0,0 +1,353 @@
+import time
+import asyncio
+import numpy as np
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+"""
+Delivery of the dispatched emails as real messages to an SMTP server, e.g. a local
+aiosmtpd sink, for load tests of the mail infrastructure.
+
+Every recipient of a campaign is rendered into an RFC 5322 message: the subject line has
+the amount of words of the email (Anzahl Wörter in Betreffzeile) and the body
+contains the product-based personalization if it was applied. Messages are sent
+with asyncio over a pool of persistent SMTP connections. With the PIPELINING
+extension (RFC 2920) MAIL FROM, RCPT TO and DATA are sent in one write. The pool
+size limits the amount of messages in flight, the rate limit the messages per second.
+"""
+
+SUBJECT_WORDS = ["Neue", "Angebote", "für", "Sie", "diese", "Woche", "entdecken", "Sie", "unsere", "Highlights", "jetzt", "exklusiv", "im", "Newsletter", "mit", "Rabatt"]
+LATENCY_PERCENTILES = [50, 90, 99]
+# Placeholders of the per-recipient header values in the rendered messages of a campaign
+RECIPIENT_PLACEHOLDER = b"recipient-placeholder@invalid"
+MESSAGE_ID_PLACEHOLDER = b"<message-id-placeholder@invalid>"
+
+class SMTPReplyError(Exception):
+        def __init__(self, code, text):
+                super().__init__("SMTP reply %d: %s" % (code, text))
+                self.code = code
+
+class SMTPConnection:
+        def __init__(self, host, port, timeout):
+                """
+                Initilizes the connection parameters. The connection is opened with open.
+
+                Args
+                -------
+                host:                   Host of the SMTP server.
+                port:                   Port of the SMTP server.
+                timeout:                Seconds to wait for a reply.
+
+                Returns
+                -------
+                None
+
+                """
+                self.host = host
+                self.port = port
+                self.timeout = timeout
+                self.reader = None
+                self.writer = None
+                self.pipelining = False
+
+        async def open(self):
+                """ Connects, reads the greeting and sends EHLO. A connection that fails the handshake is discarded."""
+                self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                try:
+                        self.expect(await self.read_reply(), 220)
+                        self.writer.write(b"EHLO email-simulation\r\n")
+                        await self.writer.drain()
+                        code, text = await self.read_reply()
+                        self.expect((code, text), 250)
+                except (SMTPReplyError, OSError, ConnectionError, asyncio.TimeoutError):
+                        self.discard()
+                        raise
+                self.pipelining = "PIPELINING" in text.upper().split()
+
+        async def read_reply(self):
+                """
+                Reads a (multiline) reply of the server.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                code:                   Reply code.
+                text:                   Reply text of all lines.
+
+                """
+                lines = []
+                while True:
+                        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+                        if not line:
+                                raise ConnectionError("SMTP server closed the connection.")
+                        line = line.decode("utf-8", "replace").rstrip("\r\n")
+                        if not (line[:3].isdigit() and line[3:4] in ("", " ", "-")):
+                                # Not an SMTP reply, the connection is discarded like a broken one
+                                raise ConnectionError("Malformed SMTP reply: %r" % line[:80])
+                        lines.append(line[4:])
+                        if line[3:4] != "-":
+                                return int(line[:3]), "\n".join(lines)
+
+        def expect(self, reply, *codes):
+                """ Raises SMTPReplyError if the reply code is not one of codes."""
+                code, text = reply
+                if code not in codes:
+                        raise SMTPReplyError(code, text)
+
+        async def send(self, sender, recipient, message):
+                """
+                Sends one message. Failed transactions are reset with RSET, so the connection can be reused.
+
+                Args
+                -------
+                sender:                 Envelope sender.
+                recipient:              Envelope recipient.
+                message:                Message as bytes with CRLF line endings.
+
+                Returns
+                -------
+                None
+
+                """
+                commands = [b"MAIL FROM:<%s>\r\n" % sender.encode(), b"RCPT TO:<%s>\r\n" % recipient.encode(), b"DATA\r\n"]
+                replies = []
+                if self.pipelining:
+                        self.writer.write(b"".join(commands))
+                        await self.writer.drain()
+                        for _ in commands:
+                                replies.append(await self.read_reply())
+                else:
+                        for command in commands:
+                                self.writer.write(command)
+                                await self.writer.drain()
+                                replies.append(await self.read_reply())
+                                if replies[-1][0] >= 400:
+                                        break
+                accepted = len(replies) == 3 and replies[0][0] == 250 and replies[1][0] in (250, 251) and replies[2][0] == 354
+                if not accepted:
+                        if replies[-1][0] == 354:
+                                # Data was accepted although a prior command failed, end it without content
+                                self.writer.write(b".\r\n")
+                                await self.writer.drain()
+                                await self.read_reply()
+                        self.writer.write(b"RSET\r\n")
+                        await self.writer.drain()
+                        await self.read_reply()
+                        code, text = next((reply for reply in replies if reply[0] >= 400), replies[-1])
+                        raise SMTPReplyError(code, text)
+                # Dot-stuffing of lines that start with a dot
+                message = message.replace(b"\r\n.", b"\r\n..")
+                if message.startswith(b"."):
+                        message = b"." + message
+                if not message.endswith(b"\r\n"):
+                        message += b"\r\n"
+                self.writer.write(message + b".\r\n")
+                await self.writer.drain()
+                self.expect(await self.read_reply(), 250)
+
+        async def close(self):
+                """ Sends QUIT and closes the connection."""
+                if self.writer is None:
+                        return
+                try:
+                        self.writer.write(b"QUIT\r\n")
+                        await self.writer.drain()
+                        await self.read_reply()
+                except (OSError, ConnectionError, asyncio.TimeoutError):
+                        pass
+                self.discard()
+
+        def discard(self):
+                """ Closes the socket without QUIT, e.g. of a broken connection, so it is reopened before the next message."""
+                if self.writer is not None:
+                        self.writer.close()
+                self.reader = None
+                self.writer = None
+
+class SMTPDelivery:
+        def __init__(self, host, port, connections=8, rate_per_second=0, sender="newsletter@example.com", recipient_domain="example.com", timeout=30):
+                """
+                Initilizes the delivery with an own event loop that keeps the connection pool open between campaigns.
+
+                Args
+                -------
+                host:                   Host of the SMTP server.
+                port:                   Port of the SMTP server.
+                connections:            Amount of pooled connections, i.e. messages in flight.
+                rate_per_second:        Highest amount of messages per second. 0 disables the rate limit.
+                sender:                 Sender address of the messages.
+                recipient_domain:       Domain of the recipient addresses consumer<consumerID>@recipient_domain.
+                timeout:                Seconds to wait for connections and replies.
+
+                Returns
+                -------
+                None
+
+                """
+                self.sender = sender
+                self.recipient_domain = recipient_domain
+                self.rate_per_second = rate_per_second
+                self.loop = asyncio.new_event_loop()
+                self.pool = [SMTPConnection(host, port, timeout) for _ in range(max(connections, 1))]
+                self.next_send_time = 0
+                self.latencies = []
+                self.sent = 0
+                self.failed = 0
+                self.sending_seconds = 0
+
+        def render_template(self, batch, subject, personalized):
+                """
+                Renders the email of a campaign once into an RFC 5322 message with placeholders for To and Message-ID.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+                subject:                Subject line of the campaign.
+                personalized:           True if the product-based personalization was applied.
+
+                Returns
+                -------
+                template:               Tuple of the message bytes before To, between To and Message-ID and after Message-ID.
+
+                """
+                message = EmailMessage(policy=policy.SMTP)
+                message["From"] = self.sender
+                message["To"] = RECIPIENT_PLACEHOLDER.decode()
+                message["Subject"] = subject
+                message["Date"] = format_datetime(batch.current_time)
+                message["Message-ID"] = MESSAGE_ID_PLACEHOLDER.decode()
+                message["X-Simulation-Email-ID"] = str(batch.email_id)
+                message["X-Simulation-Personalization"] = "Produktbasierte Personalisierung" if personalized else "False"
+                body = ["Hallo,", "", "in unserem Newsletter finden Sie die Neuheiten der Woche."]
+                if personalized:
+                        body += ["", "Passend zu Ihrem letzten Kauf empfehlen wir Ihnen diese Produkte."]
+                message.set_content("\n".join(body) + "\n")
+                head, rest = message.as_bytes().split(RECIPIENT_PLACEHOLDER, 1)
+                middle, tail = rest.split(MESSAGE_ID_PLACEHOLDER, 1)
+                return head, middle, tail
+
+        def render(self, template, email_id, consumer_id):
+                """
+                Renders the message of one consumer by splicing recipient and Message-ID into the template of the campaign.
+
+                Args
+                -------
+                template:               Template of render_template.
+                email_id:               ID of the email of the campaign.
+                consumer_id:            ID of the recipient consumer.
+
+                Returns
+                -------
+                recipient:              Recipient address.
+                message:                Message as bytes with CRLF line endings.
+
+                """
+                head, middle, tail = template
+                recipient = "consumer%d@%s" % (consumer_id, self.recipient_domain)
+                message_id = "<email-%d.consumer-%d@%s>" % (email_id, consumer_id, self.recipient_domain)
+                return recipient, b"".join((head, recipient.encode(), middle, message_id.encode(), tail))
+
+        def deliver(self, batch):
+                """
+                Sends the messages of one campaign and waits until all are delivered or failed.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                start = time.perf_counter()
+                self.loop.run_until_complete(self.send_campaign(batch))
+                self.sending_seconds += time.perf_counter() - start
+
+        async def send_campaign(self, batch):
+                """ Distributes the recipients of a campaign over the pooled connections."""
+                words = max(int(batch.length), 1)
+                offset = int(batch.email_id) % len(SUBJECT_WORDS)
+                subject = " ".join(SUBJECT_WORDS[(offset + i) % len(SUBJECT_WORDS)] for i in range(words))
+                # Headers and body are rendered once per personalization variant, recipients only splice in their header values
+                templates = {personalized: self.render_template(batch, subject, personalized) for personalized in (False, True)}
+                queue = asyncio.Queue()
+                for recipient in zip(batch.columns["consumerID"].tolist(), batch.columns["Produktkauf"].tolist()):
+                        queue.put_nowait(recipient)
+                await asyncio.gather(*[self.worker(connection, queue, batch.email_id, templates) for connection in self.pool])
+
+        async def worker(self, connection, queue, email_id, templates):
+                """
+                Sends messages from the queue over one connection. Broken connections are reopened for the next message.
+
+                Args
+                -------
+                connection:             Pooled SMTPConnection.
+                queue:                  Queue of consumer IDs and personalizations of the campaign.
+                email_id:               ID of the email of the campaign.
+                templates:              Message templates of the campaign per personalization.
+
+                Returns
+                -------
+                None
+
+                """
+                while not queue.empty():
+                        consumer_id, personalized = queue.get_nowait()
+                        recipient, message = self.render(templates[bool(personalized)], email_id, consumer_id)
+                        await self.throttle()
+                        start = time.perf_counter()
+                        try:
+                                if connection.writer is None:
+                                        await connection.open()
+                                await connection.send(self.sender, recipient, message)
+                                self.latencies.append(time.perf_counter() - start)
+                                self.sent += 1
+                        except SMTPReplyError:
+                                self.failed += 1
+                        except (OSError, ConnectionError, asyncio.TimeoutError):
+                                self.failed += 1
+                                connection.discard()
+
+        async def throttle(self):
+                """ Waits until the next message may be sent according to the rate limit."""
+                if self.rate_per_second <= 0:
+                        return
+                now = time.perf_counter()
+                send_time = max(now, self.next_send_time)
+                self.next_send_time = send_time + 1 / self.rate_per_second
+                if send_time > now:
+                        await asyncio.sleep(send_time - now)
+
+        def report(self):
+                """
+                Returns throughput and latency of the delivery.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                report:                 Dictionary of sent and failed messages, messages per second and latency percentiles in milliseconds.
+
+                """
+                percentiles = np.percentile(self.latencies, LATENCY_PERCENTILES) * 1000 if self.latencies else [0] * len(LATENCY_PERCENTILES)
+                report = {"sent": self.sent,
+                          "failed": self.failed,
+                          "messages_per_second": self.sent / self.sending_seconds if self.sending_seconds > 0 else 0}
+                report.update({"latency_p%d_ms" % percentile: float(value) for percentile, value in zip(LATENCY_PERCENTILES, percentiles)})
+                return report
+
+        async def close_pool(self):
+                """ Closes all pooled connections."""
+                await asyncio.gather(*[connection.close() for connection in self.pool])
+
+        def close(self):
+                """ Closes the pooled connections and the event loop."""
+                self.loop.run_until_complete(self.close_pool())
+                self.loop.close()
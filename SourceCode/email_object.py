@@ -1,6 +1,7 @@
 import numpy as np
 from datetime import datetime, timedelta
 from scipy.stats import skewnorm
+import random_streams
 
 """ 
 E-Mail with attributes
@@ -36,6 +37,28 @@ class Email_Object:
                 self.sending_day_influence = sending_day[1]
                 self.personalization = "Keine Personalisierung"
 
+        def restore(emailID, length, information_value, sending_day, sending_day_influence):
+                """ 
+                Restores an Email_Object with given attributes, e.g. from a serialized mailing calendar.
+
+                Args
+                -------
+                emailID, length, information_value, sending_day, sending_day_influence
+
+                Returns
+                -------
+                email:                  Email_Object with the given attributes.
+
+                """
+                email = Email_Object.__new__(Email_Object)
+                email.emailID = emailID
+                email.length = length
+                email.information_value = information_value
+                email.sending_day = sending_day
+                email.sending_day_influence = sending_day_influence
+                email.personalization = "Keine Personalisierung"
+                return email
+
         def generate_length(self):
                 """ 
                 Generates distribution of length and informative value of subject line .
@@ -82,7 +105,7 @@ class Email_Object:
                 day_categories = [0, 1, 2, 3, 4, 5, 6] # Chosen according to weekday indexes of datetime
                 day_probabilities = [0.14, 0.15, 0.16, 0.17, 0.16, 0.10, 0.12]
                 normalized_probabilities = [p / sum(day_probabilities) for p in day_probabilities]
-                sending_day = np.random.choice(day_categories, p=normalized_probabilities)
+                sending_day = random_streams.choice("sending_day", day_categories, normalized_probabilities)
 
                 if sending_day == 2:
                         sending_day_influence = -0.5
@@ -111,6 +134,10 @@ class Email_Object:
                 samples[0]:                     Returns desired sample following defined normal distribution.
 
                 """
+                if random_streams.active is not None:
+                        # Inverse transform of the truncated distribution, so that every sample uses one draw of the stream
+                        lower, upper = skewnorm.cdf([range_min, range_max], skewness, loc=mean, scale=std_dev)
+                        return list(skewnorm.ppf(lower + random_streams.uniform("subject_line", size) * (upper - lower), skewness, loc=mean, scale=std_dev))
                 samples = []
                 while len(samples) < size:
                         sample_distribution = skewnorm.rvs(skewness, loc=mean, scale=std_dev, size=size-len(samples))
@@ -164,3 +191,24 @@ class Email_Object:
                                 next_email = Email_Object(total_mailings)
                                 
                 return mailing_list
+
+        def calculate_max_frequency(mailing_list):
+                """ 
+                Calculates the highest mailing frequency in 30 days that a consumer can have at a dispatch of the mailing list.
+
+                Args
+                -------
+                mailing_list:                   List of email dispatch dates with defined Email_Object objects.
+
+                Returns
+                -------
+                max_frequency:                  Highest amount of prior emails within 30 days before a dispatch.
+
+                """
+                dispatch_dates = [datetime.strptime(date, "%Y-%m-%d") for _, date in mailing_list]
+                max_frequency = 0
+                for index, dispatch_date in enumerate(dispatch_dates):
+                        days_cutoff = dispatch_date - timedelta(days=30)
+                        frequency = sum(1 for date in dispatch_dates[:index] if date >= days_cutoff)
+                        max_frequency = max(max_frequency, frequency)
+                return max_frequency
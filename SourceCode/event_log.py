@@ -0,0 +1,217 @@
+import os
+import csv
+import heapq
+import shutil
+import numpy as np
+from scipy.stats import norm
+from consumer import DEVICE_CATEGORIES
+
+"""
+Time-ordered event log of dispatches and openings.
+
+Every opened email gets an open timestamp after the dispatch. The open delay is
+drawn from a lognormal distribution truncated to the open window, with a median
+per device and a factor per age group. The uniform draws are derived from a hash of
+consumerID, emailID and the seed of the random streams (splitmix64, like the split
+assignment of ml_export), so they do not change the random state of the run and a
+consumer opens the same email after the same delay in paired scenarios.
+
+The open windows of consecutive campaigns overlap. Every campaign is written as a
+sorted run file of its dispatch and open events. close merges the runs with a
+streaming k-way heap merge into events.csv, which is sorted by time over all
+campaigns. Only one chunk per run is held in memory.
+"""
+
+EVENT_NAMES = ["Versand", "Öffnung"]
+EVENT_COLUMNS = ["Zeitpunkt", "Ereignis", "consumerID", "emailID"]
+EVENT_TYPE = np.dtype([("time", np.int64), ("event", np.int8), ("consumer_id", np.int64), ("email_id", np.int64)])
+DEFAULT_MEDIAN_MINUTES = {"Mobil": 45, "Desktop": 180}
+DEFAULT_AGE_FACTORS = {"0": 0.8, "30": 1.0, "50": 1.5}
+CHUNK_ROWS = 65536
+
+def hash_uniform(consumer_ids, email_id, seed):
+        """
+        Derives a uniform value in (0, 1) per consumer from consumerID, emailID and seed (splitmix64).
+
+        Args
+        -------
+        consumer_ids:                   Array of consumerIDs.
+        email_id:                       emailID of the campaign.
+        seed:                           Seed of the run.
+
+        Returns
+        -------
+        uniform:                        Array of uniform values.
+
+        """
+        with np.errstate(over="ignore"):
+                z = np.asarray(consumer_ids, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64((int(email_id) * 0xD1B54A32D192ED03 + int(seed) * 0xBF58476D1CE4E5B9) % 2**64)
+                z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+                z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+                z = z ^ (z >> np.uint64(31))
+        return ((z >> np.uint64(11)).astype(np.float64) + 0.5) / float(1 << 53)
+
+class OpenDelayModel:
+        def __init__(self, median_minutes=None, sigma=1.2, max_days=7, age_factors=None):
+                """
+                Initilizes the truncated lognormal open delays.
+
+                Args
+                -------
+                median_minutes:         Median open delay in minutes per device. DEFAULT_MEDIAN_MINUTES if None.
+                sigma:                  Standard deviation of the logarithm of the delay.
+                max_days:               Open window in days. Later openings are not drawn.
+                age_factors:            Factor of the median per lower bound of an age group, e.g. {"0": 0.8, "50": 1.5}. DEFAULT_AGE_FACTORS if None.
+
+                Returns
+                -------
+                None
+
+                """
+                median_minutes = median_minutes or DEFAULT_MEDIAN_MINUTES
+                age_factors = age_factors or DEFAULT_AGE_FACTORS
+                unknown = set(median_minutes) - set(DEVICE_CATEGORIES)
+                if unknown or len(median_minutes) != len(DEVICE_CATEGORIES):
+                        raise ValueError("Median open delays have to be given for the devices %s." % ", ".join(DEVICE_CATEGORIES))
+                if sigma <= 0 or max_days <= 0:
+                        raise ValueError("Sigma and open window of the open delays have to be positive.")
+                self.medians = np.array([median_minutes[device] for device in DEVICE_CATEGORIES], dtype=np.float64)
+                self.age_bounds = np.array(sorted(int(bound) for bound in age_factors))
+                self.age_factors = np.array([age_factors[str(bound)] for bound in self.age_bounds], dtype=np.float64)
+                self.sigma = sigma
+                self.max_minutes = max_days * 24 * 60
+
+        def sample(self, consumer_ids, email_id, device, age, seed=0, antithetic=False):
+                """
+                Draws the open delays of the openings of a campaign.
+
+                Args
+                -------
+                consumer_ids:           Array of consumerIDs of the opening consumers.
+                email_id:               emailID of the campaign.
+                device:                 Array of device indexes.
+                age:                    Array of ages.
+                seed:                   Seed of the run.
+                antithetic:             Mirrors the uniform draws if True.
+
+                Returns
+                -------
+                delays:                 Array of open delays in minutes.
+
+                """
+                uniform = hash_uniform(consumer_ids, email_id, seed)
+                if antithetic:
+                        uniform = 1 - uniform
+                group = np.maximum(np.searchsorted(self.age_bounds, age, side="right") - 1, 0)
+                median = self.medians[device] * self.age_factors[group]
+                # Inverse transform of the lognormal truncated at the open window
+                upper = norm.cdf(np.log(self.max_minutes / median) / self.sigma)
+                return median * np.exp(self.sigma * norm.ppf(uniform * upper))
+
+class EventLogWriter:
+        def __init__(self, output_path, delay_model, seed=0, antithetic=False):
+                """
+                Initilizes the writer and creates the folder of the event log.
+
+                Args
+                -------
+                output_path:            Folder of the event log.
+                delay_model:            OpenDelayModel of the open delays.
+                seed:                   Seed of the open delays, e.g. of the random streams.
+                antithetic:             Mirrors the draws of the open delays if True.
+
+                Returns
+                -------
+                None
+
+                """
+                self.output_path = output_path
+                self.run_path = os.path.join(output_path, "runs")
+                self.delay_model = delay_model
+                self.seed = seed
+                self.antithetic = antithetic
+                self.runs = []
+                os.makedirs(self.run_path, exist_ok=True)
+
+        def write_batch(self, batch):
+                """
+                Writes the dispatch and open events of a campaign as sorted run file.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                if len(batch) == 0:
+                        return
+                columns = batch.columns
+                opened = columns["Öffnung"]
+                delays = self.delay_model.sample(columns["consumerID"][opened], batch.email_id, columns["Endgerät"][opened], columns["Alter"][opened], self.seed, self.antithetic)
+                send_time = np.datetime64(batch.current_time, "us").astype(np.int64)
+                events = np.zeros(len(batch) + len(delays), dtype=EVENT_TYPE)
+                events["time"][:len(batch)] = send_time
+                events["time"][len(batch):] = send_time + np.round(delays * 60e6).astype(np.int64)
+                events["event"][len(batch):] = 1
+                events["consumer_id"] = np.concatenate([columns["consumerID"], columns["consumerID"][opened]])
+                events["email_id"] = batch.email_id
+                events = events[np.lexsort((events["email_id"], events["consumer_id"], events["event"], events["time"]))]
+                path = os.path.join(self.run_path, "%05d.npy" % len(self.runs))
+                np.save(path, events)
+                self.runs.append(path)
+
+        def read_run(self, path):
+                """
+                Yields the events of a run file in chunks of CHUNK_ROWS.
+
+                Args
+                -------
+                path:                   Path of the run file.
+
+                Returns
+                -------
+                events:                 Generator of (time, event, consumerID, emailID) tuples.
+
+                """
+                events = np.load(path, mmap_mode="r")
+                for start in range(0, len(events), CHUNK_ROWS):
+                        chunk = events[start:start + CHUNK_ROWS]
+                        yield from zip(chunk["time"].tolist(), chunk["event"].tolist(), chunk["consumer_id"].tolist(), chunk["email_id"].tolist())
+
+        def close(self):
+                """
+                Merges the sorted runs of all campaigns into events.csv and removes the run files.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                rows:                   Amount of events in the log.
+
+                """
+                rows = 0
+                with open(os.path.join(self.output_path, "events.csv"), "w", newline="", encoding="utf-8") as file:
+                        writer = csv.writer(file)
+                        writer.writerow(EVENT_COLUMNS)
+                        chunk = []
+                        for event in heapq.merge(*[self.read_run(path) for path in self.runs]):
+                                chunk.append(event)
+                                if len(chunk) == CHUNK_ROWS:
+                                        rows += self.write_chunk(writer, chunk)
+                                        chunk = []
+                        rows += self.write_chunk(writer, chunk)
+                shutil.rmtree(self.run_path)
+                return rows
+
+        def write_chunk(self, writer, chunk):
+                """ Writes merged events with ISO timestamps and event names and returns their amount."""
+                if not chunk:
+                        return 0
+                times = np.datetime_as_string(np.array([event[0] for event in chunk], dtype="datetime64[us]"))
+                writer.writerows((time, EVENT_NAMES[event], consumer_id, email_id) for time, (_, event, consumer_id, email_id) in zip(times.tolist(), chunk))
+                return len(chunk)
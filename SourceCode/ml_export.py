@@ -0,0 +1,232 @@
+import os
+import json
+import numpy as np
+
+"""
+Export of the synthetic dataset as ML-ready feature matrix.
+
+Campaigns are encoded into a numeric feature matrix with a fixed column order
+and written as .npy shards that can be opened with np.load(mmap_mode="r").
+Train, validation and test assignment is derived from a hash of the consumerID,
+so that all rows of one consumer end up in the same split without any shuffle.
+"""
+
+WEEKDAY_NAMES = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
+GENDER_CODES = {"Männlich": 0, "Weiblich": 1}
+DEVICE_CODES = {"Mobil": 0, "Desktop": 1}
+LABEL_CODES = {"Nein": 0, "Ja": 1}
+FEATURE_COLUMNS = ["Alter",
+                   "Geschlecht",
+                   "Einkommen",
+                   "Informative Wahrnehmung",
+                   "Frequenz",
+                   "Zeitspanne vorherige E-Mail",
+                   "Produktkauf",
+                   "Öffnung vorherige E-Mail",
+                   "Endgerät",
+                   "Anzahl Wörter in Betreffzeile",
+                   "Informationsgehalt",
+                   "Personalisierung"] + ["Versandtag_" + day for day in WEEKDAY_NAMES]
+SPLIT_NAMES = ["train", "validation", "test"]
+
+class FeatureMatrixWriter:
+        def __init__(self, output_path, split_shares, shard_rows, weekday_names=WEEKDAY_NAMES):
+                """
+                Initilizes the writer with empty buffers for every split.
+
+                Args
+                -------
+                output_path:            Folder to write the shards and the manifest to.
+                split_shares:           Shares of consumers per split, e.g. {"train": 0.8, "validation": 0.1, "test": 0.1}.
+                shard_rows:             Maximum amount of rows per shard.
+                weekday_names:          Weekday names used in the "Versandtag" column.
+
+                Returns
+                -------
+                None
+
+                """
+                self.output_path = output_path
+                self.shard_rows = shard_rows
+                self.weekday_names = list(weekday_names)
+                self.split_names = [name for name in SPLIT_NAMES if split_shares.get(name, 0) > 0]
+                total_share = sum(split_shares[name] for name in self.split_names)
+                self.split_bounds = np.cumsum([split_shares[name] / total_share for name in self.split_names])
+                self.split_bounds[-1] = 1.0
+                self.buffers = {name: [] for name in self.split_names}
+                self.buffered_rows = {name: 0 for name in self.split_names}
+                self.shards = {name: [] for name in self.split_names}
+                os.makedirs(self.output_path, exist_ok=True)
+
+        def assign_split(self, consumer_ids):
+                """
+                Assigns every consumerID to a split by hashing it (splitmix64).
+                The assignment only depends on the consumerID and is stable across runs.
+
+                Args
+                -------
+                consumer_ids:           Array of consumerIDs.
+
+                Returns
+                -------
+                split_index:            Index into self.split_names for every consumerID.
+
+                """
+                z = np.asarray(consumer_ids, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+                z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+                z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+                z = z ^ (z >> np.uint64(31))
+                uniform = (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+                return np.searchsorted(self.split_bounds, uniform, side="right")
+
+        def encode_batch(self, batch):
+                """
+                Encodes a campaign into feature matrix, labels and ids without building rows.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                features:               float32 matrix with columns in the order of FEATURE_COLUMNS.
+                labels:                 int8 vector with 1 = opened and 0 = not opened.
+                ids:                    int64 matrix with consumerID and emailID per row.
+
+                """
+                columns = batch.columns
+                features = np.zeros((len(batch), len(FEATURE_COLUMNS)), dtype=np.float32)
+                for position, column in enumerate(["Alter", "Geschlecht", "Einkommen", "Informative Wahrnehmung", "Frequenz", "Zeitspanne vorherige E-Mail", "Produktkauf", "Öffnung vorherige E-Mail", "Endgerät"]):
+                        # Category indexes of Geschlecht and Endgerät equal GENDER_CODES and DEVICE_CODES
+                        features[:, position] = columns[column]
+                features[:, 9] = batch.length
+                features[:, 10] = batch.information_value
+                features[:, 11] = columns["Produktkauf"]
+                features[:, 12 + self.weekday_names.index(batch.sending_day)] = 1
+                labels = columns["Öffnung"].astype(np.int8)
+                ids = np.column_stack([columns["consumerID"], np.full(len(batch), batch.email_id)]).astype(np.int64)
+                return features, labels, ids
+
+        def write_batch(self, batch):
+                """
+                Encodes a campaign, assigns its rows to their split and flushes full shards to disk.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                if len(batch) == 0:
+                        return
+                self.write_encoded(*self.encode_batch(batch))
+
+        def write_encoded(self, features, labels, ids):
+                """
+                Assigns encoded rows to their split and flushes full shards to disk.
+
+                Args
+                -------
+                features, labels, ids:  Encoded rows, see encode_batch.
+
+                Returns
+                -------
+                None
+
+                """
+                split_index = self.assign_split(ids[:, 0])
+                for index, name in enumerate(self.split_names):
+                        mask = split_index == index
+                        if not mask.any():
+                                continue
+                        self.buffers[name].append((features[mask], labels[mask], ids[mask]))
+                        self.buffered_rows[name] += int(mask.sum())
+                        while self.buffered_rows[name] >= self.shard_rows:
+                                self.flush(name, self.shard_rows)
+
+        def flush(self, name, row_amount):
+                """
+                Writes the first row_amount buffered rows of a split as one shard.
+
+                Args
+                -------
+                name:                   Name of the split.
+                row_amount:             Amount of rows to write into the shard.
+
+                Returns
+                -------
+                None
+
+                """
+                features = np.concatenate([chunk[0] for chunk in self.buffers[name]])
+                labels = np.concatenate([chunk[1] for chunk in self.buffers[name]])
+                ids = np.concatenate([chunk[2] for chunk in self.buffers[name]])
+                shard_index = len(self.shards[name])
+                shard = {"features": "X_%s_%05d.npy" % (name, shard_index),
+                         "labels": "y_%s_%05d.npy" % (name, shard_index),
+                         "ids": "ids_%s_%05d.npy" % (name, shard_index),
+                         "rows": int(row_amount)}
+                np.save(os.path.join(self.output_path, shard["features"]), features[:row_amount])
+                np.save(os.path.join(self.output_path, shard["labels"]), labels[:row_amount])
+                np.save(os.path.join(self.output_path, shard["ids"]), ids[:row_amount])
+                self.shards[name].append(shard)
+                self.buffers[name] = [(features[row_amount:], labels[row_amount:], ids[row_amount:])]
+                self.buffered_rows[name] -= row_amount
+
+        def close(self):
+                """
+                Flushes remaining rows and writes manifest.json with column order, encodings and shards.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                None
+
+                """
+                for name in self.split_names:
+                        if self.buffered_rows[name] > 0:
+                                self.flush(name, self.buffered_rows[name])
+                manifest = {"feature_columns": FEATURE_COLUMNS,
+                            "feature_dtype": "float32",
+                            "label_column": "Öffnung",
+                            "label_dtype": "int8",
+                            "id_columns": ["consumerID", "emailID"],
+                            "encodings": {"Geschlecht": GENDER_CODES,
+                                          "Endgerät": DEVICE_CODES,
+                                          "Personalisierung": {"Keine Personalisierung": 0, "Produktbasierte Personalisierung": 1},
+                                          "Versandtag": "one-hot in weekday order " + ", ".join(self.weekday_names),
+                                          "Öffnung": LABEL_CODES},
+                            "split_by": "splitmix64(consumerID)",
+                            "split_bounds": dict(zip(self.split_names, self.split_bounds.tolist())),
+                            "shards": self.shards}
+                with open(os.path.join(self.output_path, "manifest.json"), "w", encoding="utf-8") as file:
+                        json.dump(manifest, file, indent=4, ensure_ascii=False)
+
+def load_split(output_path, name):
+        """
+        Opens all shards of a split as memory-mapped arrays.
+
+        Args
+        -------
+        output_path:                    Folder of the exported feature matrix.
+        name:                           Name of the split ("train", "validation" or "test").
+
+        Returns
+        -------
+        shards:                         List of (features, labels, ids) tuples of memory-mapped arrays.
+
+        """
+        with open(os.path.join(output_path, "manifest.json"), encoding="utf-8") as file:
+                manifest = json.load(file)
+        shards = []
+        for shard in manifest["shards"].get(name, []):
+                shards.append((np.load(os.path.join(output_path, shard["features"]), mmap_mode="r"),
+                               np.load(os.path.join(output_path, shard["labels"]), mmap_mode="r"),
+                               np.load(os.path.join(output_path, shard["ids"]), mmap_mode="r")))
+        return shards
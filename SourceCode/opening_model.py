@@ -0,0 +1,318 @@
+import json
+import math
+import numpy as np
+from consumer import DEVICE_CATEGORIES
+
+"""
+Declarative specification of the opening model.
+
+A spec is a JSON document with the intercept and a list of terms of the logit:
+{"intercept": -1.6,
+ "terms": [{"name": "timespan", "type": "piecewise", "input": "timespan", "edges": [3], "right": false, "slopes": [0.8, 0], "offsets": [0, 2.4]},
+           {"name": "frequency", "type": "polynomial", "input": "frequency", "coefficients": [[0.2, -0.1], [0.3, -0.1]], "by": "product_purchase"},
+           ...]}
+
+Term types:
+- categorical:  values[x] of a categorical input.
+- polynomial:   coefficients[0] * x + coefficients[1] * x^2 + ...
+- piecewise:    offsets[b] + slopes[b] * x in bin b of x. The bins are split at the sorted edges,
+                with the edges belonging to the lower bin if right is true (default) and to the upper bin otherwise.
+With "by", the parameters of a term are given per level of a mediating input, e.g. per product_purchase state,
+and the term is an interaction of both inputs. "by" is either a categorical input or bins of an input
+{"input": "subject_length", "edges": [7], "right": true}.
+
+OpeningModel compiles a spec once into NumPy arrays and evaluates the terms vectorized, e.g. on the
+grid of the opening table. interpret evaluates a spec term by term for a single consumer and email.
+It is the reference the compiled model is checked against.
+"""
+
+CATEGORICAL_INPUTS = {"sending_day": 7, "product_purchase": 2, "prior_email_opening": 2, "device": len(DEVICE_CATEGORIES)}
+NUMERIC_INPUTS = ["subject_length", "informative_perception", "timespan", "frequency", "recent_openings"]
+TERM_PARAMETERS = {"categorical": ["values"], "polynomial": ["coefficients"], "piecewise": ["slopes", "offsets"]}
+
+def read_spec(file_path):
+        """
+        Reads and checks an opening-model spec.
+
+        Args
+        -------
+        file_path:                      Path of a JSON file with the spec, optionally nested under "model".
+
+        Returns
+        -------
+        spec:                           Dictionary of the spec.
+
+        """
+        with open(file_path, encoding="utf-8") as file:
+                spec = json.load(file)
+        spec = spec.get("model", spec)
+        check_spec(spec)
+        return spec
+
+def check_spec(spec):
+        """
+        Checks the structure of a spec and raises a ValueError for the first error.
+
+        Args
+        -------
+        spec:                           Dictionary of the spec.
+
+        Returns
+        -------
+        None
+
+        """
+        if not isinstance(spec.get("intercept"), (int, float)):
+                raise ValueError("Opening model needs a numeric intercept.")
+        for term in spec.get("terms", []):
+                name = term.get("name", term.get("input"))
+                if term.get("type") not in TERM_PARAMETERS:
+                        raise ValueError("Unknown type %s of opening model term %s. Known types: %s." % (term.get("type"), name, ", ".join(TERM_PARAMETERS)))
+                if term.get("input") not in CATEGORICAL_INPUTS and term.get("input") not in NUMERIC_INPUTS:
+                        raise ValueError("Unknown input %s of opening model term %s." % (term.get("input"), name))
+                if term["type"] == "categorical" and term["input"] not in CATEGORICAL_INPUTS:
+                        raise ValueError("Categorical term %s needs one of the categorical inputs %s." % (name, ", ".join(CATEGORICAL_INPUTS)))
+                if term["type"] != "categorical" and term["input"] in CATEGORICAL_INPUTS:
+                        raise ValueError("Term %s of type %s needs a numeric input." % (name, term["type"]))
+                levels = check_level(term.get("by"), name)
+                for parameter in TERM_PARAMETERS[term["type"]]:
+                        values = term.get(parameter)
+                        for level_values in (values if levels is not None and isinstance(values, list) else [values]):
+                                if not isinstance(level_values, list) or not all(isinstance(value, (int, float)) for value in level_values):
+                                        raise ValueError("Parameter %s of opening model term %s has to be a list of numbers%s." % (parameter, name, " per level of %s" % level_name(term["by"]) if levels is not None else ""))
+                        if levels is not None and len(values) != levels:
+                                raise ValueError("Term %s needs %d levels of %s for %s." % (name, levels, parameter, level_name(term["by"])))
+                        lengths = {len(level_values) for level_values in (values if levels is not None else [values])}
+                        if len(lengths) > 1:
+                                raise ValueError("Term %s needs the same amount of %s for every level of %s." % (name, parameter, level_name(term["by"])))
+                        if term["type"] == "categorical" and lengths != {CATEGORICAL_INPUTS[term["input"]]}:
+                                raise ValueError("Term %s needs %d values for %s." % (name, CATEGORICAL_INPUTS[term["input"]], term["input"]))
+                        if term["type"] == "piecewise":
+                                check_edges(term.get("edges"), name)
+                                if lengths != {len(term["edges"]) + 1}:
+                                        raise ValueError("Term %s needs %d %s for %d edges." % (name, len(term["edges"]) + 1, parameter, len(term["edges"])))
+
+def check_level(by, name):
+        """ Checks the mediating input of a term and returns its amount of levels, None without mediating input."""
+        if by is None:
+                return None
+        if isinstance(by, str):
+                if by not in CATEGORICAL_INPUTS:
+                        raise ValueError("Term %s can only be split by the categorical inputs %s or by bins." % (name, ", ".join(CATEGORICAL_INPUTS)))
+                return CATEGORICAL_INPUTS[by]
+        if by.get("input") not in NUMERIC_INPUTS:
+                raise ValueError("Bins of term %s need one of the numeric inputs %s." % (name, ", ".join(NUMERIC_INPUTS)))
+        check_edges(by.get("edges"), name)
+        return len(by["edges"]) + 1
+
+def check_edges(edges, name):
+        """ Checks that the edges of a term are a sorted list of numbers."""
+        if not isinstance(edges, list) or not edges or not all(isinstance(edge, (int, float)) for edge in edges) or edges != sorted(edges):
+                raise ValueError("Term %s needs a sorted list of edges." % name)
+
+def level_name(by):
+        """ Returns the name of the mediating input of a term."""
+        return by if isinstance(by, str) else "bins of %s" % by["input"]
+
+def find_bin(edges, right, value):
+        """ Returns the bin of a single value, see the module description."""
+        return sum(1 for edge in edges if (value > edge if right else value >= edge))
+
+def interpret_term(term, inputs):
+        """
+        Evaluates one term of a spec for a single consumer and email.
+
+        Args
+        -------
+        term:                           Dictionary of the term.
+        inputs:                         Dictionary of the input values, see CATEGORICAL_INPUTS and NUMERIC_INPUTS.
+
+        Returns
+        -------
+        value:                          Value of the term in the logit.
+
+        """
+        by = term.get("by")
+        if by is None:
+                parameters = term
+        else:
+                level = int(inputs[by]) if isinstance(by, str) else find_bin(by["edges"], by.get("right", True), inputs[by["input"]])
+                parameters = {name: term[name][level] for name in TERM_PARAMETERS[term["type"]]}
+        value = inputs[term["input"]]
+        if term["type"] == "categorical":
+                return parameters["values"][int(value)]
+        if term["type"] == "polynomial":
+                return sum(coefficient * value ** (power + 1) for power, coefficient in enumerate(parameters["coefficients"]))
+        piece = find_bin(term["edges"], term.get("right", True), value)
+        return parameters["offsets"][piece] + parameters["slopes"][piece] * value
+
+def term_inputs(term):
+        """ Returns the names of the inputs a term depends on."""
+        by = term.get("by")
+        names = [term["input"]]
+        if by is not None:
+                names.append(by if isinstance(by, str) else by["input"])
+        return list(dict.fromkeys(names))
+
+def interpret(spec, inputs):
+        """
+        Evaluates a spec for a single consumer and email, term by term.
+
+        Args
+        -------
+        spec:                           Dictionary of the spec.
+        inputs:                         Dictionary of the input values, see CATEGORICAL_INPUTS and NUMERIC_INPUTS.
+
+        Returns
+        -------
+        probability:                    Opening probability.
+
+        """
+        logit = spec["intercept"]
+        for term in spec["terms"]:
+                logit += interpret_term(term, inputs)
+        return 1 / (1 + math.exp(-logit))
+
+class OpeningModel:
+        def __init__(self, spec):
+                """
+                Checks a spec and compiles its terms.
+
+                Args
+                -------
+                spec:                   Dictionary of the spec.
+
+                Returns
+                -------
+                None
+
+                """
+                check_spec(spec)
+                self.spec = spec
+                self.intercept = float(spec["intercept"])
+                self.terms = [self.compile_term(term) for term in spec["terms"]]
+
+        def compile_level(self, by):
+                """
+                Compiles the mediating input of a term into a function of the inputs that returns the level per element.
+
+                Args
+                -------
+                by:                     Mediating input of the term, see the module description. None without mediating input.
+
+                Returns
+                -------
+                level:                  Function of the inputs dictionary, None without mediating input.
+
+                """
+                if by is None:
+                        return None
+                if isinstance(by, str):
+                        return lambda inputs: np.asarray(inputs[by], dtype=np.int64)
+                edges = np.array(by["edges"], dtype=np.float64)
+                side = "left" if by.get("right", True) else "right"
+                return lambda inputs: np.searchsorted(edges, inputs[by["input"]], side=side)
+
+        def compile_term(self, term):
+                """
+                Compiles a term into a function of the inputs dictionary that returns the term per element.
+                Parameters are stored as arrays with one row per level of the mediating input.
+
+                Args
+                -------
+                term:                   Dictionary of the term.
+
+                Returns
+                -------
+                evaluate:               Function of the inputs dictionary.
+
+                """
+                level = self.compile_level(term.get("by"))
+                parameters = {name: np.atleast_2d(np.array(term[name], dtype=np.float64)) for name in TERM_PARAMETERS[term["type"]]}
+                name = term["input"]
+                gather = (lambda inputs: 0) if level is None else level
+                if term["type"] == "categorical":
+                        values = parameters["values"]
+                        return lambda inputs: values[gather(inputs), np.asarray(inputs[name], dtype=np.int64)]
+                if term["type"] == "polynomial":
+                        coefficients = parameters["coefficients"]
+                        def evaluate(inputs):
+                                # Ascending powers, summed in the order of calculate_opening
+                                value = np.asarray(inputs[name], dtype=np.float64)
+                                row = gather(inputs)
+                                power_value = value
+                                result = value * coefficients[row, 0]
+                                for power in range(1, coefficients.shape[1]):
+                                        power_value = power_value * value
+                                        result = result + power_value * coefficients[row, power]
+                                return result
+                        return evaluate
+                edges = np.array(term["edges"], dtype=np.float64)
+                side = "left" if term.get("right", True) else "right"
+                slopes, offsets = parameters["slopes"], parameters["offsets"]
+                def evaluate(inputs):
+                        value = np.asarray(inputs[name], dtype=np.float64)
+                        row, piece = gather(inputs), np.searchsorted(edges, value, side=side)
+                        return offsets[row, piece] + slopes[row, piece] * value
+                return evaluate
+
+        def probability(self, inputs):
+                """
+                Evaluates the opening probability for arrays of inputs.
+
+                Args
+                -------
+                inputs:                 Dictionary of broadcastable input arrays, see CATEGORICAL_INPUTS and NUMERIC_INPUTS.
+
+                Returns
+                -------
+                probability:            Array of opening probabilities as float64.
+
+                """
+                logit = self.intercept
+                for evaluate in self.terms:
+                        logit = logit + evaluate(inputs)
+                return 1 / (1 + np.exp(-logit))
+
+        def integer_axis(self, name):
+                """
+                Returns the distinct values of a non-negative integer input, e.g. subject_length or timespan, for a table.
+                Integers with the same bins and, inside sloped pieces, the same value share one entry.
+                The input may only enter the model through piecewise terms whose last piece is flat and through bins.
+
+                Args
+                -------
+                name:                   Name of the numeric input.
+
+                Returns
+                -------
+                values:                 Representative values of the entries.
+                lookup:                 Array of the entry of every integer from 0 to the cap.
+                cap:                    Highest integer with an own lookup position. Larger values behave like the cap.
+
+                """
+                splits = []
+                for term in self.spec["terms"]:
+                        by = term.get("by")
+                        if isinstance(by, dict) and by["input"] == name:
+                                splits.append((by["edges"], by.get("right", True), None))
+                        if term["input"] != name:
+                                continue
+                        if term["type"] != "piecewise" or any(slopes[-1] != 0 for slopes in np.atleast_2d(term["slopes"])):
+                                raise ValueError("Input %s can only enter the opening model through bins and piecewise terms with a flat last piece." % name)
+                        splits.append((term["edges"], term.get("right", True), np.atleast_2d(term["slopes"])))
+                cap = int(math.ceil(max([edges[-1] for edges, _, _ in splits], default=-1))) + 1
+                signatures = {}
+                values = []
+                lookup = np.zeros(cap + 1, dtype=np.int64)
+                for value in range(cap + 1):
+                        signature = []
+                        for edges, right, slopes in splits:
+                                piece = find_bin(edges, right, value)
+                                signature.append((piece, value if slopes is not None and np.any(slopes[:, piece] != 0) else None))
+                        signature = tuple(signature)
+                        if signature not in signatures:
+                                signatures[signature] = len(values)
+                                values.append(value)
+                        lookup[value] = signatures[signature]
+                return values, lookup, cap
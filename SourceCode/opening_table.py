@@ -0,0 +1,291 @@
+import itertools
+import numpy as np
+from types import SimpleNamespace
+from opening_model import OpeningModel, CATEGORICAL_INPUTS, interpret, interpret_term, term_inputs
+
+"""
+Precomputed opening decisions of Simulation.calculate_opening.
+
+The opening reaction only depends on discrete inputs:
+- subject line length bucket (<= 7 and > 7 words)
+- sending day of the email
+- informative perception of the consumer
+- timespan since the last email (capped at 3 days)
+- mailing frequency of the last 30 days
+- product purchase and prior email opening
+- device influence of the consumer
+- optionally the amount of openings among the last history_window received emails
+Decision and probability are computed once for every combination when the run starts,
+so that the dispatch only needs an index computation and a gather.
+
+The table is built from an opening-model spec (see opening_model), which is compiled
+into a vectorized evaluator. The bins of subject line length and timespan are taken
+from the spec. Without spec, the spec of calculate_opening is created from the
+coefficients, which can be replaced, e.g. by calibrated coefficients.
+DEFAULT_COEFFICIENTS are the coefficients of calculate_opening, Consumer.generate_device
+and Email_Object.generate_sending_day.
+"""
+
+AGE_PERCEPTIONS = [0, -1.2, -1.1]
+GENDER_PERCEPTIONS = [0.3, 0]
+INCOME_PERCEPTIONS = [0, 0.4, -0.1]
+DEFAULT_COEFFICIENTS = {"intercept": -1.6,
+                        "timespan": 0.8,
+                        "timespan_cap": 2.4,
+                        "personalization": 0.2,
+                        "frequency": [0.2, 0.3], # Without and with product purchase
+                        "frequency_sqr": -0.1,
+                        "prior_email_opening": [0.9, 0.7], # Without and with product purchase
+                        "device": [0.9, 0], # Ordered like the device categories ["Mobil", "Desktop"]
+                        "sending_day": [0, 0, -0.5, 0, -0.1, -0.3, -0.3], # Ordered like the weekday indexes of datetime
+                        "recent_openings": 0.0} # Per opening among the last history_window received emails
+
+def create_spec(coefficients=None):
+        """
+        Creates the opening-model spec of calculate_opening with given coefficients.
+
+        Args
+        -------
+        coefficients:                   Coefficients that replace DEFAULT_COEFFICIENTS. DEFAULT_COEFFICIENTS if None.
+
+        Returns
+        -------
+        spec:                           Dictionary of the spec, see opening_model.
+
+        """
+        coefficients = dict(DEFAULT_COEFFICIENTS, **(coefficients or {}))
+        return {"intercept": coefficients["intercept"],
+                "terms": [{"name": "perceived_value", "type": "polynomial", "input": "informative_perception", "coefficients": [[-1], [1]], "by": {"input": "subject_length", "edges": [7]}},
+                          {"name": "personalization", "type": "categorical", "input": "product_purchase", "values": [0, coefficients["personalization"]]},
+                          {"name": "sending_day", "type": "categorical", "input": "sending_day", "values": list(coefficients["sending_day"])},
+                          {"name": "frequency", "type": "polynomial", "input": "frequency", "coefficients": [[frequency, coefficients["frequency_sqr"]] for frequency in coefficients["frequency"]], "by": "product_purchase"},
+                          {"name": "timespan", "type": "piecewise", "input": "timespan", "edges": [3], "right": False, "slopes": [coefficients["timespan"], 0], "offsets": [0, coefficients["timespan_cap"]]},
+                          {"name": "prior_email_opening", "type": "categorical", "input": "prior_email_opening", "values": [[0, prior] for prior in coefficients["prior_email_opening"]], "by": "product_purchase"},
+                          {"name": "device", "type": "categorical", "input": "device", "values": list(coefficients["device"])},
+                          {"name": "recent_openings", "type": "polynomial", "input": "recent_openings", "coefficients": [coefficients["recent_openings"]]}]}
+
+class OpeningTable:
+        def __init__(self, max_frequency, coefficients=None, history_window=0, spec=None):
+                """
+                Initilizes the class, compiles the opening model and computes decision and probability for the full input space.
+
+                Args
+                -------
+                max_frequency:          Highest mailing frequency in 30 days that can occur in the simulation.
+                coefficients:           Coefficients of the logistic regression. DEFAULT_COEFFICIENTS if None.
+                history_window:         Amount of last received emails whose openings enter the model. 0 disables the feature.
+                spec:                   Opening-model spec, see opening_model. Created from the coefficients if None.
+
+                Returns
+                -------
+                None
+
+                """
+                if not 0 <= history_window <= 64:
+                        raise ValueError("History window has to be between 0 and 64 emails.")
+                if spec is not None and coefficients is not None:
+                        raise ValueError("Opening model spec and coefficients cannot be combined.")
+                self.history_window = history_window
+                self.perception_values = sorted(set(age + gender + income for age, gender, income in itertools.product(AGE_PERCEPTIONS, GENDER_PERCEPTIONS, INCOME_PERCEPTIONS)))
+                self.max_frequency = max_frequency
+                self.spec = spec if spec is not None else create_spec(coefficients)
+                self.model = OpeningModel(self.spec)
+                self.length_values, self.length_lookup, self.length_cap = self.model.integer_axis("subject_length")
+                self.timespan_values, self.timespan_lookup, self.timespan_cap = self.model.integer_axis("timespan")
+                self.probability, self.decision = self.build()
+                self.consumer_shape = self.decision.shape[2:]
+
+        def build(self):
+                """
+                Evaluates the compiled opening model on the grid of all inputs.
+                Axes are (length, sending day, perception, timespan, frequency, purchase, prior opening, device, recent openings).
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                probability:            Opening probability for every combination of inputs as float32.
+                decision:               Rounded opening decision for every combination of inputs as int8.
+
+                """
+                probability = self.model.probability(self.grid_inputs(np.ix_))
+                return probability.astype(np.float32), np.round(probability).astype(np.int8)
+
+        def grid_inputs(self, arrange):
+                """
+                Returns the input values of the table axes.
+
+                Args
+                -------
+                arrange:                Function that arranges the axis values, np.ix_ for broadcastable arrays.
+
+                Returns
+                -------
+                inputs:                 Dictionary of the inputs of the opening model.
+
+                """
+                axes = arrange(np.array(self.length_values, dtype=np.float64),
+                               np.arange(CATEGORICAL_INPUTS["sending_day"]),
+                               np.array(self.perception_values, dtype=np.float64),
+                               np.array(self.timespan_values, dtype=np.float64),
+                               np.arange(self.max_frequency + 1, dtype=np.float64),
+                               np.arange(2),
+                               np.arange(2),
+                               np.arange(CATEGORICAL_INPUTS["device"]),
+                               np.arange(self.history_window + 1, dtype=np.float64))
+                return dict(zip(["subject_length", "sending_day", "informative_perception", "timespan", "frequency", "product_purchase", "prior_email_opening", "device", "recent_openings"], axes))
+
+        def covers(self, max_frequency, coefficients=None, history_window=0, spec=None):
+                """
+                Checks whether the table can be reused for a run, e.g. by a warm worker.
+
+                Args
+                -------
+                max_frequency:          Highest mailing frequency in 30 days of the run.
+                coefficients:           Coefficients of the run. DEFAULT_COEFFICIENTS if None.
+                history_window:         History window of the run.
+                spec:                   Opening-model spec of the run. Created from the coefficients if None.
+
+                Returns
+                -------
+                covers:                 True if the table has the same opening model and history window and covers the mailing frequency.
+
+                """
+                return max_frequency <= self.max_frequency and history_window == self.history_window and self.spec == (spec if spec is not None else create_spec(coefficients))
+
+        def perception_index(self, informative_perception):
+                """
+                Maps informative perception values of consumers to their table index.
+
+                Args
+                -------
+                informative_perception: Array of informative perception values.
+
+                Returns
+                -------
+                index:                  Array of perception indexes.
+
+                """
+                values = np.asarray(informative_perception, dtype=np.float64)
+                index = np.searchsorted(self.perception_values, values)
+                if np.any(index >= len(self.perception_values)) or np.any(np.asarray(self.perception_values)[np.minimum(index, len(self.perception_values) - 1)] != values):
+                        raise ValueError("Informative perception outside of opening table.")
+                return index.astype(np.int8)
+
+        def email_index(self, email):
+                """
+                Returns the length bucket and sending day index of an email.
+
+                Args
+                -------
+                email:                  Email_Object to dispatch.
+
+                Returns
+                -------
+                length_index:           Index of the subject line length in the bins of the opening model.
+                sending_day_index:      Weekday index of the sending day.
+
+                """
+                return int(self.length_lookup[min(int(email.length), self.length_cap)]), int(email.sending_day)
+
+        def consumer_index(self, perception_index, timespan, frequency, product_purchase, prior_email_opening, device_index, recent_openings=0):
+                """
+                Computes the flat table index of consumer states.
+
+                Args
+                -------
+                perception_index:       Array of perception indexes.
+                timespan:               Array of days since last email dispatch.
+                frequency:              Array of mailing frequencies in the last 30 days.
+                product_purchase:       Array of purchase states.
+                prior_email_opening:    Array of prior email opening states.
+                device_index:           Array of device indexes (0 = Mobil, 1 = Desktop).
+                recent_openings:        Array of openings among the last history_window received emails. Ignored without history window.
+
+                Returns
+                -------
+                index:                  Flat index into the consumer axes of the table.
+
+                """
+                if np.any(frequency > self.max_frequency):
+                        raise ValueError("Mailing frequency outside of opening table.")
+                _, timespans, frequencies, _, _, devices, recents = self.consumer_shape
+                index = np.asarray(perception_index, dtype=np.int64) * timespans + self.timespan_lookup[np.minimum(timespan, self.timespan_cap)]
+                index = index * frequencies + frequency
+                index = index * 2 + product_purchase
+                index = index * 2 + prior_email_opening
+                index = index * devices + device_index
+                index = index * recents + (np.minimum(recent_openings, self.history_window) if self.history_window > 0 else 0)
+                return index
+
+        def decide(self, email, perception_index, timespan, frequency, product_purchase, prior_email_opening, device_index, recent_openings=0):
+                """
+                Gathers opening decisions and probabilities of consumers for one email.
+
+                Args
+                -------
+                email:                  Email_Object to dispatch.
+                perception_index, timespan, frequency, product_purchase, prior_email_opening, device_index, recent_openings:
+                                        Arrays of consumer states, see consumer_index.
+
+                Returns
+                -------
+                opening:                Array of opening decisions (1 = opens, 0 = does not open).
+                probability:            Array of opening probabilities.
+
+                """
+                length_index, sending_day_index = self.email_index(email)
+                index = self.consumer_index(perception_index, timespan, frequency, product_purchase, prior_email_opening, device_index, recent_openings)
+                opening = self.decision[length_index, sending_day_index].reshape(-1)[index]
+                probability = self.probability[length_index, sending_day_index].reshape(-1)[index]
+                return opening, probability
+
+        def verify(self, simulation=None, sample_size=10000):
+                """
+                Checks the compiled table against the scalar interpreter of the spec.
+                Every compiled term is checked on all combinations of its inputs in the table,
+                the sum of the terms on a fixed sample of table cells.
+                Tables of the spec of DEFAULT_COEFFICIENTS are also checked against Simulation.calculate_opening over the full input space.
+
+                Args
+                -------
+                simulation:             Simulation object providing calculate_opening. None skips that check.
+                sample_size:            Amount of table cells checked against the interpreter of the whole spec.
+
+                Returns
+                -------
+                None
+
+                """
+                inputs = self.grid_inputs(lambda *axes: axes)
+                for term, evaluate in zip(self.spec["terms"], self.model.terms):
+                        names = term_inputs(term)
+                        for values in itertools.product(*[inputs[name] for name in names]):
+                                point = dict(zip(names, values))
+                                if abs(evaluate(point) - interpret_term(term, point)) > 1e-9:
+                                        raise ValueError("Compiled opening model term %s differs from the spec at %s." % (term.get("name", term["input"]), point))
+                # Own generator, so that the global random state of the run is not changed
+                cells = np.random.default_rng(0).choice(self.decision.size, min(sample_size, self.decision.size), replace=False)
+                for cell in zip(*np.unravel_index(np.sort(cells), self.decision.shape)):
+                        probability = interpret(self.spec, {name: values[position] for (name, values), position in zip(inputs.items(), cell)})
+                        # Decisions within rounding of the compiled sum are not decided by the spec
+                        if abs(probability - self.probability[cell]) > 1e-6 or (abs(probability - 0.5) > 1e-9 and round(probability) != self.decision[cell]):
+                                raise ValueError("Opening table differs from the opening model spec at %s." % (cell,))
+                if simulation is None or self.spec != create_spec():
+                        return
+                for length_index, sending_day_index in itertools.product(range(len(self.length_values)), range(len(DEFAULT_COEFFICIENTS["sending_day"]))):
+                        email = SimpleNamespace(length=self.length_values[length_index], sending_day=sending_day_index, sending_day_influence=DEFAULT_COEFFICIENTS["sending_day"][sending_day_index])
+                        for state in itertools.product(*[range(size) for size in self.consumer_shape]):
+                                perception_index, timespan_index, frequency, purchase, prior, device_index, _ = state
+                                consumer = SimpleNamespace(informative_perception=self.perception_values[perception_index],
+                                                           timespan=self.timespan_values[timespan_index],
+                                                           mailing_frequency=frequency,
+                                                           product_purchase=bool(purchase),
+                                                           prior_email_opening=bool(prior),
+                                                           device_influence=DEFAULT_COEFFICIENTS["device"][device_index])
+                                opening, personalization = simulation.calculate_opening(consumer, email)
+                                cell = (length_index, sending_day_index) + state
+                                if opening != self.decision[cell]:
+                                        raise ValueError("Opening table differs from calculate_opening at %s." % (cell,))
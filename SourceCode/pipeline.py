@@ -0,0 +1,235 @@
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+
+"""
+Pipelined output of the synthetic dataset.
+
+email_dispatch hands every campaign as a CampaignBatch of column arrays to the
+output. With the pipeline, every output (dataset rows, feature matrix, run
+artifacts, star schema, delivery) has its own writer thread with a bounded queue
+of campaigns. The simulation thread only blocks if a writer falls more than
+queue_campaigns campaigns behind, so scoring the next campaign overlaps with
+encoding and writing the previous ones. NumPy encoding and file output release
+the GIL, so the wall time of a run approaches max(compute, output) instead of
+their sum. Every writer receives the campaigns in dispatch order, so the output
+is the same as without the pipeline.
+"""
+
+class CampaignBatch:
+        def __init__(self, columns, email, sending_day, current_time):
+                """
+                Initilizes a batch with the consumer columns and the email of one campaign.
+
+                Args
+                -------
+                columns:                Dictionary of arrays per consumer: consumerID, Alter, Geschlecht and Endgerät (category indexes), Einkommen,
+                                        Informative Wahrnehmung, Frequenz, Zeitspanne vorherige E-Mail, Produktkauf, Öffnung vorherige E-Mail, Öffnung (bool).
+                email:                  Dispatched Email_Object.
+                sending_day:            Weekday name of the dispatch.
+                current_time:           Simulation time of the dispatch.
+
+                Returns
+                -------
+                None
+
+                """
+                self.columns = columns
+                self.email_id = email.emailID
+                self.length = email.length
+                self.information_value = email.information_value
+                self.sending_day_index = email.sending_day
+                self.sending_day = sending_day
+                self.current_time = current_time
+
+        def __len__(self):
+                return len(self.columns["consumerID"])
+
+        def rows(self):
+                """
+                Materializes the batch as rows of the synthetic dataset.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                rows:                   List of rows (dicts) of the synthetic dataset.
+
+                """
+                columns = self.columns
+                personalization = np.where(columns["Produktkauf"], "Produktbasierte Personalisierung", None)
+                return [{"consumerID": consumerID,
+                         "Alter": age,
+                         "Geschlecht": gender,
+                         "Einkommen": income,
+                         "Informative Wahrnehmung": informative_perception,
+                         "Frequenz": mailing_frequency,
+                         "Zeitspanne vorherige E-Mail": consumer_timespan,
+                         "Produktkauf": consumer_product_purchase,
+                         "Öffnung vorherige E-Mail": consumer_prior_email_opening,
+                         "Endgerät": device,
+                         "emailID": self.email_id,
+                         "Anzahl Wörter in Betreffzeile": self.length,
+                         "Informationsgehalt": self.information_value,
+                         "Personalisierung": consumer_personalization or False,
+                         "Versandtag": self.sending_day,
+                         "Simulationszeit": self.current_time,
+                         "Öffnung": "Ja" if consumer_opened else "Nein"}
+                        for consumerID, age, gender, income, informative_perception, mailing_frequency, consumer_timespan, consumer_product_purchase, consumer_prior_email_opening, device, consumer_personalization, consumer_opened in zip(
+                                columns["consumerID"].tolist(), columns["Alter"].tolist(), np.array(GENDER_CATEGORIES)[columns["Geschlecht"]].tolist(), columns["Einkommen"].tolist(),
+                                columns["Informative Wahrnehmung"].tolist(), columns["Frequenz"].tolist(), columns["Zeitspanne vorherige E-Mail"].tolist(), columns["Produktkauf"].tolist(),
+                                columns["Öffnung vorherige E-Mail"].tolist(), np.array(DEVICE_CATEGORIES)[columns["Endgerät"]].tolist(), personalization.tolist(), columns["Öffnung"].tolist())]
+
+        def frame(self):
+                """
+                Materializes the batch as DataFrame with the columns of the synthetic dataset, without building rows.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                df:                     DataFrame with the same values as the rows of the batch.
+
+                """
+                columns = self.columns
+                personalization = np.full(len(self), False, dtype=object)
+                personalization[columns["Produktkauf"]] = "Produktbasierte Personalisierung"
+                return pd.DataFrame({"consumerID": columns["consumerID"],
+                                     "Alter": columns["Alter"],
+                                     "Geschlecht": np.array(GENDER_CATEGORIES, dtype=object)[columns["Geschlecht"]],
+                                     "Einkommen": columns["Einkommen"],
+                                     "Informative Wahrnehmung": columns["Informative Wahrnehmung"],
+                                     "Frequenz": columns["Frequenz"],
+                                     "Zeitspanne vorherige E-Mail": columns["Zeitspanne vorherige E-Mail"],
+                                     "Produktkauf": columns["Produktkauf"],
+                                     "Öffnung vorherige E-Mail": columns["Öffnung vorherige E-Mail"],
+                                     "Endgerät": np.array(DEVICE_CATEGORIES, dtype=object)[columns["Endgerät"]],
+                                     "emailID": self.email_id,
+                                     "Anzahl Wörter in Betreffzeile": self.length,
+                                     "Informationsgehalt": self.information_value,
+                                     "Personalisierung": personalization,
+                                     "Versandtag": self.sending_day,
+                                     "Simulationszeit": self.current_time,
+                                     "Öffnung": np.where(columns["Öffnung"], "Ja", "Nein")})
+
+class OutputPipeline:
+        def __init__(self, writers, queue_campaigns=4):
+                """
+                Initilizes the pipeline and starts one writer thread per output.
+
+                Args
+                -------
+                writers:                Dictionary of output names and functions that write a CampaignBatch.
+                queue_campaigns:        Highest amount of campaigns waiting per writer before the simulation blocks.
+
+                Returns
+                -------
+                None
+
+                """
+                self.writers = writers
+                self.queues = {name: queue.Queue(maxsize=max(queue_campaigns, 1)) for name in writers}
+                self.busy_seconds = {name: 0.0 for name in writers}
+                self.blocked_seconds = 0.0
+                self.errors = []
+                self.threads = [threading.Thread(target=self.work, args=(name,), name="output-%s" % name, daemon=True) for name in writers]
+                for thread in self.threads:
+                        thread.start()
+
+        def work(self, name):
+                """
+                Writes the queued campaigns of one output in dispatch order until the pipeline is closed.
+                After an error the remaining campaigns are discarded, so that the simulation does not block.
+
+                Args
+                -------
+                name:                   Name of the output.
+
+                Returns
+                -------
+                None
+
+                """
+                writer = self.writers[name]
+                batches = self.queues[name]
+                failed = False
+                while True:
+                        batch = batches.get()
+                        if batch is None:
+                                return
+                        if failed:
+                                continue
+                        start = time.perf_counter()
+                        try:
+                                writer(batch)
+                        except Exception as error:
+                                self.errors.append((name, error))
+                                failed = True
+                        self.busy_seconds[name] += time.perf_counter() - start
+
+        def submit(self, batch):
+                """
+                Hands a campaign to all writers. Blocks while a writer queue is full.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                self.raise_errors()
+                start = time.perf_counter()
+                for batches in self.queues.values():
+                        batches.put(batch)
+                self.blocked_seconds += time.perf_counter() - start
+
+        def close(self):
+                """
+                Waits until all writers have written their queued campaigns and stops the threads.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                None
+
+                """
+                for batches in self.queues.values():
+                        batches.put(None)
+                for thread in self.threads:
+                        thread.join()
+                self.raise_errors()
+
+        def raise_errors(self):
+                """ Raises the first error of a writer thread in the simulation thread."""
+                if self.errors:
+                        name, error = self.errors[0]
+                        raise RuntimeError("Output %s failed: %s" % (name, error)) from error
+
+        def report(self):
+                """
+                Returns the time the simulation waited for the writers and the time each writer was busy.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                report:                 Dictionary of blocked seconds of the simulation and busy seconds per writer.
+
+                """
+                return {"blocked_seconds": self.blocked_seconds,
+                        "busy_seconds": dict(self.busy_seconds)}
@@ -0,0 +1,446 @@
+import numpy as np
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+
+"""
+Columnar store of the consumers in the simulation.
+
+Static attributes of the consumers are kept as arrays next to the dynamic
+attributes (product_purchase, prior_email_opening, dispatch history), so that a
+campaign can be evaluated for all consumers at once.
+
+The store grows with amortized doubling of its buffers. Unsubscribed consumers
+are marked in the active mask (tombstones) and removed by periodic compaction,
+so that the rows stay ordered by consumerID.
+
+A SegmentIndex registered as segment_index is informed about all changes.
+
+With shared_columns the static attributes are read-only arrays of another owner,
+e.g. a SharedPopulation of several campaign programs. Only the dynamic attributes
+are private. A shared store cannot grow and is not compacted, unsubscribed consumers
+stay as tombstones in the active mask.
+
+The behavior history keeps one sent bit and one opened bit per consumer and
+campaign, packed into 64-bit words (bit c of word c // 64 for campaign c), and a
+register of the openings of the last 64 received emails (bit 0 = last email).
+Counts over campaign windows, openings among the last n received emails and
+opening streaks are computed with popcounts on the words.
+"""
+
+STATIC_COLUMNS = ["consumer_id", "age", "income", "gender", "device", "informative_perception"]
+HISTORY_COLUMNS = ["sent_history", "open_history"]
+
+def popcount(words):
+        """
+        Counts the set bits of uint64 words (SWAR popcount).
+
+        Args
+        -------
+        words:                  Array of uint64 words.
+
+        Returns
+        -------
+        counts:                 Array of bit counts per word.
+
+        """
+        words = np.asarray(words, dtype=np.uint64)
+        words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        words = (words + (words >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return ((words * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+class Population:
+        def __init__(self, consumers, opening_table, history_size, compaction_threshold=0.25, behavior_history=True, shared_columns=None):
+                """
+                Initilizes the buffers and appends a list of consumers.
+
+                Args
+                -------
+                consumers:              List of consumers in simulation.
+                opening_table:          OpeningTable used to index the informative perception.
+                history_size:           Amount of dispatch days kept per consumer. Has to cover the maximum mailing frequency in 30 days.
+                compaction_threshold:   Share of tombstones at which unsubscribed consumers are removed.
+                behavior_history:       Keeps the sent and opened bits per campaign if True. The register of the last 64 received emails is always kept.
+                shared_columns:         Optional dictionary of read-only static columns, e.g. SharedPopulation.columns. Used instead of consumers.
+
+                Returns
+                -------
+                None
+
+                """
+                self.opening_table = opening_table
+                self.history_size = max(history_size, 1)
+                self.compaction_threshold = compaction_threshold
+                self.size = 0
+                self.tombstones = 0
+                self.segment_index = None
+                self.behavior_history = behavior_history
+                self.campaigns = 0
+                self.shared = shared_columns is not None
+                self.buffers = {"consumer_id": np.zeros(0, dtype=np.int64),
+                                "age": np.zeros(0, dtype=np.int64),
+                                "income": np.zeros(0, dtype=np.int64),
+                                "gender": np.zeros(0, dtype=np.int8),
+                                "device": np.zeros(0, dtype=np.int8),
+                                "informative_perception": np.zeros(0, dtype=np.float64),
+                                "perception_index": np.zeros(0, dtype=np.int8),
+                                # Dynamic attributes
+                                "active": np.zeros(0, dtype=bool),
+                                "product_purchase": np.zeros(0, dtype=bool),
+                                "prior_email_opening": np.zeros(0, dtype=bool),
+                                "purchase_day": np.zeros(0, dtype=np.int32),
+                                # Dispatch history as ring buffer of the last history_size dispatch days
+                                "mailing_days": np.zeros((0, self.history_size), dtype=np.int32),
+                                "mailing_counter": np.zeros(0, dtype=np.int32),
+                                # Behavior history as bit-packed words per campaign and register of the last 64 received emails
+                                "sent_history": np.zeros((0, 0), dtype=np.uint64),
+                                "open_history": np.zeros((0, 0), dtype=np.uint64),
+                                "recent_openings": np.zeros(0, dtype=np.uint64)}
+                if self.shared:
+                        self.attach(shared_columns)
+                        return
+                self.append({"consumer_id": [consumer.consumerID for consumer in consumers],
+                             "age": [consumer.age for consumer in consumers],
+                             "income": [consumer.income for consumer in consumers],
+                             "gender": [GENDER_CATEGORIES.index(consumer.gender) for consumer in consumers],
+                             "device": [DEVICE_CATEGORIES.index(consumer.device) for consumer in consumers],
+                             "informative_perception": [consumer.informative_perception for consumer in consumers]})
+
+        def __len__(self):
+                return self.size
+
+        def attach(self, columns):
+                """
+                Uses read-only static columns of another owner and allocates the private dynamic buffers.
+
+                Args
+                -------
+                columns:                Dictionary of static columns consumer_id, age, income, gender, device and informative_perception.
+
+                Returns
+                -------
+                None
+
+                """
+                amount = len(columns["consumer_id"])
+                for name, buffer in self.buffers.items():
+                        if name in STATIC_COLUMNS:
+                                self.buffers[name] = columns[name]
+                        else:
+                                self.buffers[name] = np.zeros((amount,) + buffer.shape[1:], dtype=buffer.dtype)
+                self.initialize_rows(slice(0, amount))
+                self.size = amount
+                self.refresh_views()
+
+        def refresh_views(self):
+                """ Exposes the used part of every buffer as attribute, e.g. self.age."""
+                for name, buffer in self.buffers.items():
+                        setattr(self, name, buffer[:self.size])
+
+        def reserve(self, capacity):
+                """
+                Grows all buffers to at least capacity rows by doubling.
+
+                Args
+                -------
+                capacity:               Required amount of rows.
+
+                Returns
+                -------
+                None
+
+                """
+                current_capacity = len(self.buffers["consumer_id"])
+                if capacity <= current_capacity:
+                        return
+                if self.shared:
+                        raise ValueError("A population with shared static columns cannot grow, signups are not supported.")
+                new_capacity = max(capacity, 2 * current_capacity, 16)
+                for name, buffer in self.buffers.items():
+                        grown = np.zeros((new_capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+                        grown[:self.size] = buffer[:self.size]
+                        self.buffers[name] = grown
+
+        def reserve_campaigns(self, campaigns):
+                """
+                Grows the words of the behavior history to at least campaigns bits by doubling.
+
+                Args
+                -------
+                campaigns:              Required amount of campaigns.
+
+                Returns
+                -------
+                None
+
+                """
+                required = -(-campaigns // 64)
+                current_words = self.buffers["sent_history"].shape[1]
+                if required <= current_words:
+                        return
+                new_words = max(required, 2 * current_words)
+                for name in HISTORY_COLUMNS:
+                        buffer = self.buffers[name]
+                        grown = np.zeros((len(buffer), new_words), dtype=np.uint64)
+                        grown[:, :current_words] = buffer
+                        self.buffers[name] = grown
+                self.refresh_views()
+
+        def append(self, columns):
+                """
+                Appends consumers in bulk, e.g. signups created by Consumer.generate_consumer_columns.
+                ConsumerIDs have to be higher than the consumerIDs in the store.
+
+                Args
+                -------
+                columns:                Dictionary of static columns consumer_id, age, income, gender, device and informative_perception.
+
+                Returns
+                -------
+                None
+
+                """
+                amount = len(columns["consumer_id"])
+                self.reserve(self.size + amount)
+                rows = slice(self.size, self.size + amount)
+                for name in STATIC_COLUMNS:
+                        self.buffers[name][rows] = columns[name]
+                self.initialize_rows(rows)
+                self.size += amount
+                self.refresh_views()
+                if self.segment_index is not None:
+                        self.segment_index.append(rows.start)
+
+        def initialize_rows(self, rows):
+                """ Sets the perception index and the initial dynamic attributes of new rows."""
+                self.buffers["perception_index"][rows] = self.opening_table.perception_index(self.buffers["informative_perception"][rows])
+                self.buffers["active"][rows] = True
+                self.buffers["product_purchase"][rows] = False
+                self.buffers["prior_email_opening"][rows] = False
+                self.buffers["purchase_day"][rows] = -1
+                self.buffers["mailing_days"][rows] = np.iinfo(np.int32).min
+                self.buffers["mailing_counter"][rows] = 0
+                self.buffers["sent_history"][rows] = 0
+                self.buffers["open_history"][rows] = 0
+                self.buffers["recent_openings"][rows] = 0
+
+        def unsubscribe(self, index):
+                """
+                Marks consumers as unsubscribed and compacts the store if the share of tombstones exceeds the threshold.
+
+                Args
+                -------
+                index:                  Array of row indexes of unsubscribing consumers.
+
+                Returns
+                -------
+                None
+
+                """
+                self.active[index] = False
+                self.tombstones = self.size - np.count_nonzero(self.active)
+                if self.segment_index is not None:
+                        self.segment_index.update("active", index)
+                if self.tombstones > self.compaction_threshold * self.size and not self.shared:
+                        self.compact()
+
+        def compact(self):
+                """ Removes unsubscribed consumers from all buffers. The order of consumerIDs is kept."""
+                keep = np.flatnonzero(self.active)
+                for name, buffer in self.buffers.items():
+                        buffer[:len(keep)] = buffer[keep]
+                self.size = len(keep)
+                self.tombstones = 0
+                self.refresh_views()
+                if self.segment_index is not None:
+                        self.segment_index.rebuild()
+
+        def active_index(self):
+                """
+                Returns the row indexes of subscribed consumers.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                index:                  Array of row indexes.
+
+                """
+                if self.tombstones == 0:
+                        return np.arange(self.size)
+                return np.flatnonzero(self.active)
+
+        def locate(self, consumer_ids):
+                """
+                Returns the row indexes of consumerIDs. ConsumerIDs that are not in the store are dropped.
+
+                Args
+                -------
+                consumer_ids:           Array of consumerIDs.
+
+                Returns
+                -------
+                index:                  Array of row indexes.
+
+                """
+                consumer_ids = np.asarray(consumer_ids, dtype=np.int64)
+                index = np.minimum(np.searchsorted(self.consumer_id, consumer_ids), max(self.size - 1, 0))
+                return index[self.consumer_id[index] == consumer_ids] if self.size > 0 else index[:0]
+
+        def calculate_frequency(self, current_day, index):
+                """
+                Calculates mailing frequency of the last 30 days of consumers.
+
+                Args
+                -------
+                current_day:            Current day in simulation.
+                index:                  Array of row indexes.
+
+                Returns
+                -------
+                frequency:              Amount of emails in the last 30 days per consumer.
+
+                """
+                return np.count_nonzero(self.mailing_days[index] >= current_day - 30, axis=1)
+
+        def calculate_timespan(self, current_day, index):
+                """
+                Calculates the timespan since the last email dispatch of consumers.
+
+                Args
+                -------
+                current_day:            Current day in simulation.
+                index:                  Array of row indexes.
+
+                Returns
+                -------
+                timespan:               Amount of days since last dispatch, 0 if no email was dispatched yet.
+
+                """
+                mailing_counter = self.mailing_counter[index]
+                last_day = self.mailing_days[index, (mailing_counter - 1) % self.history_size]
+                return np.where(mailing_counter > 0, current_day - last_day, 0)
+
+        def record_dispatch(self, index, current_day):
+                """
+                Stores an email dispatch in the history of the consumers at index.
+
+                Args
+                -------
+                index:                  Array of row indexes of the consumers that received the email.
+                current_day:            Current day in simulation.
+
+                Returns
+                -------
+                None
+
+                """
+                self.mailing_days[index, self.mailing_counter[index] % self.history_size] = current_day
+                self.mailing_counter[index] += 1
+
+        def record_purchase(self, consumer_ids, current_day):
+                """
+                Sets product_purchase for the consumers with consumer_ids.
+
+                Args
+                -------
+                consumer_ids:           Array of consumerIDs of the buyers.
+                current_day:            Current day in simulation.
+
+                Returns
+                -------
+                None
+
+                """
+                index = self.locate(consumer_ids)
+                self.product_purchase[index] = True
+                self.purchase_day[index] = current_day
+                if self.segment_index is not None:
+                        self.segment_index.update("product_purchase", index)
+
+        def record_opening(self, index, opened):
+                """
+                Sets prior_email_opening of the consumers at index to their reaction to the current email.
+
+                Args
+                -------
+                index:                  Array of row indexes of the consumers that received the email.
+                opened:                 Array of opening reactions.
+
+                Returns
+                -------
+                None
+
+                """
+                self.prior_email_opening[index] = opened
+                if self.segment_index is not None:
+                        self.segment_index.update("prior_email_opening", index)
+                self.recent_openings[index] = (self.recent_openings[index] << np.uint64(1)) | np.asarray(opened, dtype=np.uint64)
+                if self.behavior_history:
+                        self.reserve_campaigns(self.campaigns + 1)
+                        word = self.campaigns >> 6
+                        bit = np.uint64(1) << np.uint64(self.campaigns & 63)
+                        self.sent_history[index, word] |= bit
+                        self.open_history[np.asarray(index)[np.asarray(opened, dtype=bool)], word] |= bit
+                self.campaigns += 1
+
+        def count_history(self, index, window=None):
+                """
+                Counts the received and opened emails of consumers over the last window campaigns.
+
+                Args
+                -------
+                index:                  Array of row indexes.
+                window:                 Amount of last campaigns. All campaigns if None.
+
+                Returns
+                -------
+                sent:                   Amount of received emails per consumer.
+                opened:                 Amount of opened emails per consumer.
+
+                """
+                if not self.behavior_history:
+                        raise ValueError("Behavior history is disabled.")
+                words = -(-self.campaigns // 64)
+                first = 0 if window is None else max(self.campaigns - window, 0)
+                # Mask of the campaigns first to self.campaigns - 1 per word
+                positions = np.arange(words * 64).reshape(words, 64)
+                mask = np.packbits((positions >= first) & (positions < self.campaigns), axis=1, bitorder="little").view(np.uint64)[:, 0]
+                sent = popcount(self.sent_history[index, :words] & mask).sum(axis=1)
+                opened = popcount(self.open_history[index, :words] & mask).sum(axis=1)
+                return sent, opened
+
+        def count_recent_openings(self, index, window):
+                """
+                Counts the opened emails among the last window received emails of consumers.
+
+                Args
+                -------
+                index:                  Array of row indexes.
+                window:                 Amount of last received emails (1 to 64).
+
+                Returns
+                -------
+                opened:                 Amount of opened emails per consumer.
+
+                """
+                mask = np.uint64(0xFFFFFFFFFFFFFFFF) >> np.uint64(64 - window)
+                return popcount(self.recent_openings[index] & mask)
+
+        def calculate_streak(self, index):
+                """
+                Calculates the amount of consecutively opened emails up to the last received email, at most 64.
+
+                Args
+                -------
+                index:                  Array of row indexes.
+
+                Returns
+                -------
+                streak:                 Length of the current opening streak per consumer.
+
+                """
+                recent = self.recent_openings[index]
+                # Trailing ones of the register
+                return popcount(recent & ~(recent + np.uint64(1)))
@@ -0,0 +1,190 @@
+import os
+import json
+import random
+import multiprocessing
+import numpy as np
+import simpy
+from types import SimpleNamespace
+from datetime import datetime
+from consumer import Consumer
+from email_object import Email_Object
+from population import STATIC_COLUMNS
+from shared_population import SharedPopulation
+from sharding import DatasetWriter, derive_seed, write_output
+from telemetry import peak_memory
+import random_streams
+
+"""
+Concurrent campaign programs on one customer base.
+
+Several independent programs (e.g. brands with their own mailing frequency and
+buying profile) are simulated against the same consumers. The static consumer
+columns are created once and placed in shared memory (see shared_population.py).
+Every program runs in its own process with a seed derived from the master seed and
+keeps only its own state private: mailing calendar, purchase plan, contact and
+behavior history, purchase and subscription status. N programs therefore hold one
+copy of the static columns instead of N, and no process creates Consumer objects.
+Every program writes its campaigns to its dataset file as they are produced, so
+no process keeps the rows of its dataset in memory.
+
+Outputs are written per program like the outputs of a shard: dataset.csv and
+aggregates.json in a folder named after the program, and programs.json with the
+summary and memory use of all programs: the private population state and the peak
+resident set size of every process.
+
+Usage: python simulation.py programs <programs.json> <output folder> [--processes 0] [--seed 0]
+The programs file is a list of objects with a unique "name" and optional entries of
+PROGRAM_PARAMETERS. Missing entries fall back to config.cfg.
+"""
+
+PROGRAM_PARAMETERS = ["mailing_frequency_per_month", "buying_frequency_per_month", "share_buyers", "unsubscribe_rate_per_month", "segment"]
+SUMMARY_FILE = "programs.json"
+
+def read_programs(programs_path):
+        """
+        Reads and checks the campaign programs.
+
+        Args
+        -------
+        programs_path:                  Path of the JSON file with the list of programs.
+
+        Returns
+        -------
+        programs:                       List of program dictionaries.
+
+        """
+        with open(programs_path, encoding="utf-8") as file:
+                programs = json.load(file)
+        if not isinstance(programs, list) or not programs:
+                raise ValueError("The programs file has to contain a non-empty list of programs.")
+        names = [program.get("name", "") for program in programs]
+        if "" in names or len(set(names)) != len(names):
+                raise ValueError("Every program needs a unique name.")
+        for program in programs:
+                unknown = set(program) - set(PROGRAM_PARAMETERS) - {"name"}
+                if unknown:
+                        raise ValueError("Unknown parameters of program %s: %s." % (program["name"], ", ".join(sorted(unknown))))
+        return programs
+
+def create_purchase_list(consumer_ids, simulation_time_days, buying_frequency_per_month, share_buyers, timestep_size):
+        """
+        Creates the purchase list of a program from consumerIDs, without Consumer objects.
+
+        Args
+        -------
+        consumer_ids:                   Array of consumerIDs of the shared population.
+        simulation_time_days:           Specified simulation duration in days.
+        buying_frequency_per_month:     Buying frequency per month of the program.
+        share_buyers:                   Share of consumers who buy products of the program.
+        timestep_size:                  Specified time step size.
+
+        Returns
+        -------
+        purchase_list:                  List of buyers (consumerID and purchase_date) with purchase dates, as Consumer.create_purchase_list.
+
+        """
+        num_buyers = round(len(consumer_ids) * share_buyers)
+        buyer_ids = random_streams.sample("buyers", consumer_ids.tolist(), num_buyers)
+        purchase_list = []
+        for purchase_time, purchases in Consumer.create_purchase_schedule(simulation_time_days, buying_frequency_per_month, num_buyers, timestep_size):
+                purchase_list.extend((SimpleNamespace(consumerID=consumer_id, purchase_date=None), purchase_time) for consumer_id in buyer_ids[len(purchase_list):len(purchase_list) + purchases])
+        purchase_list.sort(key=lambda x: x[1])
+        return purchase_list
+
+def run_programs(simulation, programs, output_path, master_seed, processes=0):
+        """
+        Creates the shared population and simulates every program in its own process.
+
+        Args
+        -------
+        simulation:                     Non-interactive Simulation object with the parameters of config.cfg.
+        programs:                       List of programs, see read_programs.
+        output_path:                    Folder of the program outputs.
+        master_seed:                    Seed of the population and the programs.
+        processes:                      Amount of processes. One per program if 0.
+
+        Returns
+        -------
+        summary:                        Dictionary of shared bytes and the report of every program.
+
+        """
+        if simulation.options["signup_rate_per_month"] > 0:
+                raise ValueError("Campaign programs share a fixed population, SIGNUP_RATE_PER_MONTH has to be 0.")
+        consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = simulation.read_ini(simulation.path+"/config.cfg")
+        defaults = {"mailing_frequency_per_month": mailing_frequency_per_month,
+                    "buying_frequency_per_month": buying_frequency_per_month,
+                    "share_buyers": share_buyers,
+                    "unsubscribe_rate_per_month": simulation.options["unsubscribe_rate_per_month"],
+                    "segment": simulation.options["segment"]}
+        np.random.seed(master_seed)
+        random.seed(master_seed)
+        end_time = datetime.now()
+        os.makedirs(output_path, exist_ok=True)
+
+        shared_population = SharedPopulation.create(Consumer.generate_consumer_columns(consumer_amount, 1))
+        tasks = [(simulation, shared_population.describe(), dict(defaults, **program), derive_seed(master_seed, index), os.path.join(output_path, program["name"]), end_time, simulation_time_days, timestep_size, weekday_names)
+                 for index, program in enumerate(programs)]
+        try:
+                # Spawned processes attach the population instead of inheriting a copy of the parent
+                with multiprocessing.get_context("spawn").Pool(processes or len(programs), maxtasksperchild=1) as pool:
+                        reports = pool.starmap(run_program, tasks)
+        finally:
+                shared_bytes = shared_population.nbytes()
+                shared_population.close()
+
+        summary = {"master_seed": master_seed,
+                   "consumer_amount": consumer_amount,
+                   "shared_bytes": shared_bytes,
+                   "private_bytes": sum(report["private_bytes"] for report in reports),
+                   "peak_rss_bytes": sum(report["peak_rss_bytes"] for report in reports),
+                   "programs": reports}
+        with open(os.path.join(output_path, SUMMARY_FILE), "w", encoding="utf-8") as file:
+                json.dump(summary, file, indent=4, ensure_ascii=False)
+        return summary
+
+def run_program(simulation, descriptor, program, seed, program_path, end_time, simulation_time_days, timestep_size, weekday_names):
+        """
+        Simulates one program on the attached shared population and writes its dataset and aggregates.
+
+        Args
+        -------
+        simulation:                     Non-interactive Simulation object, copied into the process.
+        descriptor:                     Descriptor of the shared population, see SharedPopulation.describe.
+        program:                        Program with all entries of PROGRAM_PARAMETERS.
+        seed:                           Seed of the program.
+        program_path:                   Folder of the program output.
+        end_time:                       End of the simulation period, shared by all programs.
+        simulation_time_days:           Specified simulation duration in days.
+        timestep_size:                  Specified time step size.
+        weekday_names:                  Specified weekday names.
+
+        Returns
+        -------
+        report:                         Dictionary of name, rows, mailings, opening rate, purchases, private population bytes and peak resident set size of the program.
+
+        """
+        shared_population = SharedPopulation.attach(descriptor)
+        np.random.seed(seed)
+        random.seed(seed)
+        simulation.options["unsubscribe_rate_per_month"] = program["unsubscribe_rate_per_month"]
+        simulation.options["segment"] = program["segment"]
+        mailing_list = Email_Object.create_mailing_list(simulation_time_days, program["mailing_frequency_per_month"], timestep_size)
+        purchase_list = create_purchase_list(shared_population.columns["consumer_id"], simulation_time_days, program["buying_frequency_per_month"], program["share_buyers"], timestep_size)
+        os.makedirs(program_path, exist_ok=True)
+        simulation.dataset_writer = DatasetWriter(os.path.join(program_path, "dataset.csv"))
+
+        env = simpy.Environment()
+        env.process(simulation.simulation_process(env, weekday_names, len(shared_population), program["mailing_frequency_per_month"], program["buying_frequency_per_month"], program["share_buyers"], simulation_time_days, timestep_size,
+                                                  simulation_inputs=(shared_population.columns, purchase_list, mailing_list), end_time=end_time))
+        env.run(until=simulation_time_days)
+        write_output(simulation, program_path, len(shared_population))
+
+        population = simulation.population
+        return {"name": program["name"],
+                "seed": seed,
+                "rows": simulation.dataset_writer.rows,
+                "mailings": len(simulation.opening_data),
+                "opening_rate": float(np.mean([rate for _, rate in simulation.opening_data])) if simulation.opening_data else 0.0,
+                "purchases": sum(simulation.purchases_per_month.values()),
+                "private_bytes": int(sum(buffer.nbytes for name, buffer in population.buffers.items() if name not in STATIC_COLUMNS)),
+                "peak_rss_bytes": peak_memory()}
@@ -0,0 +1,194 @@
+import random
+import numpy as np
+from scipy.stats import binom
+from contextlib import contextmanager
+
+"""
+Named random substreams for variance reduction in scenario comparisons.
+
+Every random source of the simulation draws from its own stream, derived from the
+seed and the name of the source. Paired scenarios with the same seed therefore get
+the same consumers, email attributes and buyers (common random numbers), even if one
+scenario draws more values from a source, e.g. more emails with a higher mailing
+frequency. With antithetic=True all uniform draws u are replaced by 1 - u and all
+normal draws z by -z, so that a run and its antithetic twin are negatively correlated.
+Subsets without replacement, e.g. of unsubscribing consumers, are drawn from their
+stream but not mirrored.
+
+All draws are expressed as inverse transforms of uniform or normal draws. Without
+active streams the helpers fall back to the global random state of numpy and
+random, so runs seeded with np.random.seed are reproduced unchanged.
+"""
+
+STREAMS = ["gender", "device", "age_income", "subject_line", "sending_day", "buyers", "signups", "unsubscribes"]
+
+active = None
+
+class RandomStreams:
+        def __init__(self, seed, antithetic=False):
+                """
+                Initilizes one generator per named stream.
+
+                Args
+                -------
+                seed:                   Seed of the streams.
+                antithetic:             Mirrors all draws if True.
+
+                Returns
+                -------
+                None
+
+                """
+                self.seed = seed
+                self.antithetic = antithetic
+                self.generators = {name: np.random.default_rng(np.random.SeedSequence([seed, index])) for index, name in enumerate(STREAMS)}
+
+        def random(self, name, size=None):
+                """ Returns uniform draws in [0, 1) of a stream (mirrored to (0, 1] if antithetic)."""
+                values = self.generators[name].random(size)
+                return 1 - values if self.antithetic else values
+
+        def normal(self, name, size=None):
+                """ Returns standard normal draws of a stream (negated if antithetic)."""
+                values = self.generators[name].standard_normal(size)
+                return -values if self.antithetic else values
+
+@contextmanager
+def use(streams):
+        """
+        Activates streams for all draws inside the with block. None keeps the global random state.
+
+        Args
+        -------
+        streams:                        RandomStreams object or None.
+
+        Returns
+        -------
+        None
+
+        """
+        global active
+        previous = active
+        active = streams
+        try:
+                yield streams
+        finally:
+                active = previous
+
+def uniform(name, size=None):
+        """
+        Draws uniform values of a stream.
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        size:                           Amount of draws. A single value if None.
+
+        Returns
+        -------
+        values:                         Uniform draws.
+
+        """
+        if active is None:
+                return np.random.random(size)
+        return active.random(name, size)
+
+def normal(name, size=None):
+        """
+        Draws standard normal values of a stream.
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        size:                           Amount of draws. A single value if None.
+
+        Returns
+        -------
+        values:                         Standard normal draws.
+
+        """
+        if active is None:
+                return np.random.normal(0, 1, size)
+        return active.normal(name, size)
+
+def choice(name, categories, probabilities, size=None):
+        """
+        Draws categories with given probabilities, like np.random.choice.
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        categories:                     List of categories or amount of categories.
+        probabilities:                  Probabilities of the categories.
+        size:                           Amount of draws. A single category if None.
+
+        Returns
+        -------
+        values:                         Drawn categories.
+
+        """
+        if active is None:
+                return np.random.choice(categories, size=size, p=probabilities)
+        categories = np.arange(categories) if isinstance(categories, int) else np.asarray(categories)
+        cumulative = np.cumsum(probabilities) / np.sum(probabilities)
+        index = np.minimum(np.searchsorted(cumulative, active.random(name, size), side="right"), len(categories) - 1)
+        return categories[index]
+
+def binomial(name, trials, probability):
+        """
+        Draws the amount of successes of trials independent trials, like np.random.binomial.
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        trials:                         Amount of trials.
+        probability:                    Success probability per trial.
+
+        Returns
+        -------
+        successes:                      Amount of successes.
+
+        """
+        if active is None:
+                return np.random.binomial(trials, probability)
+        # Inverse transform of a single uniform draw
+        return int(binom.ppf(active.random(name), trials, probability))
+
+def sample(name, population, amount):
+        """
+        Draws amount elements without replacement, like random.sample.
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        population:                     List or array to draw from.
+        amount:                         Amount of drawn elements.
+
+        Returns
+        -------
+        sample:                         List of drawn elements.
+
+        """
+        if active is None:
+                return random.sample(population, amount)
+        order = np.argsort(active.random(name, len(population)), kind="stable")[:amount]
+        return [population[index] for index in order]
+
+def subset(name, values, amount):
+        """
+        Draws amount values of an array without replacement, like np.random.choice(values, amount, replace=False).
+
+        Args
+        -------
+        name:                           Name of the stream, see STREAMS.
+        values:                         Array to draw from.
+        amount:                         Amount of drawn values.
+
+        Returns
+        -------
+        subset:                         Array of drawn values.
+
+        """
+        if active is None:
+                return np.random.choice(values, amount, replace=False)
+        return active.generators[name].choice(values, amount, replace=False)
@@ -0,0 +1,204 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime, date
+from types import SimpleNamespace
+from consumer import DEVICE_CATEGORIES
+from opening_table import OpeningTable
+from pipeline import CampaignBatch
+from population import popcount
+from segment import TOKEN_PATTERN
+from sharding import write_output
+
+"""
+Re-scoring of a stored run with a changed opening model.
+
+The opening decision of a campaign is a deterministic function of the email and
+the state of the recipient before the dispatch. Recipients, timespan, mailing
+frequency, purchase state and all consumer attributes do not depend on openings:
+they follow from the random draws of population, calendar, purchases and
+unsubscribes. With LATENT_STATE_PATH, a run stores these pre-decision states per
+(consumer, campaign) as one columnar run file per campaign, together with the
+email attributes and the aggregates that do not depend on openings.
+
+rescore recomputes the openings with the opening model of config.cfg in one
+vectorized pass per campaign. prior_email_opening and the register of recent
+openings are carried from campaign to campaign per consumer, so the chains follow
+the new decisions. Population, calendar, purchases and the daily loop are not
+simulated again.
+
+Runs whose segment selects by prior_email_opening cannot be re-scored, because
+their recipients depend on the openings.
+
+Usage: python simulation.py rescore <latent state folder> [--output /results/rescored] [--analysis]
+"""
+
+LATENT_FILE = "latent.json"
+LATENT_TYPE = np.dtype([("consumer_id", np.int64), ("age", np.int16), ("income", np.int32), ("gender", np.int8), ("device", np.int8), ("informative_perception", np.float64),
+                        ("timespan", np.int32), ("frequency", np.int16), ("product_purchase", bool), ("opened", bool)])
+
+class LatentStateWriter:
+        def __init__(self, output_path):
+                """
+                Initilizes the writer and creates the folder of the latent states.
+
+                Args
+                -------
+                output_path:            Folder of the latent states.
+
+                Returns
+                -------
+                None
+
+                """
+                self.output_path = output_path
+                self.campaigns = []
+                self.max_frequency = 0
+                os.makedirs(output_path, exist_ok=True)
+
+        def write_batch(self, batch):
+                """
+                Writes the pre-decision states of the recipients of a campaign as run file.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                columns = batch.columns
+                states = np.zeros(len(batch), dtype=LATENT_TYPE)
+                states["consumer_id"] = columns["consumerID"]
+                states["age"] = columns["Alter"]
+                states["income"] = columns["Einkommen"]
+                states["gender"] = columns["Geschlecht"]
+                states["device"] = columns["Endgerät"]
+                states["informative_perception"] = columns["Informative Wahrnehmung"]
+                states["timespan"] = columns["Zeitspanne vorherige E-Mail"]
+                states["frequency"] = columns["Frequenz"]
+                states["product_purchase"] = columns["Produktkauf"]
+                states["opened"] = columns["Öffnung"]
+                path = "%05d.npy" % len(self.campaigns)
+                np.save(os.path.join(self.output_path, path), states)
+                self.max_frequency = max(self.max_frequency, int(states["frequency"].max()) if len(states) > 0 else 0)
+                self.campaigns.append({"file": path,
+                                       "emailID": int(batch.email_id),
+                                       "length": float(batch.length),
+                                       "information_value": int(batch.information_value),
+                                       "sending_day": int(batch.sending_day_index),
+                                       "sending_day_name": batch.sending_day,
+                                       "time": batch.current_time.isoformat()})
+
+        def close(self, simulation, parameters):
+                """
+                Writes the manifest of the latent states with the email attributes and the aggregates that do not depend on openings.
+
+                Args
+                -------
+                simulation:             Simulation object after the run.
+                parameters:             Parameters of the run.
+
+                Returns
+                -------
+                None
+
+                """
+                latent = {"parameters": dict(parameters, **{name: simulation.options[name] for name in ["opening_coefficients", "opening_model", "opening_history_window", "segment"]}),
+                          "max_frequency": self.max_frequency,
+                          "campaigns": self.campaigns,
+                          "global_timespan_data": [(day.isoformat(), value) for day, value in simulation.global_timespan_data],
+                          "mailings_per_month": simulation.mailings_per_month,
+                          "purchases_per_month": simulation.purchases_per_month}
+                temporary_path = os.path.join(self.output_path, LATENT_FILE + ".tmp")
+                with open(temporary_path, "w", encoding="utf-8") as file:
+                        json.dump(latent, file, indent=4, ensure_ascii=False)
+                os.replace(temporary_path, os.path.join(self.output_path, LATENT_FILE))
+
+def rescore(simulation, latent_path, output_path):
+        """
+        Recomputes the openings of a stored run with the opening model of simulation and writes dataset and aggregates.
+        Counters and time series of simulation are filled as after the run.
+
+        Args
+        -------
+        simulation:                     Non-interactive Simulation object with the opening model of config.cfg.
+        latent_path:                    Folder of the latent states of the run.
+        output_path:                    Folder of the re-scored dataset and aggregates.
+
+        Returns
+        -------
+        df:                             Re-scored synthetic dataset.
+        changed:                        Amount of rows whose opening changed.
+
+        """
+        with open(os.path.join(latent_path, LATENT_FILE), encoding="utf-8") as file:
+                latent = json.load(file)
+        parameters = latent["parameters"]
+        if "prior_email_opening" in TOKEN_PATTERN.findall(parameters["segment"]):
+                raise ValueError("The recipients of segment %s depend on the openings, the run cannot be re-scored." % parameters["segment"])
+        options = simulation.options
+        simulation.opening_table = OpeningTable(latent["max_frequency"], options["opening_coefficients"], options["opening_history_window"], options["opening_model"])
+        simulation.opening_table.verify(simulation)
+        history_window = simulation.opening_table.history_window
+        history_mask = np.uint64(0xFFFFFFFFFFFFFFFF) >> np.uint64(64 - history_window) if history_window > 0 else np.uint64(0)
+
+        """
+        State per distinct consumer: prior email opening and register of the last 64 openings.
+        """
+        consumer_ids = np.zeros(0, dtype=np.int64)
+        for campaign in latent["campaigns"]:
+                consumer_ids = np.union1d(consumer_ids, np.load(os.path.join(latent_path, campaign["file"]), mmap_mode="r")["consumer_id"])
+        prior_email_opening = np.zeros(len(consumer_ids), dtype=bool)
+        recent_openings = np.zeros(len(consumer_ids), dtype=np.uint64)
+
+        frames = []
+        changed = 0
+        simulation.opening_data = []
+        simulation.campaign_counts = []
+        for campaign in latent["campaigns"]:
+                states = np.load(os.path.join(latent_path, campaign["file"]))
+                rows = np.searchsorted(consumer_ids, states["consumer_id"])
+                prior = prior_email_opening[rows]
+                recent = popcount(recent_openings[rows] & history_mask) if history_window > 0 else 0
+                email = SimpleNamespace(emailID=campaign["emailID"], length=campaign["length"], information_value=campaign["information_value"], sending_day=campaign["sending_day"])
+                opening, _ = simulation.opening_table.decide(email, simulation.opening_table.perception_index(states["informative_perception"]), states["timespan"], states["frequency"].astype(np.int64),
+                                                             states["product_purchase"], prior, states["device"], recent)
+                opened = opening == 1
+                prior_email_opening[rows] = opened
+                recent_openings[rows] = (recent_openings[rows] << np.uint64(1)) | opened.astype(np.uint64)
+                changed += int(np.count_nonzero(opened != states["opened"]))
+
+                current_time = datetime.fromisoformat(campaign["time"])
+                batch = CampaignBatch({"consumerID": states["consumer_id"],
+                                       "Alter": states["age"].astype(np.int64),
+                                       "Geschlecht": states["gender"],
+                                       "Einkommen": states["income"].astype(np.int64),
+                                       "Informative Wahrnehmung": states["informative_perception"],
+                                       "Frequenz": states["frequency"].astype(np.int64),
+                                       "Zeitspanne vorherige E-Mail": states["timespan"].astype(np.int64),
+                                       "Produktkauf": states["product_purchase"],
+                                       "Öffnung vorherige E-Mail": prior,
+                                       "Endgerät": states["device"],
+                                       "Öffnung": opened}, email, campaign["sending_day_name"], current_time)
+                frames.append(batch.frame())
+                simulation.count_device_openings(np.bincount(states["device"], minlength=len(DEVICE_CATEGORIES)), np.bincount(states["device"][opened], minlength=len(DEVICE_CATEGORIES)))
+                simulation.opening_data.append((current_time.date(), np.count_nonzero(opened) / len(opened) if len(opened) > 0 else 0))
+                simulation.campaign_counts.append((len(opened), int(np.count_nonzero(opened))))
+
+        """
+        Aggregates that do not depend on openings are taken from the run.
+        """
+        simulation.global_timespan_data = [(date.fromisoformat(day), value) for day, value in latent["global_timespan_data"]]
+        simulation.mailings_per_month = latent["mailings_per_month"]
+        simulation.purchases_per_month = latent["purchases_per_month"]
+        simulation.global_opening_data = []
+        for day, _ in simulation.global_timespan_data:
+                campaign_rates = [rate for campaign_date, rate in simulation.opening_data if campaign_date <= day]
+                simulation.global_opening_data.append((day, sum(campaign_rates) / len(campaign_rates)))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        write_output(simulation, output_path, parameters["consumer_amount"], df)
+        return df, changed
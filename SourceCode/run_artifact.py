@@ -0,0 +1,317 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from datetime import datetime, date
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+from star_schema import WIDE_COLUMNS
+
+"""
+Self-describing artifact directory of a simulation run.
+
+<run-dir>/
+        manifest.json           Format, column types and categories, shards, parameters of the run.
+        config.cfg              Snapshot of the configuration of the run.
+        dataset/part-<i>/       Dataset shard with one .npy file per column.
+        timeseries.json         Opening rate per campaign, average opening rate and timespan per day.
+        counters.json           Mailings, purchases, signups and unsubscribes per month.
+
+Text columns are stored as int8 codes with the categories in the manifest, so that
+every column can be memory-mapped. RunArtifact scans the shards lazily.
+"""
+
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 1
+COLUMN_TYPES = {"consumerID": "int64",
+                "Alter": "int64",
+                "Geschlecht": "int8",
+                "Einkommen": "int64",
+                "Informative Wahrnehmung": "float64",
+                "Frequenz": "int64",
+                "Zeitspanne vorherige E-Mail": "int64",
+                "Produktkauf": "bool",
+                "Öffnung vorherige E-Mail": "bool",
+                "Endgerät": "int8",
+                "emailID": "int64",
+                "Anzahl Wörter in Betreffzeile": "float64",
+                "Informationsgehalt": "int64",
+                "Personalisierung": "int8",
+                "Versandtag": "int8",
+                "Simulationszeit": "datetime64[us]",
+                "Öffnung": "int8"}
+
+class RunArtifactWriter:
+        def __init__(self, output_path, shard_rows, weekday_names):
+                """
+                Initilizes the writer and creates the run directory.
+
+                Args
+                -------
+                output_path:            Folder of the run.
+                shard_rows:             Maximum amount of rows per dataset shard.
+                weekday_names:          Weekday names of the Versandtag column.
+
+                Returns
+                -------
+                None
+
+                """
+                self.output_path = output_path
+                self.shard_rows = shard_rows
+                self.categories = {"Geschlecht": GENDER_CATEGORIES,
+                                   "Endgerät": DEVICE_CATEGORIES,
+                                   "Personalisierung": [False, "Produktbasierte Personalisierung", "Keine Personalisierung"],
+                                   "Versandtag": list(weekday_names),
+                                   "Öffnung": ["Nein", "Ja"]}
+                self.codes = {column: {value: code for code, value in enumerate(categories)} for column, categories in self.categories.items()}
+                self.buffer = []
+                self.buffered_rows = 0
+                self.shards = []
+                os.makedirs(os.path.join(self.output_path, "dataset"), exist_ok=True)
+
+        def encode_batch(self, batch):
+                """
+                Encodes a campaign into the stored column types.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                columns:                Dictionary of column names and arrays, codes for text columns.
+
+                """
+                columns = batch.columns
+                rows = len(batch)
+                return {"consumerID": columns["consumerID"].astype(np.int64),
+                        "Alter": columns["Alter"].astype(np.int64),
+                        "Geschlecht": columns["Geschlecht"].astype(np.int8),
+                        "Einkommen": columns["Einkommen"].astype(np.int64),
+                        "Informative Wahrnehmung": columns["Informative Wahrnehmung"].astype(np.float64),
+                        "Frequenz": columns["Frequenz"].astype(np.int64),
+                        "Zeitspanne vorherige E-Mail": columns["Zeitspanne vorherige E-Mail"].astype(np.int64),
+                        "Produktkauf": columns["Produktkauf"].astype(bool),
+                        "Öffnung vorherige E-Mail": columns["Öffnung vorherige E-Mail"].astype(bool),
+                        "Endgerät": columns["Endgerät"].astype(np.int8),
+                        "emailID": np.full(rows, batch.email_id, dtype=np.int64),
+                        "Anzahl Wörter in Betreffzeile": np.full(rows, batch.length, dtype=np.float64),
+                        "Informationsgehalt": np.full(rows, batch.information_value, dtype=np.int64),
+                        # Code 1 is "Produktbasierte Personalisierung", code 0 no personalization
+                        "Personalisierung": columns["Produktkauf"].astype(np.int8),
+                        "Versandtag": np.full(rows, self.codes["Versandtag"][batch.sending_day], dtype=np.int8),
+                        "Simulationszeit": np.full(rows, np.datetime64(batch.current_time, "us")),
+                        "Öffnung": columns["Öffnung"].astype(np.int8)}
+
+        def write_batch(self, batch):
+                """
+                Buffers the columns of a campaign and writes full shards.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                if len(batch) == 0:
+                        return
+                self.buffer.append(self.encode_batch(batch))
+                self.buffered_rows += len(batch)
+                while self.buffered_rows >= self.shard_rows:
+                        self.flush(self.shard_rows)
+
+        def flush(self, row_amount):
+                """
+                Writes the first row_amount buffered rows as a dataset shard with one .npy file per column.
+
+                Args
+                -------
+                row_amount:             Amount of rows to write into the shard.
+
+                Returns
+                -------
+                None
+
+                """
+                name = "part-%05d" % len(self.shards)
+                shard_path = os.path.join(self.output_path, "dataset", name)
+                os.makedirs(shard_path, exist_ok=True)
+                remaining = {}
+                for index, column in enumerate(WIDE_COLUMNS):
+                        values = np.concatenate([chunk[column] for chunk in self.buffer])
+                        np.save(os.path.join(shard_path, "%02d.npy" % index), values[:row_amount])
+                        remaining[column] = values[row_amount:]
+                self.shards.append({"name": name, "rows": int(row_amount)})
+                self.buffer = [remaining]
+                self.buffered_rows -= row_amount
+
+        def close(self, simulation, parameters, config_path):
+                """
+                Writes the remaining rows, time series, counters, config snapshot and manifest of the run.
+
+                Args
+                -------
+                simulation:             Simulation object after the run.
+                parameters:             Dictionary of the input parameters of read_ini, e.g. consumer_amount.
+                config_path:            Path of the config.cfg of the run.
+
+                Returns
+                -------
+                None
+
+                """
+                if self.buffered_rows > 0:
+                        self.flush(self.buffered_rows)
+                with open(os.path.join(self.output_path, "timeseries.json"), "w", encoding="utf-8") as file:
+                        json.dump({"opening_data": [(day.isoformat(), rate) for day, rate in simulation.opening_data],
+                                   "global_opening_data": [(day.isoformat(), rate) for day, rate in simulation.global_opening_data],
+                                   "global_timespan_data": [(day.isoformat(), timespan) for day, timespan in simulation.global_timespan_data]}, file)
+                with open(os.path.join(self.output_path, "counters.json"), "w", encoding="utf-8") as file:
+                        json.dump({"mailings_per_month": simulation.mailings_per_month,
+                                   "purchases_per_month": simulation.purchases_per_month,
+                                   "signups_per_month": simulation.signups_per_month,
+                                   "unsubscribes_per_month": simulation.unsubscribes_per_month}, file, indent=4)
+                if os.path.exists(config_path):
+                        shutil.copyfile(config_path, os.path.join(self.output_path, "config.cfg"))
+                manifest = {"format_version": FORMAT_VERSION,
+                            "created": datetime.now().isoformat(),
+                            "end_time": simulation.end_time.isoformat(),
+                            "rows": sum(shard["rows"] for shard in self.shards),
+                            "columns": [{"name": column, "file": "%02d.npy" % index, "type": COLUMN_TYPES[column], "categories": self.categories.get(column)} for index, column in enumerate(WIDE_COLUMNS)],
+                            "shards": self.shards,
+                            "parameters": parameters,
+                            "options": {name: value for name, value in simulation.options.items() if isinstance(value, (str, int, float, bool, list, dict, type(None)))}}
+                with open(os.path.join(self.output_path, MANIFEST_FILE), "w", encoding="utf-8") as file:
+                        json.dump(manifest, file, indent=4, ensure_ascii=False)
+
+class RunArtifact:
+        def __init__(self, run_path):
+                """
+                Opens the manifest of a stored run.
+
+                Args
+                -------
+                run_path:               Folder of the run.
+
+                Returns
+                -------
+                None
+
+                """
+                self.run_path = run_path
+                with open(os.path.join(run_path, MANIFEST_FILE), encoding="utf-8") as file:
+                        self.manifest = json.load(file)
+                if self.manifest["format_version"] > FORMAT_VERSION:
+                        raise ValueError("Run artifact format %d is newer than the supported format %d." % (self.manifest["format_version"], FORMAT_VERSION))
+                self.columns = {column["name"]: column for column in self.manifest["columns"]}
+                self.end_time = datetime.fromisoformat(self.manifest["end_time"])
+
+        def shards(self, columns):
+                """
+                Iterates lazily over the dataset shards with memory-mapped columns.
+
+                Args
+                -------
+                columns:                Names of the columns to map.
+
+                Returns
+                -------
+                shards:                 Generator of dictionaries of column names and memory-mapped arrays (codes for text columns).
+
+                """
+                for shard in self.manifest["shards"]:
+                        shard_path = os.path.join(self.run_path, "dataset", shard["name"])
+                        yield {column: np.load(os.path.join(shard_path, self.columns[column]["file"]), mmap_mode="r") for column in columns}
+
+        def decode(self, column, values):
+                """
+                Converts stored values of a column back to the values of the synthetic dataset.
+
+                Args
+                -------
+                column:                 Name of the column.
+                values:                 Array of stored values.
+
+                Returns
+                -------
+                values:                 Array of decoded values.
+
+                """
+                categories = self.columns[column]["categories"]
+                if categories is None:
+                        return np.asarray(values)
+                return np.array(categories, dtype=object)[values]
+
+        def first_rows(self, key):
+                """
+                Collects the first row of every distinct value of a key column, like DataFrame.drop_duplicates(key).
+                Only the rows of new keys are read from each shard.
+
+                Args
+                -------
+                key:                    Key column, e.g. consumerID or emailID.
+
+                Returns
+                -------
+                df:                     DataFrame with the first row per key in order of appearance.
+
+                """
+                seen = np.zeros(0, dtype=np.int64)
+                parts = []
+                for shard in self.shards(WIDE_COLUMNS):
+                        keys, first = np.unique(shard[key], return_index=True)
+                        new = ~np.isin(keys, seen)
+                        seen = np.union1d(seen, keys[new])
+                        positions = np.sort(first[new])
+                        parts.append(pd.DataFrame({column: self.decode(column, shard[column][positions]) for column in WIDE_COLUMNS}))
+                if not parts:
+                        return pd.DataFrame(columns=WIDE_COLUMNS)
+                return pd.concat(parts, ignore_index=True)
+
+        def value_counts(self, group, value):
+                """
+                Counts the rows per group and value of two integer-coded columns, e.g. Endgerät and Alter.
+
+                Args
+                -------
+                group:                  Name of the group column.
+                value:                  Name of the value column.
+
+                Returns
+                -------
+                counts:                 Series of row counts with a (group, value) index.
+
+                """
+                counts = {}
+                for shard in self.shards([group, value]):
+                        pairs, amount = np.unique(np.stack([np.asarray(shard[group], dtype=np.int64), np.asarray(shard[value], dtype=np.int64)]), axis=1, return_counts=True)
+                        for (group_code, value_code), count in zip(pairs.T.tolist(), amount.tolist()):
+                                counts[(group_code, value_code)] = counts.get((group_code, value_code), 0) + count
+                index = pd.MultiIndex.from_tuples([(self.decode(group, np.array([group_code]))[0], value_code) for group_code, value_code in counts], names=[group, value])
+                return pd.Series(list(counts.values()), index=index).sort_index()
+
+        def restore(self, simulation):
+                """
+                Loads time series and counters of the run into a Simulation object for the report.
+
+                Args
+                -------
+                simulation:             Non-interactive Simulation object.
+
+                Returns
+                -------
+                None
+
+                """
+                with open(os.path.join(self.run_path, "timeseries.json"), encoding="utf-8") as file:
+                        timeseries = json.load(file)
+                for name in ["opening_data", "global_opening_data", "global_timespan_data"]:
+                        setattr(simulation, name, [(date.fromisoformat(day), value) for day, value in timeseries[name]])
+                with open(os.path.join(self.run_path, "counters.json"), encoding="utf-8") as file:
+                        counters = json.load(file)
+                for name, values in counters.items():
+                        setattr(simulation, name, values)
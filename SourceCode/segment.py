@@ -0,0 +1,304 @@
+import re
+import numpy as np
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+
+"""
+Bitmap index over the population for targeted dispatch to consumer segments.
+
+Every attribute value (age band, income band, gender, device) and every dynamic
+state (product_purchase, prior_email_opening, active) is kept as a bitmap with one
+bit per row of the population, packed into 64-bit words. Segment expressions are
+compiled once and evaluated with bitwise operations on the words, so a lookup
+touches n/64 words instead of n consumers, and the row indexes are extracted from
+the non-zero words only. Changes of dynamic states only set and clear the bits of
+the changed rows.
+
+Segment expressions combine terms with and, or, not and parentheses, e.g.
+        product_purchase
+        device:Mobil and age:50+
+        prior_email_opening and not income:niedrig
+Terms are age:<band>, income:<band>, gender:<category>, device:<category>,
+product_purchase and prior_email_opening. age:<x>+ selects all consumers aged x or
+older: whole bands if x is a band bound, an own age bitmap otherwise.
+"""
+
+MINIMUM_AGE = 18 # Youngest consumer, so age:18+ selects the first band as a whole
+AGE_BANDS = [("18-29", 0, 30), ("30-39", 30, 40), ("40-49", 40, 50), ("50-59", 50, 60), ("60+", 60, np.inf)]
+# Income bands follow the income thresholds of the informative perception
+INCOME_BANDS = [("niedrig", 0, 7584), ("mittel", 7584, 15168), ("hoch", 15168, np.inf)]
+FLAGS = ["product_purchase", "prior_email_opening"]
+TOKEN_PATTERN = re.compile(r"\(|\)|[^\s()]+")
+
+class SegmentIndex:
+        def __init__(self, population):
+                """
+                Initilizes the bitmaps of a population and registers the index at the population,
+                so that changes of the population are applied to the bitmaps.
+
+                Args
+                -------
+                population:             Population to index.
+
+                Returns
+                -------
+                None
+
+                """
+                self.population = population
+                self.predicates = {}
+                for name, lower, upper in AGE_BANDS:
+                        self.predicates["age:" + name] = ("age", lambda values, lower=lower, upper=upper: (values >= lower) & (values < upper))
+                for name, lower, upper in INCOME_BANDS:
+                        self.predicates["income:" + name] = ("income", lambda values, lower=lower, upper=upper: (values >= lower) & (values < upper))
+                for code, name in enumerate(GENDER_CATEGORIES):
+                        self.predicates["gender:" + name] = ("gender", lambda values, code=code: values == code)
+                for code, name in enumerate(DEVICE_CATEGORIES):
+                        self.predicates["device:" + name] = ("device", lambda values, code=code: values == code)
+                for name in FLAGS + ["active"]:
+                        self.predicates[name] = (name, lambda values: values.astype(bool))
+                self.rebuild()
+                population.segment_index = self
+
+        def pack(self, column, predicate, words):
+                """
+                Computes the bitmap words at the word indexes words from a population column.
+
+                Args
+                -------
+                column:                 Name of the population column.
+                predicate:              Function that maps column values to booleans.
+                words:                  Array of word indexes.
+
+                Returns
+                -------
+                packed:                 Array of uint64 words.
+
+                """
+                size = len(self.population)
+                rows = words[:, None] * 64 + np.arange(64)
+                values = predicate(getattr(self.population, column)[np.minimum(rows, max(size - 1, 0))]) & (rows < size) if size > 0 else np.zeros(rows.shape, dtype=bool)
+                return np.packbits(values, axis=1, bitorder="little").view(np.uint64)[:, 0]
+
+        def rebuild(self):
+                """ Builds all bitmaps, e.g. after the compaction of the population."""
+                self.capacity = max(-(-len(self.population) // 64), 1)
+                words = np.arange(-(-len(self.population) // 64))
+                self.bitmaps = {}
+                for key, (column, predicate) in self.predicates.items():
+                        self.bitmaps[key] = np.zeros(self.capacity, dtype=np.uint64)
+                        self.bitmaps[key][:len(words)] = self.pack(column, predicate, words)
+
+        def update(self, column, index):
+                """
+                Sets the bits of the rows at index to the current values of a dynamic column.
+
+                Args
+                -------
+                column:                 Name of the changed population column (product_purchase, prior_email_opening or active).
+                index:                  Array of changed row indexes.
+
+                Returns
+                -------
+                None
+
+                """
+                index = np.asarray(index, dtype=np.int64)
+                # Indexes of a dispatch are already sorted and unique
+                if len(index) > 1 and not (index[1:] > index[:-1]).all():
+                        index = np.unique(index)
+                if len(index) == 0:
+                        return
+                values = getattr(self.population, column)[index].astype(bool)
+                words = index >> 6
+                bits = np.left_shift(np.uint64(1), (index & 63).astype(np.uint64))
+                starts = np.flatnonzero(np.concatenate(([True], words[1:] != words[:-1])))
+                set_mask = np.bitwise_or.reduceat(np.where(values, bits, np.uint64(0)), starts)
+                clear_mask = np.bitwise_or.reduceat(np.where(values, np.uint64(0), bits), starts)
+                words = words[starts]
+                bitmap = self.bitmaps[column]
+                bitmap[words] = (bitmap[words] & ~clear_mask) | set_mask
+
+        def append(self, first_row):
+                """
+                Adds the rows from first_row on, e.g. signups, to all bitmaps. The words grow by doubling.
+
+                Args
+                -------
+                first_row:              Index of the first appended row.
+
+                Returns
+                -------
+                None
+
+                """
+                required = -(-len(self.population) // 64)
+                if required > self.capacity:
+                        self.capacity = max(required, 2 * self.capacity)
+                        for key, bitmap in self.bitmaps.items():
+                                grown = np.zeros(self.capacity, dtype=np.uint64)
+                                grown[:len(bitmap)] = bitmap
+                                self.bitmaps[key] = grown
+                words = np.arange(first_row >> 6, required)
+                for key, (column, predicate) in self.predicates.items():
+                        self.bitmaps[key][words] = self.pack(column, predicate, words)
+
+        def compile(self, expression):
+                """
+                Parses a segment expression into a tree of bitmap keys and operators.
+
+                Args
+                -------
+                expression:             Segment expression, see module description.
+
+                Returns
+                -------
+                tree:                   Nested tuples ("or"/"and", left, right), ("not", operand) and ("bitmap", keys).
+
+                """
+                tokens = TOKEN_PATTERN.findall(expression)
+                position = 0
+                bitmap_keys = []
+
+                def peek():
+                        return tokens[position] if position < len(tokens) else None
+
+                def take():
+                        nonlocal position
+                        if position >= len(tokens):
+                                raise ValueError("Unexpected end of segment expression: %s" % expression)
+                        position += 1
+                        return tokens[position - 1]
+
+                def parse_or():
+                        tree = parse_and()
+                        while peek() == "or":
+                                take()
+                                tree = ("or", tree, parse_and())
+                        return tree
+
+                def parse_and():
+                        tree = parse_not()
+                        while peek() == "and":
+                                take()
+                                tree = ("and", tree, parse_not())
+                        return tree
+
+                def parse_not():
+                        token = take()
+                        if token == "not":
+                                return ("not", parse_not())
+                        if token == "(":
+                                tree = parse_or()
+                                if take() != ")":
+                                        raise ValueError("Missing closing parenthesis in segment expression: %s" % expression)
+                                return tree
+                        keys = self.keys(token)
+                        bitmap_keys.extend(keys)
+                        return ("bitmap", keys)
+
+                tree = parse_or()
+                if peek() is not None:
+                        raise ValueError("Unexpected term %s in segment expression: %s" % (peek(), expression))
+                # Bitmaps of age bounds inside a band are only added once the whole expression is valid
+                for key in bitmap_keys:
+                        if key not in self.bitmaps:
+                                self.add_age_bound(key)
+                return tree
+
+        def keys(self, term):
+                """
+                Returns the bitmap keys of a term. The bitmaps of the keys are combined with or.
+                An age bound inside a band is returned as its own key, its bitmap is added by add_age_bound.
+
+                Args
+                -------
+                term:                   Term of a segment expression, e.g. device:Mobil or age:50+.
+
+                Returns
+                -------
+                keys:                   List of bitmap keys.
+
+                """
+                if term in self.predicates and term != "active":
+                        return [term]
+                if term.startswith("age:") and term.endswith("+") and term[4:-1].isdigit():
+                        lower = int(term[4:-1])
+                        band_lowers = [max(band_lower, MINIMUM_AGE) for _, band_lower, _ in AGE_BANDS]
+                        if lower <= MINIMUM_AGE or lower in band_lowers:
+                                return ["age:" + name for (name, _, _), band_lower in zip(AGE_BANDS, band_lowers) if band_lower >= lower]
+                        return [term]
+                raise ValueError("Unknown segment term %s. Known terms: %s, age:<x>+." % (term, ", ".join(key for key in self.predicates if key != "active")))
+
+        def add_age_bound(self, term):
+                """
+                Adds the bitmap of an age bound inside a band, which is kept up to date like the band bitmaps.
+
+                Args
+                -------
+                term:                   Age bound term age:<x>+, e.g. age:35+.
+
+                Returns
+                -------
+                None
+
+                """
+                lower = int(term[4:-1])
+                self.predicates[term] = ("age", lambda values, lower=lower: values >= lower)
+                words = np.arange(-(-len(self.population) // 64))
+                self.bitmaps[term] = np.zeros(self.capacity, dtype=np.uint64)
+                self.bitmaps[term][:len(words)] = self.pack(*self.predicates[term], words)
+
+        def evaluate(self, tree):
+                """
+                Evaluates a compiled segment expression with bitwise operations.
+
+                Args
+                -------
+                tree:                   Compiled segment expression.
+
+                Returns
+                -------
+                words:                  Bitmap of the segment as array of uint64 words.
+
+                """
+                operator = tree[0]
+                if operator == "bitmap":
+                        words = self.bitmaps[tree[1][0]]
+                        for key in tree[1][1:]:
+                                words = words | self.bitmaps[key]
+                        return words
+                if operator == "not":
+                        return ~self.evaluate(tree[1])
+                if operator == "and":
+                        return self.evaluate(tree[1]) & self.evaluate(tree[2])
+                return self.evaluate(tree[1]) | self.evaluate(tree[2])
+
+        def select(self, tree):
+                """
+                Returns the row indexes of the subscribed consumers in a segment.
+
+                Args
+                -------
+                tree:                   Compiled segment expression.
+
+                Returns
+                -------
+                index:                  Sorted array of row indexes.
+
+                """
+                words = self.evaluate(tree) & self.bitmaps["active"]
+                nonzero = np.flatnonzero(words)
+                words = words[nonzero]
+                base = nonzero * 64
+                index = []
+                # Extracts the lowest set bit of all remaining words per iteration
+                while len(words) > 0:
+                        lowest = words & (~words + np.uint64(1))
+                        index.append(base + np.log2(lowest).astype(np.int64))
+                        words = words ^ lowest
+                        remaining = words != 0
+                        words = words[remaining]
+                        base = base[remaining]
+                index = np.concatenate(index) if index else np.zeros(0, dtype=np.int64)
+                index.sort()
+                return index
@@ -0,0 +1,109 @@
+import json
+import time
+import argparse
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from api import Generator
+
+"""
+Local HTTP service around a warm Generator.
+
+The worker process keeps populations, calendars, opening tables and results in
+memory between requests. Requests are handled one after another, because the
+simulation uses the global random state of numpy.
+
+POST /simulate          Body: JSON parameters of api.DEFAULT_PARAMETERS, optionally "rows": true
+                        to include the synthetic dataset. Returns the aggregates of the run.
+GET  /health            Returns the amount of cached entries per cache.
+
+Usage: python service.py [--host 127.0.0.1] [--port 8080] [--cache-size 8] [--catalog results/catalog.sqlite]
+"""
+
+class SimulationRequestHandler(BaseHTTPRequestHandler):
+        generator = None
+        lock = threading.Lock()
+
+        def send_json(self, status, body):
+                """
+                Sends a JSON response.
+
+                Args
+                -------
+                status:                 HTTP status code.
+                body:                   JSON-serializable response body.
+
+                Returns
+                -------
+                None
+
+                """
+                content = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+        def do_GET(self):
+                if self.path != "/health":
+                        self.send_json(404, {"error": "Unknown path %s." % self.path})
+                        return
+                self.send_json(200, {"status": "ok", "cached": {name: len(cache) for name, cache in self.generator.caches.items()}})
+
+        def do_POST(self):
+                if self.path != "/simulate":
+                        self.send_json(404, {"error": "Unknown path %s." % self.path})
+                        return
+                try:
+                        parameters = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                        rows = parameters.pop("rows", False)
+                        start = time.perf_counter()
+                        with self.lock:
+                                result = self.generator.simulate(parameters)
+                        body = result.aggregates()
+                        body["cached"] = result.cached
+                        body["seconds"] = time.perf_counter() - start
+                        if rows:
+                                body["dataset"] = json.loads(result.dataset.to_json(orient="split", index=False, date_format="iso", force_ascii=False))
+                except (ValueError, TypeError, KeyError) as error:
+                        self.send_json(400, {"error": str(error)})
+                        return
+                except Exception as error:
+                        self.send_json(500, {"error": "%s: %s" % (type(error).__name__, error)})
+                        return
+                self.send_json(200, body)
+
+def serve(host="127.0.0.1", port=8080, cache_size=8, catalog_path=""):
+        """
+        Starts the service and handles requests until the process is stopped.
+
+        Args
+        -------
+        host:                           Address to listen on.
+        port:                           Port to listen on.
+        cache_size:                     Amount of entries kept per cache of the generator.
+        catalog_path:                   SQLite file of the run catalog. Empty disables the catalog.
+
+        Returns
+        -------
+        None
+
+        """
+        SimulationRequestHandler.generator = Generator(cache_size, catalog_path)
+        server = HTTPServer((host, port), SimulationRequestHandler)
+        print("Simulation service listening on http://%s:%d" % (host, port))
+        try:
+                server.serve_forever()
+        except KeyboardInterrupt:
+                pass
+        finally:
+                server.server_close()
+
+if __name__ == "__main__":
+        parser = argparse.ArgumentParser(description="Local simulation service with cached populations and calendars.")
+        parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+        parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+        parser.add_argument("--cache-size", type=int, default=8, help="Amount of entries kept per cache.")
+        parser.add_argument("--catalog", default="", help="SQLite file of the run catalog.")
+        arguments = parser.parse_args()
+        serve(arguments.host, arguments.port, arguments.cache_size, arguments.catalog)
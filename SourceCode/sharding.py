@@ -0,0 +1,437 @@
+import os
+import csv
+import json
+import heapq
+import random
+import numpy as np
+import pandas as pd
+import simpy
+from datetime import datetime
+from consumer import Consumer
+from email_object import Email_Object
+from star_schema import WIDE_COLUMNS
+
+"""
+Sharded simulation runs on several nodes.
+
+plan:           Splits a run into consumer-ID-range shards and writes a manifest with
+                the parameters, one shared mailing calendar and one shared purchase plan.
+run-shard:      Simulates one shard from the manifest alone with a seed derived from the master seed.
+merge:          Combines shard datasets and aggregates into the dataset and report of the whole run.
+                Shard datasets are merged with a streaming k-way merge and scanned chunk by chunk
+                for the report, so the dataset of the whole run is never held in memory.
+All communication happens through plain files next to the manifest, no coordinator is needed.
+"""
+
+MANIFEST_FILE = "manifest.json"
+CALENDAR_FILE = "calendar.json"
+PURCHASE_PLAN_FILE = "purchase_plan.npz"
+CHUNK_ROWS = 100000 # Rows per chunk when shard datasets are read
+SIGNUP_ID_STRIDE = 10**12 # ConsumerIDs of signups in shard i start at consumer_amount + 1 + i * SIGNUP_ID_STRIDE
+# Outputs of a single-process run that shards do not write
+UNSUPPORTED_OUTPUTS = [("ML_EXPORT_PATH", "ml_export_path"), ("EVENT_LOG_PATH", "event_log_path"), ("LATENT_STATE_PATH", "latent_state_path"), ("SMTP_HOST", "smtp_host")]
+
+def derive_seed(master_seed, shard_index):
+        """
+        Derives the deterministic seed of a shard from the master seed.
+
+        Args
+        -------
+        master_seed:                    Seed of the whole run.
+        shard_index:                    Index of the shard.
+
+        Returns
+        -------
+        seed:                           Seed of the shard.
+
+        """
+        return int(np.random.SeedSequence([master_seed, shard_index]).generate_state(1)[0])
+
+def plan(simulation, shard_amount, output_path, master_seed):
+        """
+        Splits a run into shards and writes manifest, mailing calendar and purchase plan.
+
+        Args
+        -------
+        simulation:                     Simulation object to read the parameters from config.cfg.
+        shard_amount:                   Amount of consumer-ID-range shards.
+        output_path:                    Folder of the job, shared by all nodes.
+        master_seed:                    Seed of the whole run.
+
+        Returns
+        -------
+        manifest_path:                  Path of the written manifest.
+
+        """
+        options = simulation.options
+        if options["simulation_mode"] != "individual":
+                raise ValueError("Shards are simulated in the individual simulation mode, SIMULATION_MODE has to be individual.")
+        unsupported = [name for name, option in UNSUPPORTED_OUTPUTS if options[option]]
+        if options["output_mode"] != "wide":
+                unsupported.append("OUTPUT_MODE = %s" % options["output_mode"])
+        if unsupported:
+                raise ValueError("Shards only write dataset.csv and aggregates.json. Unset %s or use a single-process run." % ", ".join(unsupported))
+        consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = simulation.read_ini(simulation.path+"/config.cfg")
+        np.random.seed(master_seed)
+        random.seed(master_seed)
+        end_time = datetime.now()
+        os.makedirs(output_path, exist_ok=True)
+
+        """
+        Shared mailing calendar.
+        """
+        mailing_list = Email_Object.create_mailing_list(simulation_time_days, mailing_frequency_per_month, timestep_size)
+        calendar = [{"emailID": int(email.emailID),
+                     "length": float(email.length),
+                     "information_value": int(email.information_value),
+                     "sending_day": int(email.sending_day),
+                     "sending_day_influence": float(email.sending_day_influence),
+                     "date": date} for email, date in mailing_list]
+        with open(os.path.join(output_path, CALENDAR_FILE), "w", encoding="utf-8") as file:
+                json.dump(calendar, file, indent=4)
+
+        """
+        Shared purchase plan with consumerIDs of buyers and purchase days.
+        """
+        num_buyers = round(consumer_amount * share_buyers)
+        buyer_ids = random.sample(range(1, consumer_amount + 1), num_buyers)
+        purchase_ids = []
+        purchase_dates = []
+        for purchase_time, purchases in Consumer.create_purchase_schedule(simulation_time_days, buying_frequency_per_month, num_buyers, timestep_size):
+                purchase_ids.extend(buyer_ids[len(purchase_ids):len(purchase_ids) + purchases])
+                purchase_dates.extend([purchase_time.strftime("%Y-%m-%d")] * purchases)
+        np.savez(os.path.join(output_path, PURCHASE_PLAN_FILE), consumer_id=np.array(purchase_ids, dtype=np.int64), date=np.array(purchase_dates, dtype="U10"))
+
+        """
+        Consumer-ID-range shards with derived seeds.
+        """
+        bounds = np.linspace(1, consumer_amount + 1, shard_amount + 1).round().astype(np.int64)
+        shards = [{"index": index,
+                   "first_consumer_id": int(bounds[index]),
+                   "consumer_amount": int(bounds[index + 1] - bounds[index]),
+                   "seed": derive_seed(master_seed, index),
+                   "output": "shard_%05d" % index} for index in range(shard_amount)]
+        manifest = {"master_seed": master_seed,
+                    "end_time": end_time.isoformat(),
+                    "parameters": {"consumer_amount": consumer_amount,
+                                   "simulation_time_days": simulation_time_days,
+                                   "timestep_size": timestep_size,
+                                   "weekday_names": weekday_names,
+                                   "mailing_frequency_per_month": mailing_frequency_per_month,
+                                   "buying_frequency_per_month": buying_frequency_per_month,
+                                   "share_buyers": share_buyers,
+                                   "signup_rate_per_month": simulation.options["signup_rate_per_month"],
+                                   "unsubscribe_rate_per_month": simulation.options["unsubscribe_rate_per_month"],
+                                   "opening_coefficients": simulation.options["opening_coefficients"],
+                                   "opening_model": simulation.options["opening_model"],
+                                   "opening_history_window": simulation.options["opening_history_window"],
+                                   "segment": simulation.options["segment"]},
+                    "calendar": CALENDAR_FILE,
+                    "purchase_plan": PURCHASE_PLAN_FILE,
+                    "shards": shards}
+        manifest_path = os.path.join(output_path, MANIFEST_FILE)
+        with open(manifest_path, "w", encoding="utf-8") as file:
+                json.dump(manifest, file, indent=4, ensure_ascii=False)
+        return manifest_path
+
+def read_manifest(manifest_path):
+        """
+        Reads manifest, mailing calendar and purchase plan of a job.
+
+        Args
+        -------
+        manifest_path:                  Path of the manifest.
+
+        Returns
+        -------
+        manifest:                       Manifest of the job.
+        mailing_list:                   List of email dispatch dates with restored Email_Object objects.
+        purchase_plan:                  Tuple of consumerIDs and purchase dates.
+
+        """
+        job_path = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+        with open(os.path.join(job_path, manifest["calendar"]), encoding="utf-8") as file:
+                calendar = json.load(file)
+        mailing_list = [(Email_Object.restore(entry["emailID"], entry["length"], entry["information_value"], entry["sending_day"], entry["sending_day_influence"]), entry["date"]) for entry in calendar]
+        purchase_plan = np.load(os.path.join(job_path, manifest["purchase_plan"]))
+        return manifest, mailing_list, (purchase_plan["consumer_id"], purchase_plan["date"])
+
+def run_shard(simulation, manifest_path, shard_index):
+        """
+        Simulates one shard from the manifest and writes its dataset and aggregates.
+        Shards that are already complete are skipped, so a shard can be rerun after node failures.
+
+        Args
+        -------
+        simulation:                     Non-interactive Simulation object.
+        manifest_path:                  Path of the manifest.
+        shard_index:                    Index of the shard to run.
+
+        Returns
+        -------
+        shard_path:                     Folder of the shard output.
+
+        """
+        manifest, mailing_list, (purchase_ids, purchase_dates) = read_manifest(manifest_path)
+        shard = manifest["shards"][shard_index]
+        parameters = manifest["parameters"]
+        shard_path = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), shard["output"])
+        if os.path.exists(os.path.join(shard_path, "aggregates.json")):
+                return shard_path
+
+        np.random.seed(shard["seed"])
+        random.seed(shard["seed"])
+        simulation.options["signup_rate_per_month"] = parameters["signup_rate_per_month"]
+        simulation.options["unsubscribe_rate_per_month"] = parameters["unsubscribe_rate_per_month"]
+        simulation.options["opening_coefficients"] = parameters.get("opening_coefficients")
+        simulation.options["opening_model"] = parameters.get("opening_model")
+        simulation.options["opening_history_window"] = parameters.get("opening_history_window", 0)
+        simulation.options["segment"] = parameters.get("segment", "")
+        simulation.next_consumer_id = parameters["consumer_amount"] + 1 + shard_index * SIGNUP_ID_STRIDE
+        first_consumer_id = shard["first_consumer_id"]
+        consumers = Consumer.create_consumers(shard["consumer_amount"], first_consumer_id)
+        in_shard = (purchase_ids >= first_consumer_id) & (purchase_ids < first_consumer_id + shard["consumer_amount"])
+        purchase_list = [(consumers[consumer_id - first_consumer_id], datetime.strptime(date, "%Y-%m-%d")) for consumer_id, date in zip(purchase_ids[in_shard].tolist(), purchase_dates[in_shard].tolist())]
+        purchase_list.sort(key=lambda x: x[1])
+
+        env = simpy.Environment()
+        env.process(simulation.simulation_process(env, parameters["weekday_names"], shard["consumer_amount"], parameters["mailing_frequency_per_month"], parameters["buying_frequency_per_month"], parameters["share_buyers"], parameters["simulation_time_days"], parameters["timestep_size"],
+                                                  simulation_inputs=(consumers, purchase_list, mailing_list), end_time=datetime.fromisoformat(manifest["end_time"])))
+        env.run(until=parameters["simulation_time_days"])
+
+        write_output(simulation, shard_path, shard["consumer_amount"])
+        return shard_path
+
+class DatasetWriter:
+        def __init__(self, dataset_path):
+                """
+                Initilizes the writer and opens the dataset file, so that campaigns are written as they are produced instead of being kept as rows.
+
+                Args
+                -------
+                dataset_path:           Path of the synthetic dataset.
+
+                Returns
+                -------
+                None
+
+                """
+                self.dataset_path = dataset_path
+                self.file = open(dataset_path, "w", newline="", encoding="utf-8")
+                self.file.write(",".join(WIDE_COLUMNS) + "\n")
+                self.rows = 0
+
+        def write_batch(self, batch):
+                """
+                Appends a campaign to the dataset file in the format of DataFrame.to_csv.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                if len(batch) == 0:
+                        return
+                batch.frame().to_csv(self.file, header=False, index=False)
+                self.rows += len(batch)
+
+        def close(self):
+                """ Closes the dataset file."""
+                self.file.close()
+
+def write_output(simulation, output_path, consumer_amount, df=None):
+        """
+        Writes dataset and aggregates of a finished run. The aggregates file marks the run as complete and is written last.
+
+        Args
+        -------
+        simulation:                     Simulation object after simulation_process.
+        output_path:                    Folder of the output.
+        consumer_amount:                Amount of consumers at the start of the run.
+        df:                             Optional synthetic dataset, e.g. of a rescored run. Taken from the simulation if None,
+                                        the DatasetWriter of the simulation is only closed if it wrote the dataset during the run.
+
+        Returns
+        -------
+        None
+
+        """
+        os.makedirs(output_path, exist_ok=True)
+        if df is None and simulation.dataset_writer is not None:
+                # The dataset was written by the DatasetWriter during the run
+                simulation.dataset_writer.close()
+        else:
+                if df is None:
+                        df = pd.DataFrame(simulation.synthetic_dataset)
+                if df.empty:
+                        # Header only, so merge can read the dataset of a shard without recipients
+                        df = pd.DataFrame(columns=WIDE_COLUMNS)
+                df.to_csv(os.path.join(output_path, "dataset.csv"), index=False)
+        # Counted per dispatched campaign, so campaigns without recipients keep their entry
+        aggregates = {"consumer_amount": consumer_amount,
+                      "campaigns": [(date.isoformat(), recipients, opens) for (date, _), (recipients, opens) in zip(simulation.opening_data, simulation.campaign_counts)],
+                      "global_timespan_data": [(date.isoformat(), value) for date, value in simulation.global_timespan_data],
+                      "mailings_per_month": simulation.mailings_per_month,
+                      "purchases_per_month": simulation.purchases_per_month}
+        temporary_path = os.path.join(output_path, "aggregates.json.tmp")
+        with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump(aggregates, file, indent=4)
+        os.replace(temporary_path, os.path.join(output_path, "aggregates.json"))
+
+def shard_paths(manifest_path):
+        """
+        Returns the output folders of all shards and checks that every shard is complete.
+
+        Args
+        -------
+        manifest_path:                  Path of the manifest.
+
+        Returns
+        -------
+        manifest:                       Manifest of the job.
+        shard_paths:                    List of shard output folders.
+
+        """
+        with open(manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+        job_path = os.path.dirname(os.path.abspath(manifest_path))
+        paths = [os.path.join(job_path, shard["output"]) for shard in manifest["shards"]]
+        missing = [path for path in paths if not os.path.exists(os.path.join(path, "aggregates.json"))]
+        if missing:
+                raise FileNotFoundError("Shards not complete: " + ", ".join(missing))
+        return manifest, paths
+
+def read_shard_rows(shard_path):
+        """
+        Yields the rows of a shard dataset in chunks of CHUNK_ROWS, with the values as written by the shard.
+
+        Args
+        -------
+        shard_path:                     Folder of the shard output.
+
+        Returns
+        -------
+        rows:                           Generator of (emailID, consumerID, row) tuples in the order of the shard dataset.
+
+        """
+        email_column = WIDE_COLUMNS.index("emailID")
+        consumer_column = WIDE_COLUMNS.index("consumerID")
+        for chunk in pd.read_csv(os.path.join(shard_path, "dataset.csv"), dtype=str, keep_default_na=False, chunksize=CHUNK_ROWS):
+                rows = chunk[WIDE_COLUMNS].values.tolist()
+                yield from ((int(row[email_column]), int(row[consumer_column]), row) for row in rows)
+
+def merge(simulation, manifest_path, dataset_path):
+        """
+        Combines the outputs of all shards into the dataset of the whole run.
+        Counters and time series of simulation are filled as after a single-process run.
+
+        Args
+        -------
+        simulation:                     Non-interactive Simulation object that receives the merged counters and time series.
+        manifest_path:                  Path of the manifest.
+        dataset_path:                   Path to save the merged synthetic dataset to.
+
+        Returns
+        -------
+        rows:                           Amount of rows of the merged synthetic dataset.
+
+        """
+        manifest, paths = shard_paths(manifest_path)
+
+        opens = {}
+        recipients = {}
+        for shard_path in paths:
+                with open(os.path.join(shard_path, "aggregates.json"), encoding="utf-8") as file:
+                        aggregates = json.load(file)
+                for date, shard_recipients, shard_opens in aggregates["campaigns"]:
+                        recipients[date] = recipients.get(date, 0) + shard_recipients
+                        opens[date] = opens.get(date, 0) + shard_opens
+                for year_month, mailings in aggregates["mailings_per_month"].items():
+                        simulation.mailings_per_month[year_month] = mailings
+                for year_month, purchases in aggregates["purchases_per_month"].items():
+                        simulation.purchases_per_month[year_month] = simulation.purchases_per_month.get(year_month, 0) + purchases
+                simulation.global_timespan_data = [(datetime.fromisoformat(date).date(), value) for date, value in aggregates["global_timespan_data"]]
+
+        """
+        Order rows as in a single-process run: by campaign, then by consumerID.
+        Every shard dataset is already in this order, so the rows are merged and written one by one.
+        """
+        rows = 0
+        with open(dataset_path, "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file, lineterminator="\n")
+                writer.writerow(WIDE_COLUMNS)
+                for _, _, row in heapq.merge(*[read_shard_rows(shard_path) for shard_path in paths]):
+                        writer.writerow(row)
+                        rows += 1
+
+        opening_rate = 0
+        simulation.opening_data = []
+        for total_mailings, date in enumerate(sorted(opens), start=1):
+                campaign_opening_rate = opens[date] / recipients[date] if recipients[date] > 0 else 0
+                opening_rate += campaign_opening_rate
+                simulation.opening_data.append((datetime.fromisoformat(date).date(), campaign_opening_rate))
+        simulation.global_opening_data = []
+        for date, _ in simulation.global_timespan_data:
+                campaign_rates = [rate for campaign_date, rate in simulation.opening_data if campaign_date <= date]
+                simulation.global_opening_data.append((date, sum(campaign_rates) / len(campaign_rates)))
+
+        total_mailings = len(simulation.opening_data)
+        time_past = manifest["parameters"]["simulation_time_days"]
+        print(  "Anzahl Mailings: ", total_mailings,
+                "\nÖffnungsrate: ", opening_rate / total_mailings,
+                "\nAnzahl Käufe: ", sum(simulation.purchases_per_month.values()),
+                "\nAnzahl Simulationstage: ", time_past,
+                "\nDurschnittliche Zeitspanne zur letzten E-Mail: ", time_past / total_mailings,
+                "\nMailings pro Monat: ", simulation.mailings_per_month,
+                "\nKäufe pro Monat: ", simulation.purchases_per_month)
+        return rows
+
+def merged_report(manifest_path):
+        """
+        Collects the inputs of the report of the whole run from the shard datasets, chunk by chunk.
+        The first rows per consumer and email and the age counts per device are the same as of the merged dataset.
+
+        Args
+        -------
+        manifest_path:                  Path of the manifest.
+
+        Returns
+        -------
+        unique_consumers:               First row of every consumer of the merged dataset.
+        unique_mails:                   First row of every email of the merged dataset.
+        device_ages:                    Series of row counts with an (Endgerät, Alter) index.
+
+        """
+        _, paths = shard_paths(manifest_path)
+        consumers = []
+        mails = []
+        counts = []
+        for shard_path in paths:
+                seen_consumers = np.zeros(0, dtype=np.int64)
+                seen_mails = np.zeros(0, dtype=np.int64)
+                for chunk in pd.read_csv(os.path.join(shard_path, "dataset.csv"), parse_dates=["Simulationszeit"], chunksize=CHUNK_ROWS):
+                        first = chunk.drop_duplicates("consumerID")
+                        first = first[~np.isin(first["consumerID"], seen_consumers)]
+                        seen_consumers = np.union1d(seen_consumers, first["consumerID"])
+                        consumers.append(first)
+                        first = chunk.drop_duplicates("emailID")
+                        first = first[~np.isin(first["emailID"], seen_mails)]
+                        seen_mails = np.union1d(seen_mails, first["emailID"])
+                        mails.append(first)
+                        counts.append(chunk.groupby(["Endgerät", "Alter"]).size())
+        if not consumers:
+                return pd.DataFrame(columns=WIDE_COLUMNS), pd.DataFrame(columns=WIDE_COLUMNS), pd.Series(dtype=np.int64)
+
+        """
+        The first row of a consumer (email) in the merged dataset is its row with the lowest (emailID, consumerID) over all shards.
+        """
+        unique_consumers = pd.concat(consumers, ignore_index=True).sort_values(["emailID", "consumerID"]).drop_duplicates("consumerID").reset_index(drop=True)
+        unique_mails = pd.concat(mails, ignore_index=True).sort_values(["emailID", "consumerID"]).drop_duplicates("emailID").reset_index(drop=True)
+        device_ages = pd.concat(counts).groupby(level=[0, 1]).sum()
+        return unique_consumers, unique_mails, device_ages
@@ -0,0 +1,116 @@
+import numpy as np
+from multiprocessing import shared_memory
+from population import STATIC_COLUMNS
+
+"""
+Static consumer columns in shared memory.
+
+The static columns of a population (consumer_id, age, income, gender, device and
+informative_perception) are written once into one block of
+multiprocessing.shared_memory. Other processes attach the block by its descriptor
+and get read-only arrays without a copy, so several campaign programs on the same
+customer base keep one copy of the static columns. Contact history and purchase
+state stay private per process in Population.
+
+The creating process owns the block and removes it with unlink. Attached
+processes, e.g. the processes of the campaign programs, keep their mapping until
+they exit or call close.
+"""
+
+ALIGNMENT = 64
+
+class SharedPopulation:
+        def __init__(self, shared_block, layout, owner):
+                """
+                Initilizes the read-only column views of a shared memory block. Use create or attach.
+
+                Args
+                -------
+                shared_block:           SharedMemory block of the columns.
+                layout:                 List of column name, dtype, length and byte offset.
+                owner:                  True if the block was created by this process and is removed by unlink.
+
+                Returns
+                -------
+                None
+
+                """
+                self.shared_block = shared_block
+                self.layout = layout
+                self.owner = owner
+                self.columns = {}
+                for name, dtype, length, offset in layout:
+                        column = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shared_block.buf, offset=offset)
+                        column.flags.writeable = False
+                        self.columns[name] = column
+
+        def __len__(self):
+                return len(self.columns["consumer_id"])
+
+        @staticmethod
+        def create(columns):
+                """
+                Copies static consumer columns into a new shared memory block.
+
+                Args
+                -------
+                columns:                Dictionary of static columns, e.g. created by Consumer.generate_consumer_columns.
+
+                Returns
+                -------
+                shared_population:      SharedPopulation that owns the block.
+
+                """
+                layout = []
+                size = 0
+                for name in STATIC_COLUMNS:
+                        column = np.asarray(columns[name])
+                        layout.append((name, column.dtype.str, len(column), size))
+                        size += -(-column.nbytes // ALIGNMENT) * ALIGNMENT
+                shared_block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+                for name, dtype, length, offset in layout:
+                        np.ndarray((length,), dtype=np.dtype(dtype), buffer=shared_block.buf, offset=offset)[:] = columns[name]
+                return SharedPopulation(shared_block, layout, owner=True)
+
+        @staticmethod
+        def attach(descriptor):
+                """
+                Attaches the shared memory block of another process.
+
+                Args
+                -------
+                descriptor:             Descriptor returned by describe.
+
+                Returns
+                -------
+                shared_population:      SharedPopulation with read-only columns.
+
+                """
+                shared_block = shared_memory.SharedMemory(name=descriptor["name"])
+                return SharedPopulation(shared_block, [tuple(column) for column in descriptor["layout"]], owner=False)
+
+        def describe(self):
+                """
+                Returns the picklable descriptor of the block for attach.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                descriptor:             Dictionary of block name and column layout.
+
+                """
+                return {"name": self.shared_block.name, "layout": self.layout}
+
+        def nbytes(self):
+                """ Returns the size of the shared memory block in bytes."""
+                return self.shared_block.size
+
+        def close(self):
+                """ Releases the column views and the mapping of the block. The owner also removes the block."""
+                self.columns = {}
+                self.shared_block.close()
+                if self.owner:
+                        self.shared_block.unlink()
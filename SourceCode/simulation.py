@@ -4,31 +4,78 @@ import simpy
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from consumer import Consumer
+from calendar import monthrange
+from consumer import Consumer, DEVICE_CATEGORIES
 from email_object import Email_Object
-from sklearn.model_selection import train_test_split
+from ml_export import FeatureMatrixWriter
+from star_schema import StarSchemaWriter, build_wide_view
+from opening_table import OpeningTable
+from population import Population
+from cohort import CohortSimulation, check_cohort_options
+from calibration import Calibration, read_coefficients
+from opening_model import read_spec
+from telemetry import Telemetry
+from delivery import SMTPDelivery
+from segment import SegmentIndex
+from run_artifact import RunArtifactWriter, RunArtifact
+import random_streams
+from catalog import RunCatalog, create_record
+from pipeline import CampaignBatch, OutputPipeline
+from event_log import EventLogWriter, OpenDelayModel
+from approximate_analysis import AnalysisSampler, describe_sample, correlation_interval
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import describe
 import json
+import argparse
+import sharding
+import programs
+import rescore
 
 color_first = "#5372AB"
 color_second = "#B65556"
 
 class Simulation:
 
-        def __init__(self):
-                """ Initilizes the class with creation of datasets to be created and definition of working directory."""
+        def __init__(self, interactive=True, options=None):
+                """ Initilizes the class with creation of datasets to be created and definition of working directory.
+                    With interactive=False the simulation is not started, e.g. for the shard commands.
+                    With options, config.cfg is not read and the summary is not printed, e.g. for the library API."""
 
                 path = os.getcwd()
                 self.path = os.path.abspath(path).replace(os.sep, "/")
                 self.synthetic_dataset = []
+                self.campaign_batches = None
                 self.opening_data = []
+                self.campaign_counts = []
                 self.purchase_data = []
                 self.global_opening_data = []
                 self.global_timespan_data = []
                 self.mailings_per_month = {}
                 self.purchases_per_month = {}
+                self.feature_writer = None
+                self.star_writer = None
+                self.dataset_writer = None
+                self.delivery = None
+                self.artifact_writer = None
+                self.event_writer = None
+                self.analysis_sampler = None
+                self.latent_writer = None
+                self.output = None
+                self.end_time = None
+                self.opening_table = None
+                self.population = None
+                self.signups_per_month = {}
+                self.unsubscribes_per_month = {}
+                self.device_recipients = {}
+                self.device_openings = {}
+                self.next_consumer_id = None
+                self.verbose = options is None
+                self.options = options if options is not None else self.read_options(self.path+"/config.cfg")
+
+                if not interactive:
+                        return
 
                 # Start the simulation process
                 print("Welcome to the Synthetic E-Mail Dataset Simulator!")
@@ -54,17 +101,111 @@ class Simulation:
                 None 
 
                 """
+                start = time.perf_counter()
                 env = simpy.Environment()
                 consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = self.read_ini(self.path+"/config.cfg")
-
-                env.process(self.simulation_process(env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size))
+                options = self.options
+                if options["simulation_mode"] == "cohort":
+                        check_cohort_options(options)
+                if options["ml_export_path"]:
+                        self.feature_writer = FeatureMatrixWriter(options["ml_export_path"], options["ml_split_shares"], options["ml_shard_rows"], weekday_names)
+                if options["output_mode"] == "star":
+                        self.star_writer = StarSchemaWriter(options["star_schema_path"])
+                if options["run_artifact_path"]:
+                        self.artifact_writer = RunArtifactWriter(self.create_run_path(options["run_artifact_path"]), options["run_shard_rows"], weekday_names)
+                if options["event_log_path"]:
+                        streams = random_streams.active
+                        delay_model = OpenDelayModel(options["open_delay_median_minutes"], options["open_delay_sigma"], options["open_delay_max_days"], options["open_delay_age_factors"])
+                        self.event_writer = EventLogWriter(options["event_log_path"], delay_model, streams.seed if streams is not None else 0, streams is not None and streams.antithetic)
+                if options["latent_state_path"]:
+                        if options["simulation_mode"] != "individual":
+                                raise ValueError("Latent states can only be stored in the individual simulation mode.")
+                        self.latent_writer = rescore.LatentStateWriter(options["latent_state_path"])
+                if options["analysis_mode"] == "approximate":
+                        streams = random_streams.active
+                        self.analysis_sampler = AnalysisSampler(options["analysis_sample_size"], options["analysis_sketch_accuracy"], streams.seed if streams is not None else 0)
+                elif options["analysis_mode"] != "exact":
+                        raise ValueError("Unknown analysis mode %s. Known modes: exact, approximate." % options["analysis_mode"])
+                if options["smtp_host"]:
+                        self.delivery = SMTPDelivery(options["smtp_host"], options["smtp_port"], options["smtp_connections"], options["smtp_rate_per_second"], options["smtp_sender"], options["smtp_recipient_domain"], options["smtp_timeout_seconds"])
+                if options["output_pipeline"]:
+                        self.output = OutputPipeline(self.output_writers(), options["output_queue_campaigns"])
+
+                if options["simulation_mode"] == "cohort":
+                        cohort_simulation = CohortSimulation(self, options["cohort_sample_size"])
+                        env.process(cohort_simulation.simulation_process(env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size))
+                else:
+                        env.process(self.simulation_process(env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size))
                 env.run(until=simulation_time_days)
+                if self.output is not None:
+                        self.output.close()
+                        report = self.output.report()
+                        print(  "Wartezeit der Simulation auf die Ausgabe (s): ", report["blocked_seconds"],
+                                "\nAuslastung der Ausgabe (s): ", report["busy_seconds"])
+                if self.feature_writer is not None:
+                        self.feature_writer.close()
+                        print("Feature matrix saved at:", options["ml_export_path"])
+                if self.event_writer is not None:
+                        self.event_writer.close()
+                        print("Event log saved at:", options["event_log_path"])
+                if self.star_writer is not None:
+                        self.star_writer.close()
+                        print("Star-schema tables saved at:", options["star_schema_path"])
+                parameters = {"consumer_amount": consumer_amount,
+                              "simulation_time_days": simulation_time_days,
+                              "timestep_size": timestep_size,
+                              "share_buyers": share_buyers,
+                              "mailing_frequency_per_month": mailing_frequency_per_month,
+                              "buying_frequency_per_month": buying_frequency_per_month}
+                if self.latent_writer is not None:
+                        self.latent_writer.close(self, parameters)
+                        print("Latent states saved at:", options["latent_state_path"])
+                if self.artifact_writer is not None:
+                        self.artifact_writer.close(self, parameters, self.path+"/config.cfg")
+                        print("Run artifacts saved at:", self.artifact_writer.output_path)
+                if options["run_catalog_path"]:
+                        parameters.update({name: options[name] for name in ["signup_rate_per_month", "unsubscribe_rate_per_month", "simulation_mode", "cohort_sample_size", "segment", "opening_coefficients", "opening_model", "opening_history_window"]})
+                        catalog = RunCatalog(options["run_catalog_path"])
+                        run_id = catalog.insert([create_record(self, parameters, "run", time.perf_counter() - start, run_path=self.artifact_writer.output_path if self.artifact_writer is not None else "")])[0]
+                        catalog.close()
+                        print("Run %d saved in catalog:" % run_id, options["run_catalog_path"])
+                if self.delivery is not None:
+                        self.delivery.close()
+                        report = self.delivery.report()
+                        print(  "Zugestellte Nachrichten: ", report["sent"],
+                                "\nFehlgeschlagene Nachrichten: ", report["failed"],
+                                "\nNachrichten pro Sekunde: ", report["messages_per_second"],
+                                "\nLatenz p50/p90/p99 (ms): ", report["latency_p50_ms"], report["latency_p90_ms"], report["latency_p99_ms"])
+                if options["simulation_mode"] == "cohort" and options["cohort_sample_size"] == 0:
+                        # No rows to analyze without sample
+                        return
                 proceed = input("Do you want to start analysis of the synthetic dataset now? [y/n] ")
-                if proceed == "y":
+                if proceed == "y" and self.analysis_sampler is not None:
+                        self.approximate_analysis(consumer_amount, unique_file_path)
+                elif proceed == "y":
                         self.data_analysis(consumer_amount, dataset_path, unique_file_path)
                 else:
                         pass
         
+        def create_run_path(self, run_artifact_path):
+                """ Returns a new folder for the artifacts of a run, named after the start time of the run.
+
+                Args
+                -------
+                run_artifact_path: Specified folder of the run artifacts.
+
+                Returns
+                -------
+                run_path:               Folder of the run.
+                """
+                name = datetime.now().strftime("%Y%m%d-%H%M%S")
+                run_path = os.path.join(run_artifact_path, name)
+                suffix = 1
+                while os.path.exists(run_path):
+                        suffix += 1
+                        run_path = os.path.join(run_artifact_path, "%s-%d" % (name, suffix))
+                return run_path
+
         def read_ini(self, file_path):
                 """ Reads simulation parameters.
 
@@ -99,7 +240,115 @@ class Simulation:
 
                 return consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path
 
-        def simulation_process(self, env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size):
+        def read_options(self, file_path):
+                """ Reads optional output parameters. Missing entries fall back to their defaults.
+
+                Args
+                -------
+                file_path: Folder path to config.cfg
+
+                Returns
+                -------
+                options:                        Dictionary of optional parameters:
+                                                ml_export_path:         Specified folder for the ML feature matrix. Empty disables the export.
+                                                ml_split_shares:        Specified shares of consumers for train, validation and test split.
+                                                ml_shard_rows:          Specified maximum amount of rows per feature matrix shard.
+                                                output_mode:            Specified output mode, "wide" for denormalized rows or "star" for consumers, emails and interactions tables.
+                                                star_schema_path:       Specified folder for the star-schema tables.
+                                                run_artifact_path:      Specified folder for the artifact directories of the runs. Empty disables the artifacts.
+                                                run_shard_rows:         Specified maximum amount of rows per dataset shard of the run artifacts.
+                                                run_catalog_path:       Specified SQLite file of the run catalog. Empty disables the catalog.
+                                                latent_state_path:      Specified folder for the pre-decision states per consumer and campaign, which the rescore command re-scores. Empty disables the latent states.
+                                                output_pipeline:        Specified switch for writer threads that write the outputs while the simulation continues.
+                                                output_queue_campaigns: Specified amount of campaigns a writer thread may fall behind before the simulation waits.
+                                                simulation_mode:        Specified simulation mode, "individual" or "cohort" for aggregated consumer states.
+                                                cohort_sample_size:     Specified amount of individual consumers with rows in cohort mode.
+                                                signup_rate_per_month:  Specified share of subscribed consumers that is added as new consumers per month.
+                                                unsubscribe_rate_per_month: Specified share of subscribed consumers that unsubscribes per month.
+                                                compaction_threshold:   Specified share of unsubscribed consumers at which the population store is compacted.
+                                                behavior_history:       Specified switch for the sent and opened bits per consumer and campaign.
+                                                progress_interval_seconds: Specified seconds between progress lines and refreshes of the metrics file. 0 disables the telemetry.
+                                                metrics_path:           Specified file for Prometheus metrics of the run. Empty disables the metrics file.
+                                                smtp_host:              Specified host of the SMTP server for the delivery mode. Empty disables the delivery.
+                                                smtp_port, smtp_connections, smtp_rate_per_second, smtp_sender, smtp_recipient_domain, smtp_timeout_seconds:
+                                                                        Specified port, pooled connections, rate limit (0 = unlimited), sender, recipient domain and timeout of the delivery.
+                                                event_log_path:         Specified folder for the time-ordered log of dispatch and open events. Empty disables the event log.
+                                                open_delay_median_minutes, open_delay_sigma, open_delay_max_days, open_delay_age_factors:
+                                                                        Specified median open delay per device, standard deviation of its logarithm, open window and factors of the median per lower bound of an age group.
+                                                analysis_mode:          Specified analysis mode, "exact" for the whole dataset or "approximate" for samples and sketches kept during the run.
+                                                analysis_sample_size:   Specified amount of sampled consumers and of sampled interactions of the approximate analysis.
+                                                analysis_sketch_accuracy: Specified highest relative error of the quantiles of the approximate analysis.
+                                                segment:                Specified segment expression of the consumers that receive the campaigns. Empty targets all subscribed consumers.
+                                                opening_history_window: Specified amount of last received emails whose openings enter the opening model. 0 disables the feature.
+                                                opening_coefficients:   Coefficients of the opening model read from the specified JSON file, e.g. of a calibration. None for the default coefficients.
+                                                opening_model:          Opening-model spec read from the specified JSON file. None for the spec of calculate_opening with the coefficients.
+                """
+
+                config = configparser.ConfigParser()
+                config.read(file_path)
+                for section in ["OUTPUT_PARAMETERS", "MODE_PARAMETERS", "POPULATION_PARAMETERS", "MODEL_PARAMETERS", "TELEMETRY_PARAMETERS", "DELIVERY_PARAMETERS", "SEGMENT_PARAMETERS", "EVENT_LOG_PARAMETERS", "ANALYSIS_PARAMETERS"]:
+                        if not config.has_section(section):
+                                config.add_section(section)
+                output = config["OUTPUT_PARAMETERS"]
+                mode = config["MODE_PARAMETERS"]
+                population = config["POPULATION_PARAMETERS"]
+                model = config["MODEL_PARAMETERS"]
+                telemetry = config["TELEMETRY_PARAMETERS"]
+                delivery = config["DELIVERY_PARAMETERS"]
+                segment = config["SEGMENT_PARAMETERS"]
+                event_log = config["EVENT_LOG_PARAMETERS"]
+                analysis = config["ANALYSIS_PARAMETERS"]
+                options = {}
+                ml_export_path = output.get("ML_EXPORT_PATH", "").strip()
+                options["ml_export_path"] = self.path+ml_export_path if ml_export_path else ""
+                options["ml_split_shares"] = json.loads(output.get("ML_SPLIT_SHARES", '{"train": 0.8, "validation": 0.1, "test": 0.1}'))
+                options["ml_shard_rows"] = int(output.get("ML_SHARD_ROWS", "1000000"))
+                options["output_mode"] = output.get("OUTPUT_MODE", "wide").strip()
+                options["star_schema_path"] = self.path+output.get("STAR_SCHEMA_PATH", "/results/star_schema").strip()
+                run_artifact_path = output.get("RUN_ARTIFACT_PATH", "/results/runs").strip()
+                options["run_artifact_path"] = self.path+run_artifact_path if run_artifact_path else ""
+                options["run_shard_rows"] = int(output.get("RUN_SHARD_ROWS", "1000000"))
+                run_catalog_path = output.get("RUN_CATALOG_PATH", "/results/catalog.sqlite").strip()
+                options["run_catalog_path"] = self.path+run_catalog_path if run_catalog_path else ""
+                latent_state_path = output.get("LATENT_STATE_PATH", "").strip()
+                options["latent_state_path"] = self.path+latent_state_path if latent_state_path else ""
+                options["output_pipeline"] = output.getboolean("OUTPUT_PIPELINE", True)
+                options["output_queue_campaigns"] = int(output.get("OUTPUT_QUEUE_CAMPAIGNS", "4"))
+                options["simulation_mode"] = mode.get("SIMULATION_MODE", "individual").strip()
+                options["cohort_sample_size"] = int(mode.get("COHORT_SAMPLE_SIZE", "0"))
+                options["signup_rate_per_month"] = float(population.get("SIGNUP_RATE_PER_MONTH", "0"))
+                options["unsubscribe_rate_per_month"] = float(population.get("UNSUBSCRIBE_RATE_PER_MONTH", "0"))
+                options["compaction_threshold"] = float(population.get("COMPACTION_THRESHOLD", "0.25"))
+                options["behavior_history"] = population.getboolean("BEHAVIOR_HISTORY", True)
+                options["progress_interval_seconds"] = float(telemetry.get("PROGRESS_INTERVAL_SECONDS", "10"))
+                metrics_path = telemetry.get("METRICS_PATH", "").strip()
+                options["metrics_path"] = self.path+metrics_path if metrics_path else ""
+                options["smtp_host"] = delivery.get("SMTP_HOST", "").strip()
+                options["smtp_port"] = int(delivery.get("SMTP_PORT", "8025"))
+                options["smtp_connections"] = int(delivery.get("SMTP_CONNECTIONS", "8"))
+                options["smtp_rate_per_second"] = float(delivery.get("SMTP_RATE_PER_SECOND", "0"))
+                options["smtp_sender"] = delivery.get("SMTP_SENDER", "newsletter@example.com").strip()
+                options["smtp_recipient_domain"] = delivery.get("SMTP_RECIPIENT_DOMAIN", "example.com").strip()
+                options["smtp_timeout_seconds"] = float(delivery.get("SMTP_TIMEOUT_SECONDS", "30"))
+                options["segment"] = segment.get("SEGMENT", "").strip()
+                event_log_path = event_log.get("EVENT_LOG_PATH", "").strip()
+                options["event_log_path"] = self.path+event_log_path if event_log_path else ""
+                options["open_delay_median_minutes"] = json.loads(event_log.get("OPEN_DELAY_MEDIAN_MINUTES", '{"Mobil": 45, "Desktop": 180}'))
+                options["open_delay_sigma"] = float(event_log.get("OPEN_DELAY_SIGMA", "1.2"))
+                options["open_delay_max_days"] = float(event_log.get("OPEN_DELAY_MAX_DAYS", "7"))
+                options["open_delay_age_factors"] = json.loads(event_log.get("OPEN_DELAY_AGE_FACTORS", '{"0": 0.8, "30": 1.0, "50": 1.5}'))
+                options["analysis_mode"] = analysis.get("ANALYSIS_MODE", "exact").strip()
+                options["analysis_sample_size"] = int(analysis.get("ANALYSIS_SAMPLE_SIZE", "10000"))
+                options["analysis_sketch_accuracy"] = float(analysis.get("ANALYSIS_SKETCH_ACCURACY", "0.01"))
+                opening_coefficients_path = model.get("OPENING_COEFFICIENTS_PATH", "").strip()
+                options["opening_history_window"] = int(model.get("OPENING_HISTORY_WINDOW", "0"))
+                options["opening_coefficients"] = read_coefficients(self.path+opening_coefficients_path) if opening_coefficients_path else None
+                opening_model_path = model.get("OPENING_MODEL_PATH", "").strip()
+                options["opening_model"] = read_spec(self.path+opening_model_path) if opening_model_path else None
+
+                return options
+
+        def simulation_process(self, env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size, simulation_inputs=None, end_time=None):
                 """ Reads simulation parameters from initialization routine.
                     Initializes consumers as well as email and purchase lists.
                     Starts the simulation.
@@ -108,32 +357,62 @@ class Simulation:
                 -------
                 file_path (str): Folder path to config.cfg
                 env, weekday_names, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days     
+                simulation_inputs:      Optional tuple of consumers, purchase_list and mailing_list, e.g. of a shard. Created if None.
+                                        Consumers can be a dictionary of shared static columns instead of a list, e.g. of a campaign program.
+                end_time:               Optional end of the simulation period. Today if None.
                 
                 Returns
                 -------
                 None
                 """
-                time_past, opening_rate, total_mailings, total_purchases, end_time, current_time, year_month, email_dispatch, product_purchase = self.initialize_simulation_parameters(simulation_time_days)
+                time_past, opening_rate, total_mailings, total_purchases, end_time, current_time, year_month, email_dispatch, product_purchase = self.initialize_simulation_parameters(simulation_time_days, end_time)
 
-                consumers = Consumer.create_consumers(consumer_amount=consumer_amount)
+                if simulation_inputs is not None:
+                        consumers, purchase_list, mailing_list = simulation_inputs
+                else:
+                        consumers = Consumer.create_consumers(consumer_amount=consumer_amount)
                 
-                """
-                Create purchase list for purchase dates. 
-                """
-                purchase_list = Consumer.create_purchase_list(simulation_time_days, buying_frequency_per_month, share_buyers, consumers, timestep_size)
+                        """
+                        Create purchase list for purchase dates. 
+                        """
+                        purchase_list = Consumer.create_purchase_list(simulation_time_days, buying_frequency_per_month, share_buyers, consumers, timestep_size)
+
+                        """
+                        Create mailing list for dispatch dates.
+                        """
+                        mailing_list = Email_Object.create_mailing_list(simulation_time_days, mailing_frequency_per_month, timestep_size)
                 if purchase_list:
                         next_purchase_date = purchase_list[total_purchases][1].strftime("%Y-%m-%d")
                 else:
                         next_purchase_date = 0 
 
-                
-                """
-                Create mailing list for dispatch dates.
-                """
-                mailing_list = Email_Object.create_mailing_list(simulation_time_days, mailing_frequency_per_month, timestep_size)
+                shared_columns = consumers if isinstance(consumers, dict) else None
+                if self.star_writer is not None:
+                        if shared_columns is not None:
+                                self.star_writer.write_consumer_columns(shared_columns)
+                        else:
+                                self.star_writer.write_consumers(consumers)
+                        self.star_writer.write_emails(mailing_list, weekday_names, end_time)
                 next_email_dispatch_date = mailing_list[total_mailings][1]
                 next_email = mailing_list[total_mailings][0]
 
+                """
+                Precompute opening decisions and create columnar population for dispatch.
+                """
+                max_frequency = Email_Object.calculate_max_frequency(mailing_list)
+                if self.opening_table is None or not self.opening_table.covers(max_frequency, self.options["opening_coefficients"], self.options["opening_history_window"], self.options["opening_model"]):
+                        self.opening_table = OpeningTable(max_frequency, self.options["opening_coefficients"], self.options["opening_history_window"], self.options["opening_model"])
+                        self.opening_table.verify(self)
+                population = Population([] if shared_columns is not None else consumers, self.opening_table, max_frequency, self.options["compaction_threshold"], self.options["behavior_history"], shared_columns)
+                self.population = population
+                segment = None
+                if self.options["segment"]:
+                        segment_index = SegmentIndex(population)
+                        segment = segment_index.compile(self.options["segment"])
+                if self.next_consumer_id is None:
+                        self.next_consumer_id = int(population.consumer_id.max()) + 1 if len(population) > 0 else 1
+                dynamic_population = self.options["signup_rate_per_month"] > 0 or self.options["unsubscribe_rate_per_month"] > 0
+                telemetry = Telemetry((end_time.date() - current_time.date()).days, self.options["progress_interval_seconds"], self.options["metrics_path"])
                 
                 """
                 Start simulation that starts at current_time which is today - timedelta of simulation_time_days and lasts until today (end_time).
@@ -167,10 +446,15 @@ class Simulation:
                         Check for occuring dispatch and purchase dates. 
                         Update system and consumer states accordingly.
                         """
+                        campaign_rows = 0
                         if email_dispatch == True:
-                                campaign_opening_rate = self.email_dispatch(consumers, current_time, next_email, weekday_names)
+                                segment_rows = segment_index.select(segment) if segment is not None else None
+                                campaign_opening_rate, batch = self.email_dispatch(population, current_time, time_past, next_email, weekday_names, segment_rows)
+                                campaign_rows = len(batch)
+                                self.write_campaign_rows(batch)
                                 opening_rate += campaign_opening_rate
                                 self.opening_data.append((current_time.date(), campaign_opening_rate))
+                                self.campaign_counts.append((len(batch), int(np.count_nonzero(batch.columns["Öffnung"]))))
                                 total_mailings += 1
                                 self.mailings_per_month[year_month] += 1
                                 if total_mailings < len(mailing_list):
@@ -178,36 +462,140 @@ class Simulation:
                                         next_email = mailing_list[total_mailings][0]
 
                         if product_purchase == True:
-                                for buyer in purchase_list:
-                                        if buyer[1].strftime("%Y-%m-%d") == current_time.strftime("%Y-%m-%d"):
-                                                buyer[0].product_purchase = True
-                                                buyer[0].purchase_date = current_time.strftime("%Y-%m-%d")
-                                                self.purchases_per_month[year_month] += 1
-                                                total_purchases += 1
-                                        else: 
-                                                pass
+                                buyer_ids = []
+                                # The purchase list is sorted by date, so the buyers of the day follow the purchases so far
+                                while total_purchases < len(purchase_list) and purchase_list[total_purchases][1].strftime("%Y-%m-%d") == next_purchase_date:
+                                        buyer = purchase_list[total_purchases]
+                                        buyer[0].purchase_date = next_purchase_date
+                                        buyer_ids.append(buyer[0].consumerID)
+                                        self.purchases_per_month[year_month] += 1
+                                        total_purchases += 1
+                                population.record_purchase(buyer_ids, time_past)
                                         
                                 if total_purchases < len(purchase_list):
                                         next_purchase_date = purchase_list[total_purchases][1].strftime("%Y-%m-%d")
 
+                        if dynamic_population:
+                                self.update_population(population, current_time, year_month)
+
                         if total_mailings > 0:
                                 average_opening_rate = opening_rate / total_mailings
                                 self.global_opening_data.append((current_time.date(), average_opening_rate))
                                 average_timespan = time_past / total_mailings
                                 self.global_timespan_data.append((current_time.date(), average_timespan))
 
-                print(  "Anzahl Mailings: ", total_mailings,
-                        "\nÖffnungsrate: ", average_opening_rate, 
-                        "\nAnzahl Käufe: ", total_purchases, 
-                        "\nAnzahl Simulationstage: ", time_past,
-                        "\nDurschnittliche Zeitspanne zur letzten E-Mail: ", time_past / total_mailings,
-                        "\nMailings pro Monat: ", self.mailings_per_month,
-                        "\nKäufe pro Monat: ", self.purchases_per_month)
+                        telemetry.update(time_past, int(email_dispatch), campaign_rows)
+
+                telemetry.close()
+                if self.verbose:
+                        print(  "Anzahl Mailings: ", total_mailings,
+                                "\nÖffnungsrate: ", average_opening_rate, 
+                                "\nAnzahl Käufe: ", total_purchases, 
+                                "\nAnzahl Simulationstage: ", time_past,
+                                "\nDurschnittliche Zeitspanne zur letzten E-Mail: ", time_past / total_mailings,
+                                "\nMailings pro Monat: ", self.mailings_per_month,
+                                "\nKäufe pro Monat: ", self.purchases_per_month)
+                if dynamic_population and self.verbose:
+                        print(  "Anmeldungen pro Monat: ", self.signups_per_month,
+                                "\nAbmeldungen pro Monat: ", self.unsubscribes_per_month,
+                                "\nAbonnenten am Ende: ", len(population.active_index()))
                 
                 
                 yield env.timeout(1)
 
-        def initialize_simulation_parameters(self, simulation_time_days):
+        def update_population(self, population, current_time, year_month):
+                """ Lets consumers unsubscribe and adds new consumers at the current simulation day.
+                    Monthly rates are spread over the days of the month. New consumers are created in bulk.
+
+                Args
+                -------
+                population:     Population of the simulation.
+                current_time:   Current time in simulation.
+                year_month:     Current month of year.
+
+                Returns
+                -------
+                None
+                """
+                days_in_month = monthrange(current_time.year, current_time.month)[1]
+                active = population.active_index()
+                self.signups_per_month[year_month] = self.signups_per_month.get(year_month, 0)
+                self.unsubscribes_per_month[year_month] = self.unsubscribes_per_month.get(year_month, 0)
+
+                unsubscribe_probability = 1 - (1 - self.options["unsubscribe_rate_per_month"]) ** (1 / days_in_month)
+                unsubscribes = random_streams.binomial("unsubscribes", len(active), unsubscribe_probability)
+                if unsubscribes > 0:
+                        population.unsubscribe(random_streams.subset("unsubscribes", active, unsubscribes))
+                        self.unsubscribes_per_month[year_month] += unsubscribes
+
+                signups = random_streams.binomial("signups", len(active), self.options["signup_rate_per_month"] / days_in_month)
+                if signups > 0:
+                        columns = Consumer.generate_consumer_columns(signups, self.next_consumer_id)
+                        self.next_consumer_id += signups
+                        population.append(columns)
+                        if self.star_writer is not None:
+                                self.star_writer.write_consumer_columns(columns)
+                        self.signups_per_month[year_month] += signups
+
+        def output_writers(self):
+                """ Returns the configured outputs of the campaigns.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                writers: Dictionary of output names and functions that write a CampaignBatch.
+                """
+                writers = {}
+                if self.analysis_sampler is not None:
+                        # Rows are summarized by the samples and sketches instead of being kept in memory
+                        writers["analysis"] = self.analysis_sampler.write_batch
+                        if self.star_writer is not None:
+                                writers["star"] = self.star_writer.write_interactions
+                elif self.star_writer is None and self.campaign_batches is not None:
+                        # Campaigns are kept as column arrays, e.g. by the library API, which builds the dataset on demand
+                        writers["dataset"] = self.campaign_batches.append
+                elif self.star_writer is None and self.dataset_writer is not None:
+                        # Rows are written to the dataset file as they are produced, e.g. by a campaign program
+                        writers["dataset"] = self.dataset_writer.write_batch
+                elif self.star_writer is None:
+                        # Rows are kept in memory for data_analysis
+                        writers["dataset"] = lambda batch: self.synthetic_dataset.extend(batch.rows())
+                else:
+                        # Rows are kept in the star-schema tables only
+                        writers["star"] = self.star_writer.write_interactions
+                if self.feature_writer is not None:
+                        writers["ml"] = self.feature_writer.write_batch
+                if self.artifact_writer is not None:
+                        writers["artifact"] = self.artifact_writer.write_batch
+                if self.event_writer is not None:
+                        writers["events"] = self.event_writer.write_batch
+                if self.latent_writer is not None:
+                        writers["latent"] = self.latent_writer.write_batch
+                if self.delivery is not None:
+                        writers["delivery"] = self.delivery.deliver
+                return writers
+
+        def write_campaign_rows(self, batch):
+                """ Passes the current campaign to the configured outputs, through the writer threads if the output pipeline is running.
+
+                Args
+                -------
+                batch: CampaignBatch of the current campaign.
+
+                Returns
+                -------
+                None
+                """
+                if self.output is not None:
+                        self.output.submit(batch)
+                        return
+                for writer in self.output_writers().values():
+                        writer(batch)
+
+        def initialize_simulation_parameters(self, simulation_time_days, end_time=None):
                 """ Set initial system states. 
                     Set time step size and set simulation clock to 0.
                     Set counters to 0. 
@@ -215,6 +603,7 @@ class Simulation:
                 Args
                 -------
                 simulation_time_days: Amount of days for simulation period.
+                end_time: Optional end of the simulation period. Today if None.
 
                 Returns
                 -------
@@ -229,8 +618,10 @@ class Simulation:
                 product_purchase
                 """
 
-                end_time = datetime.now()
-                current_time = datetime.now() - timedelta(days=simulation_time_days)
+                if end_time is None:
+                        end_time = datetime.now()
+                self.end_time = end_time
+                current_time = end_time - timedelta(days=simulation_time_days)
                 email_dispatch = False
                 product_purchase = False
                 time_past = 0 # Counter
@@ -241,76 +632,74 @@ class Simulation:
 
                 return time_past, opening_rate, total_mailings, total_purchases, end_time, current_time, year_month, email_dispatch, product_purchase
                    
-        def email_dispatch(self, consumers, current_time, email, weekday_names):
+        def email_dispatch(self, population, current_time, current_day, email, weekday_names, index=None):
                 """ Timning routine for simulation time interval. 
+                    Opening reactions of all consumers are gathered from the precomputed opening table.
 
                 Args
                 -------
-                consumers, current_time, email, weekday_names
+                population, current_time, current_day, email, weekday_names
+                index:          Optional row indexes of the targeted segment. All subscribed consumers if None.
 
                 Returns
                 -------
                 opening_rate: Opening rate of current campaign.
+                batch: CampaignBatch with the rows of the current campaign.
                 """  
                 
-                opens = 0
-                for consumer in consumers:
-                        """
-                        Calculate mailing_frequency and timespan at current simulation time. 
-                        """
-                        consumer.mailing_frequency = Consumer.calculate_frequency(consumer.mailing_timestamps, current_time)
-                        consumer.timespan = Consumer.calculate_timespan(consumer.mailing_timestamps, current_time)
+                """
+                Calculate mailing_frequency and timespan of subscribed consumers at current simulation time. 
+                """
+                if index is None:
+                        index = population.active_index()
+                frequency = population.calculate_frequency(current_day, index)
+                timespan = population.calculate_timespan(current_day, index)
+                product_purchase = population.product_purchase[index]
+                prior_email_opening = population.prior_email_opening[index]
+                recent_openings = population.count_recent_openings(index, self.opening_table.history_window) if self.opening_table.history_window > 0 else 0
 
-                        """
-                        Calculate opening reaction of consumer to email. 
-                        """
-                        opening, personalization = self.calculate_opening(consumer, email)
+                """
+                Calculate opening reaction of consumers to email. 
+                """
+                opening, _ = self.opening_table.decide(email, population.perception_index[index], timespan, frequency, product_purchase, prior_email_opening, population.device[index], recent_openings)
+                opened = opening == 1
 
-                        """
-                        Create synthetic data row according to consumers reaction. 
-                        """
-                        if opening == 1.0:
-                                self.synthetic_dataset.append({"consumerID": consumer.consumerID, 
-                                                "Alter": consumer.age, 
-                                                "Geschlecht": consumer.gender, 
-                                                "Einkommen": consumer.income, 
-                                                "Informative Wahrnehmung": consumer.informative_perception,
-                                                "Frequenz": consumer.mailing_frequency,
-                                                "Zeitspanne vorherige E-Mail": consumer.timespan,
-                                                "Produktkauf": consumer.product_purchase,
-                                                "Öffnung vorherige E-Mail": consumer.prior_email_opening,
-                                                "Endgerät": consumer.device,
-                                                "emailID": email.emailID,
-                                                "Anzahl Wörter in Betreffzeile": email.length,
-                                                "Informationsgehalt": email.information_value,
-                                                "Personalisierung": personalization,
-                                                "Versandtag": weekday_names[current_time.weekday()],
-                                                "Simulationszeit": current_time,
-                                                "Öffnung": "Ja"})
-                                consumer.prior_email_opening = True
-                                opens += 1
-                        elif opening == 0.0:
-                                self.synthetic_dataset.append({"consumerID": consumer.consumerID, 
-                                                "Alter": consumer.age, 
-                                                "Geschlecht": consumer.gender,
-                                                "Einkommen": consumer.income, 
-                                                "Informative Wahrnehmung": consumer.informative_perception,
-                                                "Frequenz": consumer.mailing_frequency,
-                                                "Zeitspanne vorherige E-Mail": consumer.timespan,
-                                                "Produktkauf": consumer.product_purchase,
-                                                "Öffnung vorherige E-Mail": consumer.prior_email_opening,
-                                                "Endgerät": consumer.device,
-                                                "emailID": email.emailID,
-                                                "Anzahl Wörter in Betreffzeile": email.length,
-                                                "Informationsgehalt": email.information_value,
-                                                "Personalisierung": personalization,
-                                                "Versandtag": weekday_names[current_time.weekday()],
-                                                "Simulationszeit": current_time,
-                                                "Öffnung": "Nein"})
-                                consumer.prior_email_opening = False
-                        consumer.mailing_timestamps.append(current_time)
-                opening_rate = opens / len(consumers)
-                return opening_rate
+                """
+                Collect the columns of the synthetic data rows according to consumers reaction. 
+                Rows are built by the outputs.
+                """
+                batch = CampaignBatch({"consumerID": population.consumer_id[index],
+                                       "Alter": population.age[index],
+                                       "Geschlecht": population.gender[index],
+                                       "Einkommen": population.income[index],
+                                       "Informative Wahrnehmung": population.informative_perception[index],
+                                       "Frequenz": frequency,
+                                       "Zeitspanne vorherige E-Mail": timespan,
+                                       "Produktkauf": product_purchase,
+                                       "Öffnung vorherige E-Mail": prior_email_opening,
+                                       "Endgerät": population.device[index],
+                                       "Öffnung": opened}, email, weekday_names[current_time.weekday()], current_time)
+                population.record_opening(index, opened)
+                population.record_dispatch(index, current_day)
+                self.count_device_openings(np.bincount(population.device[index], minlength=len(DEVICE_CATEGORIES)), np.bincount(population.device[index][opened], minlength=len(DEVICE_CATEGORIES)))
+                opening_rate = np.count_nonzero(opened) / len(index) if len(index) > 0 else 0
+                return opening_rate, batch
+
+        def count_device_openings(self, recipients, openings):
+                """ Adds recipients and openings of a campaign to the counters per device.
+
+                Args
+                -------
+                recipients: Amount of recipients per device index.
+                openings: Amount of openings per device index.
+
+                Returns
+                -------
+                None
+                """
+                for device, device_recipients, device_openings in zip(DEVICE_CATEGORIES, recipients, openings):
+                        self.device_recipients[device] = self.device_recipients.get(device, 0) + int(device_recipients)
+                        self.device_openings[device] = self.device_openings.get(device, 0) + int(device_openings)
 
         def calculate_opening(self, consumer, email):
                 """ 
@@ -387,7 +776,7 @@ class Simulation:
 
                 return opening, personalization
 
-        def data_analysis(self, consumer_amount, dataset_path, unique_file_path):
+        def data_analysis(self, consumer_amount, dataset_path, unique_file_path, df=None):
                 """ 
                 Method to analyze synthetic dataset and save it at desired file path.
 
@@ -396,24 +785,159 @@ class Simulation:
                 consumer_amount:                Specified consumer amount.
                 dataset_path:                   Specified path to save synthetic dataset.
                 unique_file_path:               Specified path to save unique consumers of  synthetic dataset.
+                df:                             Optional synthetic dataset, e.g. merged from shards. Taken from the simulation if None.
 
                 Returns
                 -------
                 None
 
                 """  
-                df = pd.DataFrame(self.synthetic_dataset)
+                if df is not None:
+                        df = df.copy()
+                elif self.star_writer is not None:
+                        df = build_wide_view(self.star_writer.output_path)
+                else:
+                        df = pd.DataFrame(self.synthetic_dataset)
                 df["Simulationszeit"] = pd.to_datetime(df["Simulationszeit"])
 
                 """
-                Print stats and create unique_consumers, unique_mails dataset and auxiliary variables.
+                Create unique_consumers, unique_mails dataset and row counts of age per device.
                 """
                 unique_consumers = df.drop_duplicates("consumerID")
-                unique_consumers.to_csv(unique_file_path, index=False)
                 unique_mails = df.drop_duplicates("emailID")
-                day_order = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
-                unique_mails["Versandtag"] = pd.Categorical(unique_mails["Versandtag"], categories=day_order, ordered=True)
-                end_date = datetime.now()
+                device_ages = df.groupby(["Endgerät", "Alter"]).size()
+                self.create_report(consumer_amount, unique_consumers, unique_mails, device_ages, unique_file_path, self.path+"/results", self.end_time)
+
+                """             
+                Save synthetic dataset in desired path.
+                """
+
+                #df.to_csv(dataset_path, index=False)
+
+                print("DataFrame saved as CSV file at:", dataset_path)
+
+        def approximate_analysis(self, consumer_amount, unique_file_path):
+                """ 
+                Method to analyze the samples and sketches of the approximate analysis mode.
+                Prints the statistics of the consumer sample with 95% confidence intervals and saves the figures of data_analysis.
+                The sample of interactions is saved next to the sample of consumers.
+
+                Args
+                -------
+                consumer_amount:                Specified consumer amount.
+                unique_file_path:               Specified path to save the sampled consumers.
+
+                Returns
+                -------
+                None
+
+                """
+                sampler = self.analysis_sampler
+                unique_consumers = sampler.consumers.frame()
+                if unique_consumers.empty:
+                        raise ValueError("The approximate analysis has no rows to analyze.")
+                consumer_total, consumer_error = sampler.consumers.estimate_total()
+                interaction_path = os.path.join(os.path.dirname(unique_file_path), "sample_interactions.csv")
+                sampler.interactions.frame().to_csv(interaction_path, index=False)
+                print(  "Zeilen: ", sampler.rows,
+                        "\nKonsumenten (geschätzt): ", consumer_total, "± %.1f%%" % (100 * consumer_error),
+                        "\nStichprobe Konsumenten: ", len(unique_consumers),
+                        "\nStichprobe Interaktionen: ", len(sampler.interactions),
+                        "\nRelativer Fehler der Quantile Alter je Endgerät: ", sampler.device_ages[DEVICE_CATEGORIES[0]].accuracy)
+                correlation = correlation_interval(unique_consumers["Alter"], unique_consumers["Einkommen"], consumer_total)
+                for column in ["Einkommen", "Alter"]:
+                        statistics = describe_sample(unique_consumers[column], consumer_total)
+                        print(column, "(95%-Konfidenzintervalle)",
+                        "\nArithmetisches Mittel:", statistics["mean"],
+                        "\nStandardabweichung:", statistics["std"],
+                        "\nMedian:", statistics["median"],
+                        "\nSchiefe:", statistics["skewness"],
+                        "\nWölbung:", statistics["kurtosis"],
+                        "\nKorrelation:", correlation)
+                self.create_report(consumer_amount, unique_consumers, sampler.mail_frame(), sampler.device_age_counts(), unique_file_path, self.path+"/results", self.end_time, consumer_total / len(unique_consumers))
+                print("Interaction sample saved at:", interaction_path)
+
+        def analyze_run(self, run_path):
+                """ 
+                Method to analyze the artifacts of a stored run without loading the whole dataset.
+                Unique consumers and emails are collected shard by shard from the memory-mapped columns,
+                the age per device is counted per shard. Report files are saved in <run_path>/report.
+
+                Args
+                -------
+                run_path:                       Folder of the run artifacts.
+
+                Returns
+                -------
+                report_path:                    Folder of the report.
+
+                """
+                artifact = RunArtifact(run_path)
+                if artifact.manifest["rows"] == 0:
+                        raise ValueError("Run %s has no rows to analyze." % run_path)
+                artifact.restore(self)
+                unique_consumers = artifact.first_rows("consumerID")
+                unique_mails = artifact.first_rows("emailID")
+                device_ages = artifact.value_counts("Endgerät", "Alter")
+                report_path = os.path.join(run_path, "report")
+                os.makedirs(report_path, exist_ok=True)
+                self.create_report(artifact.manifest["parameters"]["consumer_amount"], unique_consumers, unique_mails, device_ages, os.path.join(report_path, "unique_customers.csv"), report_path, artifact.end_time)
+                return report_path
+
+        def device_age_boxes(self, device_ages):
+                """ 
+                Computes the box plot statistics of the age per device from row counts.
+
+                Args
+                -------
+                device_ages:                    Series of row counts with an (Endgerät, Alter) index.
+
+                Returns
+                -------
+                boxes:                          List of box statistics for Axes.bxp.
+
+                """
+                boxes = []
+                devices = device_ages.index.get_level_values(0)
+                for device in [device for device in DEVICE_CATEGORIES if device in devices]:
+                        counts = device_ages.xs(device, level=0).sort_index()
+                        ages = counts.index.to_numpy(dtype=float)
+                        shares = np.cumsum(counts.to_numpy()) / counts.sum()
+                        first_quartile, median, third_quartile = [ages[np.searchsorted(shares, quantile)] for quantile in [0.25, 0.5, 0.75]]
+                        whisker = 1.5 * (third_quartile - first_quartile)
+                        inside = ages[(ages >= first_quartile - whisker) & (ages <= third_quartile + whisker)]
+                        boxes.append({"label": device, "med": median, "q1": first_quartile, "q3": third_quartile,
+                                      "whislo": inside.min(), "whishi": inside.max(),
+                                      "fliers": ages[(ages < inside.min()) | (ages > inside.max())]})
+                return boxes
+
+        def create_report(self, consumer_amount, unique_consumers, unique_mails, device_ages, unique_file_path, figure_path, end_date=None, consumer_weight=1.0):
+                """ 
+                Prints the statistics of the synthetic dataset and saves the figures.
+
+                Args
+                -------
+                consumer_amount:                Specified consumer amount.
+                unique_consumers:               First row of every consumer of the synthetic dataset.
+                unique_mails:                   First row of every email of the synthetic dataset.
+                device_ages:                    Series of row counts with an (Endgerät, Alter) index.
+                unique_file_path:               Specified path to save unique consumers of  synthetic dataset.
+                figure_path:                    Folder of the figures.
+                end_date:                       End of the simulation period. Today if None.
+                consumer_weight:                Amount of consumers represented by every row of unique_consumers, e.g. of a consumer sample.
+
+                Returns
+                -------
+                None
+
+                """
+                """
+                Print stats and save unique_consumers and auxiliary variables.
+                """
+                unique_consumers.to_csv(unique_file_path, index=False)
+                unique_mails = unique_mails.copy()
+                if end_date is None:
+                        end_date = datetime.now()
                 start_date = end_date - timedelta(days=365)
                 all_months_time = []
                 while start_date <= end_date:
@@ -454,7 +978,7 @@ class Simulation:
                 plt.xlabel("Simulationszeit")
                 plt.ylabel("Durchschnittliche Zeitspanne")
                 plt.xticks(all_months_time, all_month_labels)
-                plt.savefig(self.path+"/results/timespan.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/timespan.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
 
@@ -471,7 +995,7 @@ class Simulation:
                 plt.xlabel("Simulationszeit")
                 plt.ylabel("Öffnungsrate")
                 plt.xticks(all_months_time, all_month_labels)
-                plt.savefig(self.path+"/results/opening_rate.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/opening_rate.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
                 
@@ -493,7 +1017,7 @@ class Simulation:
                 ax2.set_ylabel("Produktkäufe", color=color_second)
                 ax2.tick_params("y", colors=color_second)
                 plt.xticks(rotation=90) 
-                plt.savefig(self.path+"/results/frequencies.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/frequencies.png", dpi=300, bbox_inches='tight')
                 plt.show()
                          
                 ###########################          VISUALIZATION OF STATIC CONSUMER ATTRIBUTES.           ###########################
@@ -506,11 +1030,11 @@ class Simulation:
                 age = [21, 29.5, 39.5, 49.5, 59.5, 69.5]
                 plt.figure(figsize=(6, 4))
                 plt.plot(age, proportions_age, marker="o", linestyle="-", color=color_second)
-                plt.hist(unique_consumers["Alter"], bins=100, color=color_first)
+                plt.hist(unique_consumers["Alter"], bins=100, weights=np.full(len(unique_consumers), consumer_weight), color=color_first)
                 plt.xlabel("Alter")
                 plt.ylabel("Anzahl")
                 plt.title("Verteilung des Alters")
-                plt.savefig(self.path+"/results/age.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/age.png", dpi=300, bbox_inches='tight')
                 plt.show()
                 
 
@@ -521,11 +1045,11 @@ class Simulation:
                 plt.figure(figsize=(6, 4))
                 proportions_income = [0.22*consumer_amount/10*2, 0.31*consumer_amount/10*2, 0.21*consumer_amount/10*2, 0.1*consumer_amount/10*2, 0.07*consumer_amount/10*2, 0]
                 plt.plot(income, proportions_income, marker="o", linestyle="-", color=color_second, label="Beispielunternehmen")
-                plt.hist(unique_consumers["Einkommen"], bins="auto", color=color_first, label="Simulationsmodell")
+                plt.hist(unique_consumers["Einkommen"], bins=np.histogram_bin_edges(unique_consumers["Einkommen"], bins="auto"), weights=np.full(len(unique_consumers), consumer_weight), color=color_first, label="Simulationsmodell")
                 plt.xlabel("Einkommen")
                 plt.ylabel("Anzahl")
                 plt.title("Verteilung des Einkommens")
-                plt.savefig(self.path+"/results/income.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/income.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
                 """             
@@ -535,23 +1059,22 @@ class Simulation:
                 h = sns.jointplot(x="Alter", y="Einkommen", data=unique_consumers, height=6)
                 h.set_axis_labels("Alter", "Einkommen", fontsize=14)
                 h.plot_marginals(sns.rugplot)
-                plt.savefig(self.path+"/results/age_income_correlation.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/age_income_correlation.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
                 """
                 Visualization of age distributions and device usage in synthetic dataset.
                 """
-                plt.figure(figsize=(12, 4))
-                sns.boxplot(x="Endgerät", y="Alter", data=df)
+                fig, ax = plt.subplots(figsize=(12, 4))
+                ax.bxp(self.device_age_boxes(device_ages), patch_artist=True, boxprops={"facecolor": color_first})
                 plt.xlabel("Endgerät")
                 plt.ylabel("Alter")
-                plt.savefig(self.path+"/results/devices_age.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/devices_age.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
 
 
                 ###########################          VISUALIZATION OF EMAIL ATTRIBUTES.           ###########################
-                unique_mails = df.drop_duplicates("emailID")
                 subject_line_length = "Anzahl Wörter in Betreffzeile"
                 sending_day = "Versandtag"
                 day_order = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
@@ -570,7 +1093,7 @@ class Simulation:
                 ax.set_xlabel("Anzahl Wörter")
                 ax.set_ylabel("Anzahl")
                 plt.tight_layout()
-                plt.savefig(self.path+"/results/subject_line.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/subject_line.png", dpi=300, bbox_inches='tight')
                 plt.show()
 
 
@@ -588,17 +1111,120 @@ class Simulation:
                 ax.set_ylabel("Anzahl")
 
                 plt.tight_layout()
-                plt.savefig(self.path+"/results/sending_day.png", dpi=300, bbox_inches='tight')
+                plt.savefig(figure_path+"/sending_day.png", dpi=300, bbox_inches='tight')
                 plt.show()
-                
-
-                """             
-                Save synthetic dataset in desired path.
-                """
-
-                #df.to_csv(dataset_path, index=False)
-
-                print("DataFrame saved as CSV file at:", dataset_path)
 
 if __name__ == "__main__":
-        simulation = Simulation()
\ No newline at end of file
+        parser = argparse.ArgumentParser(description="Synthetic E-Mail Dataset Simulator. Without command, the interactive simulation is started.")
+        subparsers = parser.add_subparsers(dest="command")
+        plan_parser = subparsers.add_parser("plan", help="Split a run into consumer-ID-range shards.")
+        plan_parser.add_argument("job_path", help="Folder of the job on a shared filesystem.")
+        plan_parser.add_argument("--shards", type=int, required=True, help="Amount of shards.")
+        plan_parser.add_argument("--seed", type=int, default=0, help="Master seed of the run.")
+        shard_parser = subparsers.add_parser("run-shard", help="Run one shard of a planned job.")
+        shard_parser.add_argument("manifest", help="Path of the job manifest.")
+        shard_parser.add_argument("shard", type=int, help="Index of the shard.")
+        merge_parser = subparsers.add_parser("merge", help="Merge the shards of a planned job.")
+        merge_parser.add_argument("manifest", help="Path of the job manifest.")
+        merge_parser.add_argument("--analysis", action="store_true", help="Analyze the merged dataset.")
+        calibrate_parser = subparsers.add_parser("calibrate", help="Fit the opening-model coefficients to target opening rates.")
+        calibrate_parser.add_argument("targets", help="JSON file with target opening rates (overall, month, device).")
+        calibrate_parser.add_argument("--parameters", nargs="+", default=["intercept"], help="Coefficients to fit, e.g. intercept device sending_day.")
+        calibrate_parser.add_argument("--tolerance", type=float, default=0.005, help="Highest accepted absolute deviation per target.")
+        calibrate_parser.add_argument("--max-evaluations", type=int, default=500, help="Highest amount of evaluated coefficient sets.")
+        calibrate_parser.add_argument("--seed", type=int, default=0, help="Seed of cohorts, calendars and purchases.")
+        calibrate_parser.add_argument("--replications", type=int, default=5, help="Amount of calendars averaged per evaluation.")
+        calibrate_parser.add_argument("--output", default="/results/calibration.json", help="Output file relative to the simulation folder.")
+        analyze_parser = subparsers.add_parser("analyze", help="Analyze the artifacts of a stored run without loading the whole dataset.")
+        analyze_parser.add_argument("run_path", help="Folder of the run artifacts, e.g. results/runs/<run>.")
+        rescore_parser = subparsers.add_parser("rescore", help="Recompute the openings of a run with stored latent states with the configured opening model.")
+        rescore_parser.add_argument("latent_path", help="Folder of the latent states of the run.")
+        rescore_parser.add_argument("--output", default="/results/rescored", help="Output folder relative to the simulation folder.")
+        rescore_parser.add_argument("--analysis", action="store_true", help="Analyze the re-scored dataset.")
+        programs_parser = subparsers.add_parser("programs", help="Run several campaign programs on one shared population.")
+        programs_parser.add_argument("programs", help="JSON file with the list of campaign programs.")
+        programs_parser.add_argument("output_path", help="Folder of the program outputs.")
+        programs_parser.add_argument("--processes", type=int, default=0, help="Amount of processes, one per program if 0.")
+        programs_parser.add_argument("--seed", type=int, default=0, help="Master seed of the population and the programs.")
+        model_parser = subparsers.add_parser("model", help="Check the configured opening model and save its spec.")
+        model_parser.add_argument("--max-frequency", type=int, default=30, help="Highest mailing frequency in 30 days of the checked table.")
+        model_parser.add_argument("--output", default="/results/opening_model.json", help="Output file relative to the simulation folder.")
+        arguments = parser.parse_args()
+
+        if arguments.command is None:
+                simulation = Simulation()
+        elif arguments.command == "plan":
+                simulation = Simulation(interactive=False)
+                print("Manifest saved at:", sharding.plan(simulation, arguments.shards, arguments.job_path, arguments.seed))
+        elif arguments.command == "run-shard":
+                simulation = Simulation(interactive=False)
+                print("Shard saved at:", sharding.run_shard(simulation, arguments.manifest, arguments.shard))
+        elif arguments.command == "merge":
+                simulation = Simulation(interactive=False)
+                consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = simulation.read_ini(simulation.path+"/config.cfg")
+                sharding.merge(simulation, arguments.manifest, dataset_path)
+                print("DataFrame saved as CSV file at:", dataset_path)
+                if arguments.analysis:
+                        unique_consumers, unique_mails, device_ages = sharding.merged_report(arguments.manifest)
+                        simulation.create_report(len(unique_consumers), unique_consumers, unique_mails, device_ages, unique_file_path, simulation.path+"/results", simulation.end_time)
+        elif arguments.command == "calibrate":
+                simulation = Simulation(interactive=False)
+                if simulation.options["opening_model"] is not None:
+                        raise ValueError("Calibration fits the coefficients of calculate_opening and cannot be combined with OPENING_MODEL_PATH.")
+                consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = simulation.read_ini(simulation.path+"/config.cfg")
+                with open(arguments.targets, encoding="utf-8") as file:
+                        targets = json.load(file)
+                calibration = Calibration(simulation, consumer_amount, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, simulation_time_days, timestep_size, arguments.seed, arguments.replications)
+                result = calibration.fit(targets, arguments.parameters, arguments.tolerance, arguments.max_evaluations, initial_coefficients=simulation.options["opening_coefficients"])
+                output_path = simulation.path+arguments.output
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                with open(output_path, "w", encoding="utf-8") as file:
+                        json.dump(result, file, indent=4, ensure_ascii=False)
+                print(  "Koeffizienten: ", result["coefficients"],
+                        "\nKonvergiert: ", result["fit"]["converged"],
+                        "\nMaximale Abweichung: ", result["fit"]["max_deviation"],
+                        "\nAuswertungen: ", result["fit"]["evaluations"],
+                        "\nAbweichungen: ", result["fit"]["deviations"])
+                print("Calibration saved at:", output_path)
+        elif arguments.command == "analyze":
+                simulation = Simulation(interactive=False)
+                print("Report saved at:", simulation.analyze_run(arguments.run_path))
+        elif arguments.command == "rescore":
+                simulation = Simulation(interactive=False)
+                start = time.perf_counter()
+                df, changed = rescore.rescore(simulation, arguments.latent_path, simulation.path+arguments.output)
+                opening_rate = np.mean([rate for _, rate in simulation.opening_data]) if simulation.opening_data else 0
+                print(  "Anzahl Mailings: ", len(simulation.opening_data),
+                        "\nÖffnungsrate: ", opening_rate,
+                        "\nGeänderte Öffnungen: ", changed,
+                        "\nDauer (s): ", time.perf_counter() - start)
+                print("Rescored dataset saved at:", simulation.path+arguments.output)
+                if arguments.analysis:
+                        consumer_amount, simulation_time_days, timestep_size, weekday_names, mailing_frequency_per_month, buying_frequency_per_month, share_buyers, dataset_path, unique_file_path = simulation.read_ini(simulation.path+"/config.cfg")
+                        simulation.data_analysis(len(df["consumerID"].unique()), dataset_path, unique_file_path, df)
+        elif arguments.command == "programs":
+                simulation = Simulation(interactive=False)
+                summary = programs.run_programs(simulation, programs.read_programs(arguments.programs), arguments.output_path, arguments.seed, arguments.processes)
+                for report in summary["programs"]:
+                        print(  "Programm: ", report["name"],
+                                "\nAnzahl Mailings: ", report["mailings"],
+                                "\nÖffnungsrate: ", report["opening_rate"],
+                                "\nAnzahl Käufe: ", report["purchases"],
+                                "\nPrivater Zustand der Population (MB): ", report["private_bytes"] / 2**20,
+                                "\nSpitzen-RSS des Prozesses (MB): ", report["peak_rss_bytes"] / 2**20)
+                print(  "Gemeinsame Population (MB): ", summary["shared_bytes"] / 2**20,
+                        "\nPrivate Zustände der Populationen gesamt (MB): ", summary["private_bytes"] / 2**20,
+                        "\nSpitzen-RSS der Prozesse gesamt (MB): ", summary["peak_rss_bytes"] / 2**20)
+                print("Programs saved at:", arguments.output_path)
+        elif arguments.command == "model":
+                simulation = Simulation(interactive=False)
+                opening_table = OpeningTable(arguments.max_frequency, simulation.options["opening_coefficients"], simulation.options["opening_history_window"], simulation.options["opening_model"])
+                opening_table.verify(simulation)
+                output_path = simulation.path+arguments.output
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                with open(output_path, "w", encoding="utf-8") as file:
+                        json.dump(opening_table.spec, file, indent=4)
+                print(  "Tabellengröße: ", opening_table.decision.shape,
+                        "\nBetreffzeilenlängen: ", opening_table.length_values,
+                        "\nZeitspannen: ", opening_table.timespan_values)
+                print("Opening model saved at:", output_path)
@@ -0,0 +1,145 @@
+import os
+import csv
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from consumer import GENDER_CATEGORIES, DEVICE_CATEGORIES
+
+"""
+Normalized star-schema output of the synthetic dataset.
+
+Instead of repeating all static consumer and email attributes in every row, the
+dataset is written as
+- consumers.csv:        consumer dimension table, one row per consumer
+- emails.csv:           email dimension table, one row per email
+- interactions.csv:     narrow fact table, one row per dispatched email and consumer
+build_wide_view joins the tables back into the wide synthetic dataset on demand. The
+simulation time of a row is the dispatch time of its email, and the personalization
+follows from the product purchase, so neither is repeated in the fact table.
+"""
+
+CONSUMER_COLUMNS = ["consumerID", "Alter", "Geschlecht", "Einkommen", "Informative Wahrnehmung", "Endgerät"]
+EMAIL_COLUMNS = ["emailID", "Anzahl Wörter in Betreffzeile", "Informationsgehalt", "Versandtag", "Versanddatum", "Simulationszeit"]
+INTERACTION_COLUMNS = ["consumerID", "emailID", "Frequenz", "Zeitspanne vorherige E-Mail", "Produktkauf", "Öffnung vorherige E-Mail", "Öffnung"]
+WIDE_COLUMNS = ["consumerID", "Alter", "Geschlecht", "Einkommen", "Informative Wahrnehmung", "Frequenz", "Zeitspanne vorherige E-Mail", "Produktkauf", "Öffnung vorherige E-Mail", "Endgerät", "emailID", "Anzahl Wörter in Betreffzeile", "Informationsgehalt", "Personalisierung", "Versandtag", "Simulationszeit", "Öffnung"]
+
+class StarSchemaWriter:
+        def __init__(self, output_path):
+                """
+                Initilizes the writer and opens the consumers and interactions tables for appending.
+
+                Args
+                -------
+                output_path:            Folder to write the star-schema tables to.
+
+                Returns
+                -------
+                None
+
+                """
+                self.output_path = output_path
+                os.makedirs(self.output_path, exist_ok=True)
+                self.consumers_file = open(os.path.join(self.output_path, "consumers.csv"), "w", newline="", encoding="utf-8")
+                self.consumers = csv.writer(self.consumers_file)
+                self.consumers.writerow(CONSUMER_COLUMNS)
+                self.interactions_file = open(os.path.join(self.output_path, "interactions.csv"), "w", newline="", encoding="utf-8")
+                self.interactions = csv.writer(self.interactions_file)
+                self.interactions.writerow(INTERACTION_COLUMNS)
+
+        def write_consumers(self, consumers):
+                """
+                Writes consumers to the consumer dimension table.
+
+                Args
+                -------
+                consumers:              List of consumers in simulation.
+
+                Returns
+                -------
+                None
+
+                """
+                self.consumers.writerows((consumer.consumerID, consumer.age, consumer.gender, consumer.income, consumer.informative_perception, consumer.device) for consumer in consumers)
+
+        def write_consumer_columns(self, columns):
+                """
+                Writes consumers created in bulk, e.g. signups, to the consumer dimension table.
+
+                Args
+                -------
+                columns:                Dictionary of columns created by Consumer.generate_consumer_columns.
+
+                Returns
+                -------
+                None
+
+                """
+                self.consumers.writerows(zip(columns["consumer_id"].tolist(), columns["age"].tolist(), [GENDER_CATEGORIES[gender] for gender in columns["gender"]],
+                                             columns["income"].tolist(), columns["informative_perception"].tolist(), [DEVICE_CATEGORIES[device] for device in columns["device"]]))
+
+        def write_emails(self, mailing_list, weekday_names, end_time):
+                """
+                Writes the email dimension table once.
+
+                Args
+                -------
+                mailing_list:           List of email dispatch dates with Email_Object objects.
+                weekday_names:          Weekday names to match with weekday numbers of datetime.
+                end_time:               End of the simulation period. Campaigns are dispatched at its time of day.
+
+                Returns
+                -------
+                None
+
+                """
+                with open(os.path.join(self.output_path, "emails.csv"), "w", newline="", encoding="utf-8") as file:
+                        writer = csv.writer(file)
+                        writer.writerow(EMAIL_COLUMNS)
+                        writer.writerows((email.emailID, email.length, email.information_value, weekday_names[email.sending_day], date, datetime.combine(datetime.strptime(date, "%Y-%m-%d").date(), end_time.time()))
+                                         for email, date in mailing_list)
+
+        def write_interactions(self, batch):
+                """
+                Appends a campaign to the narrow interactions fact table, straight from the column arrays of the batch.
+
+                Args
+                -------
+                batch:                  CampaignBatch of the campaign.
+
+                Returns
+                -------
+                None
+
+                """
+                columns = batch.columns
+                opening = np.where(columns["Öffnung"], "Ja", "Nein")
+                self.interactions.writerows(zip(columns["consumerID"].tolist(), repeat(batch.email_id, len(batch)), columns["Frequenz"].tolist(), columns["Zeitspanne vorherige E-Mail"].tolist(),
+                                                columns["Produktkauf"].tolist(), columns["Öffnung vorherige E-Mail"].tolist(), opening.tolist()))
+
+        def close(self):
+                """ Closes the consumers and interactions tables."""
+                self.consumers_file.close()
+                self.interactions_file.close()
+
+def build_wide_view(output_path):
+        """
+        Rebuilds the wide synthetic dataset from the star-schema tables.
+
+        Args
+        -------
+        output_path:                    Folder of the star-schema tables.
+
+        Returns
+        -------
+        df:                             Wide synthetic dataset with the columns of the denormalized rows.
+
+        """
+        consumers = pd.read_csv(os.path.join(output_path, "consumers.csv"))
+        emails = pd.read_csv(os.path.join(output_path, "emails.csv"), parse_dates=["Simulationszeit"]).drop(columns=["Versanddatum"])
+        interactions = pd.read_csv(os.path.join(output_path, "interactions.csv"))
+        personalization = np.full(len(interactions), False, dtype=object)
+        personalization[interactions["Produktkauf"].to_numpy(dtype=bool)] = "Produktbasierte Personalisierung"
+        interactions["Personalisierung"] = personalization
+        df = interactions.merge(consumers, on="consumerID", how="left").merge(emails, on="emailID", how="left")
+        return df[WIDE_COLUMNS]
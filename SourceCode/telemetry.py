@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+from datetime import timedelta
+
+"""
+Progress and throughput telemetry of a simulation run.
+
+The simulation reports its state once per simulated day (update), which costs a
+few additions and one clock read. Progress lines and the metrics file are only
+written when the configured interval has elapsed, so the dispatch itself is not
+affected. The metrics file uses the Prometheus text format and is replaced
+atomically, so that the textfile collector of a node exporter never reads a
+partially written file.
+"""
+
+METRIC_PREFIX = "email_simulation"
+METRICS = [("simulated_days", "gauge", "Simulated days."),
+           ("total_days", "gauge", "Days of the simulation period."),
+           ("campaigns_total", "counter", "Dispatched campaigns."),
+           ("rows_total", "counter", "Rows (dispatched emails) of the synthetic dataset."),
+           ("rows_per_second", "gauge", "Average rows per second since the start of the run."),
+           ("eta_seconds", "gauge", "Estimated seconds until the end of the run."),
+           ("resident_memory_bytes", "gauge", "Resident set size of the process."),
+           ("elapsed_seconds", "gauge", "Seconds since the start of the run.")]
+
+def resident_memory():
+        """
+        Returns the resident set size of the process. Falls back to the peak resident set size where /proc is not available.
+
+        Args
+        -------
+        None
+
+        Returns
+        -------
+        rss:                            Resident set size in bytes.
+
+        """
+        try:
+                with open("/proc/self/statm") as file:
+                        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+                return peak_memory()
+
+def peak_memory():
+        """
+        Returns the peak resident set size of the process.
+
+        Args
+        -------
+        None
+
+        Returns
+        -------
+        rss:                            Peak resident set size in bytes.
+
+        """
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class Telemetry:
+        def __init__(self, total_days, interval_seconds=10, metrics_path=""):
+                """
+                Initilizes the class and starts the clock of the run.
+
+                Args
+                -------
+                total_days:             Days of the simulation period.
+                interval_seconds:       Seconds between progress lines and refreshes of the metrics file. 0 disables the telemetry.
+                metrics_path:           File for the Prometheus metrics. Empty disables the metrics file.
+
+                Returns
+                -------
+                None
+
+                """
+                self.total_days = total_days
+                self.interval_seconds = interval_seconds
+                self.metrics_path = metrics_path
+                self.start = time.monotonic()
+                self.last_report = self.start
+                self.day = 0
+                self.campaigns = 0
+                self.rows = 0
+
+        def update(self, day, campaigns=0, rows=0):
+                """
+                Adds the campaigns and rows of a simulated day and reports if the interval has elapsed.
+
+                Args
+                -------
+                day:                    Current day in simulation.
+                campaigns:              Amount of campaigns dispatched at the day.
+                rows:                   Amount of rows created at the day.
+
+                Returns
+                -------
+                None
+
+                """
+                self.day = day
+                self.campaigns += campaigns
+                self.rows += rows
+                if self.interval_seconds > 0 and time.monotonic() - self.last_report >= self.interval_seconds:
+                        self.report()
+
+        def snapshot(self):
+                """
+                Computes the current metrics.
+
+                Args
+                -------
+                None
+
+                Returns
+                -------
+                metrics:                Dictionary of metric names and values.
+
+                """
+                elapsed = time.monotonic() - self.start
+                eta = elapsed * (self.total_days - self.day) / self.day if self.day > 0 else 0
+                return {"simulated_days": self.day,
+                        "total_days": self.total_days,
+                        "campaigns_total": self.campaigns,
+                        "rows_total": self.rows,
+                        "rows_per_second": self.rows / elapsed if elapsed > 0 else 0,
+                        "eta_seconds": max(eta, 0),
+                        "resident_memory_bytes": resident_memory(),
+                        "elapsed_seconds": elapsed}
+
+        def report(self):
+                """ Prints a progress line and refreshes the metrics file."""
+                self.last_report = time.monotonic()
+                metrics = self.snapshot()
+                print("Fortschritt: Tag %d/%d (%.1f%%) | Kampagnen: %d | Zeilen/s: %.0f | Restzeit: %s | RSS: %.1f MB" % (
+                        metrics["simulated_days"], metrics["total_days"], 100 * metrics["simulated_days"] / max(metrics["total_days"], 1),
+                        metrics["campaigns_total"], metrics["rows_per_second"], timedelta(seconds=round(metrics["eta_seconds"])),
+                        metrics["resident_memory_bytes"] / 2**20), flush=True)
+                if self.metrics_path:
+                        self.write_metrics(metrics)
+
+        def write_metrics(self, metrics):
+                """
+                Writes the metrics in the Prometheus text format to a temporary file and replaces the metrics file with it.
+
+                Args
+                -------
+                metrics:                Dictionary of metric names and values.
+
+                Returns
+                -------
+                None
+
+                """
+                lines = []
+                for name, metric_type, description in METRICS:
+                        lines += ["# HELP %s_%s %s" % (METRIC_PREFIX, name, description),
+                                  "# TYPE %s_%s %s" % (METRIC_PREFIX, name, metric_type),
+                                  "%s_%s %s" % (METRIC_PREFIX, name, repr(float(metrics[name])))]
+                os.makedirs(os.path.dirname(os.path.abspath(self.metrics_path)), exist_ok=True)
+                temporary_path = self.metrics_path + ".tmp"
+                with open(temporary_path, "w", encoding="utf-8") as file:
+                        file.write("\n".join(lines) + "\n")
+                os.replace(temporary_path, self.metrics_path)
+
+        def close(self):
+                """ Reports the final state of the run."""
+                if self.interval_seconds > 0:
+                        self.report()